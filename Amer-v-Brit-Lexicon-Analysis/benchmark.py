@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# # Benchmark suite
+#
+# Measures every stage of the pipeline on a synthetic corpus (see synthetic_ngrams.py), so that the effect of a change to
+# `preprocess_ngrams`, `create_lexicon.main` or the birth and death analysis can be measured without the real shards:
+# 1. `preprocess`: `preprocess.py`, raw 1-gram shards to `-preprocessed.pickle`
+# 2. `complete`: `LexiconSize/preprocess_complete_lemmatization2.py`, raw 1-gram shards to `-COMPLETE.json`
+# 3. `store`: `ngram_store.py`, the preprocessed files to `.store` directories
+# 4. `lexicon`: `create_lexicon.main()` over one window (it reads the stores written by the previous stage)
+# 5. `birth_death`: `birth_death.py` over every part of speech of the `-COMPLETE.json` files
+# 6. `cluster`: `LexemeClustering/cluster_5grams.py`, raw 5-gram shards to `_CLUSTERED.json`
+# 7. `census`: `LexiconSize/lexicon_census.py`, the years x tags census of the raw 1-gram shards (one shard after the other, in this process)
+#
+# Each corpus has its own directory in the work directory (e.g. `1grams-2x100000-seed0/`), where the stages write their outputs.
+# Each stage reads the outputs of the ones before it. Every run of a stage is done in a new process, so its peak resident set size is its own
+# (and the lemma cache starts cold every time). The suite reports rows (or ngrams) per second of the best run, the wall time of every run
+# and the peak RSS, and saves them with the parameters of the corpus, the machine and the git commit in `benchmarks/<label>.json`
+# in the work directory. Two saved runs can then be compared stage by stage.
+#
+# Usage:
+# `python benchmark.py C:\path\to\work\` generates the corpus (only the first time) and benchmarks every stage 3 times
+# `python benchmark.py C:\path\to\work\ --stages preprocess complete --rows 500000 -r 5 -o blocks`
+# `python benchmark.py --compare C:\path\to\work\benchmarks\baseline.json C:\path\to\work\benchmarks\blocks.json`
+
+import os
+import sys
+import json
+import time
+import platform
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+
+from synthetic_ngrams import ensure_corpus
+
+REPO = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+RESULTS = 'benchmarks/'
+#Stages in the order they have to run, with the unit of their throughput
+STAGES = {'preprocess':'row', 'complete':'row', 'store':'ngram', 'lexicon':'ngram', 'birth_death':'ngram', 'cluster':'row', 'census':'row'}
+WINDOW = (1851, 1900, 1)
+
+def peak_rss():
+    #Peak resident set size of this process in bytes, None where it cannot be read
+    try:
+        import resource
+    except ImportError:
+        return _windows_peak_rss()
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    #ru_maxrss is in bytes on macOS and in kilobytes everywhere else
+    return peak if sys.platform == 'darwin' else peak*1024
+
+def _windows_peak_rss():
+    try:
+        import ctypes
+        from ctypes import wintypes
+    except ImportError:
+        return None
+
+    class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+        _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD),
+                    ('PeakWorkingSetSize', ctypes.c_size_t), ('WorkingSetSize', ctypes.c_size_t),
+                    ('QuotaPeakPagedPoolUsage', ctypes.c_size_t), ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                    ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t), ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                    ('PagefileUsage', ctypes.c_size_t), ('PeakPagefileUsage', ctypes.c_size_t)]
+    counters = PROCESS_MEMORY_COUNTERS()
+    counters.cb = ctypes.sizeof(counters)
+    try:
+        process = ctypes.windll.kernel32.GetCurrentProcess()
+        if not ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+            return None
+    except (AttributeError, OSError):
+        return None
+    return counters.PeakWorkingSetSize
+
+def _require(directory, suffix, stage):
+    if not any(file_name.endswith(suffix) for file_name in os.listdir(directory)):
+        raise ValueError('No '+suffix+' file in '+directory+', run the '+stage+' stage first')
+
+def _shards(directory):
+    from parallel_preprocess import list_shards
+    return list_shards(directory)
+
+def corpus_directory(work, n, shards, rows, seed):
+    return work+str(n)+'grams-'+str(shards)+'x'+str(rows)+'-seed'+str(seed)+'/'
+
+def run_preprocess(unigrams, pentagrams):
+    from preprocess import preprocess_ngrams, save_pickle
+    for file_path in _shards(unigrams):
+        save_pickle(preprocess_ngrams(unigrams, file_path), unigrams, file_path)
+
+def run_complete(unigrams, pentagrams):
+    sys.path.append(os.path.join(REPO, 'LexiconSize'))
+    from preprocess_complete_lemmatization2 import preprocess_ngrams
+    for file_path in _shards(unigrams):
+        preprocess_ngrams(unigrams, file_path)
+
+def run_store(unigrams, pentagrams):
+    from ngram_store import convert_directory
+    _require(unigrams, '-COMPLETE.json', 'complete')
+    convert_directory(unigrams, overwrite=True)
+
+def run_lexicon(unigrams, pentagrams):
+    import create_lexicon
+    _require(unigrams, '-COMPLETE.json', 'complete')
+    create_lexicon.main(unigrams, *WINDOW)
+
+def run_birth_death(unigrams, pentagrams):
+    from birth_death import analyze_directory
+    from create_lexicon import save_json
+    _require(unigrams, '-COMPLETE.json', 'complete')
+    save_json(analyze_directory(unigrams, '-COMPLETE.json'), unigrams, 'BIRTH_DEATH_BENCHMARK')
+
+def run_cluster(unigrams, pentagrams):
+    sys.path.append(os.path.join(REPO, 'LexemeClustering'))
+    from cluster_5grams import cluster_shard
+    for file_path in _shards(pentagrams):
+        cluster_shard(pentagrams, file_path)
+
+def run_census(unigrams, pentagrams):
+    sys.path.append(os.path.join(REPO, 'LexiconSize'))
+    from lexicon_census import census_shard
+    shards = _shards(unigrams)
+    census = census_shard(unigrams, shards[0])
+    for file_path in shards[1:]:
+        census += census_shard(unigrams, file_path)
+    census.save(unigrams+'census-benchmark.npz')
+
+def _run_stage(stage, unigrams, pentagrams):
+    #Runs in a new worker process, returns the wall time and the peak RSS of that process
+    run = globals()['run_'+stage]
+    start = time.perf_counter()
+    run(unigrams, pentagrams)
+    return time.perf_counter()-start, peak_rss()
+
+def count_ngrams(directory):
+    #Number of ngrams in the -COMPLETE.json files of directory (read from their stores when they have one)
+    from ngram_store import store_path_for
+    n_ngrams = 0
+    for file_name in os.listdir(directory):
+        if file_name.endswith('-COMPLETE.json'):
+            meta_path = os.path.join(store_path_for(directory, file_name), 'meta.json')
+            with open(meta_path if os.path.exists(meta_path) else directory+file_name, 'r') as f:
+                meta = json.load(f)
+            n_ngrams += meta['ngrams'] if os.path.exists(meta_path) else len(meta)
+    return n_ngrams
+
+def machine():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'python':platform.python_version(), 'platform':platform.platform(), 'processor':platform.processor(),
+            'cpu_count':os.cpu_count(), 'commit':commit}
+
+def run_benchmarks(work, stages=None, repeat=3, shards=2, rows=100000, pentagram_rows=None, seed=0):
+    '''
+    Benchmarks the stages (default all of them, always run in the order of STAGES) repeat times each on the synthetic corpus in work,
+    which is generated first if it does not exist yet (shards of rows 1-grams and of pentagram_rows 5-grams, default rows).
+    Returns the results as saved by save_results().
+    '''
+    stages = [stage for stage in STAGES if stages is None or stage in stages]
+    pentagram_rows = pentagram_rows or rows
+    unigrams = corpus_directory(work, 1, shards, rows, seed)
+    pentagrams = corpus_directory(work, 5, shards, pentagram_rows, seed)
+    corpus = {'unigrams':ensure_corpus(unigrams, 1, shards, rows, seed),
+              'pentagrams':ensure_corpus(pentagrams, 5, shards, pentagram_rows, seed)}
+    results = {'date':time.strftime('%Y-%m-%d %H:%M:%S'), 'machine':machine(), 'repeat':repeat,
+               'corpus':{name:{key:value for key, value in metadata.items() if key != 'files'} for name, metadata in corpus.items()},
+               'stages':dict()}
+    for stage in stages:
+        wall_times, peak = [], None
+        for i in range(repeat):
+            #A new process for every run, its peak RSS is only the stage's
+            with ProcessPoolExecutor(max_workers=1) as executor:
+                wall_time, rss = executor.submit(_run_stage, stage, unigrams, pentagrams).result()
+            wall_times.append(wall_time)
+            peak = rss if peak is None or (rss is not None and rss > peak) else peak
+        if STAGES[stage] == 'ngram':
+            units = count_ngrams(unigrams)
+        else:
+            units = sum(corpus['pentagrams' if stage == 'cluster' else 'unigrams']['files'].values())
+        results['stages'][stage] = {'unit':STAGES[stage], 'units':units, 'wall_times':wall_times,
+                                    'per_second':units/min(wall_times), 'peak_rss':peak}
+        print(format_stage(stage, results['stages'][stage]))
+    return results
+
+def _megabytes(n_bytes):
+    return 'n/a' if n_bytes is None else '{:,.0f} MB'.format(n_bytes/2**20)
+
+def format_stage(stage, result):
+    return '{:<12} {:>12,.0f} {}s/sec  best {:.2f} s of {}  peak RSS {}'.format(stage, result['per_second'], result['unit'],
+                                                                           min(result['wall_times']), len(result['wall_times']), _megabytes(result['peak_rss']))
+
+def save_results(results, work, label=None):
+    label = label or time.strftime('%Y%m%d-%H%M%S')
+    os.makedirs(work+RESULTS, exist_ok=True)
+    output = work+RESULTS+label+'.json'
+    with open(output, 'w') as f_out:
+        json.dump(results, f_out, indent=1)
+    print('SAVED: ', output)
+    return output
+
+def compare(old_path, new_path):
+    #Prints the throughput and peak RSS of every stage two saved runs have in common, returns {stage: speedup of new over old}
+    with open(old_path, 'r') as f:
+        old = json.load(f)
+    with open(new_path, 'r') as f:
+        new = json.load(f)
+    if old['corpus'] != new['corpus']:
+        print('WARNING: the runs are on different corpora', old['corpus'], new['corpus'])
+    print('{:<12} {:>16} {:>16} {:>8} {:>10} {:>10}'.format('stage', 'old units/sec', 'new units/sec', 'speedup', 'old RSS', 'new RSS'))
+    speedups = dict()
+    for stage in STAGES:
+        if stage in old['stages'] and stage in new['stages']:
+            a, b = old['stages'][stage], new['stages'][stage]
+            speedups[stage] = b['per_second']/a['per_second']
+            print('{:<12} {:>16,.0f} {:>16,.0f} {:>7.2f}x {:>10} {:>10}'.format(stage, a['per_second'], b['per_second'], speedups[stage],
+                                                                           _megabytes(a['peak_rss']), _megabytes(b['peak_rss'])))
+    return speedups
+
+if __name__ == '__main__':
+
+    import argparse
+    parser = argparse.ArgumentParser(description='Benchmarks every stage of the pipeline on a seeded synthetic corpus and saves the results')
+
+    parser.add_argument('path', type=str, nargs='?', default=None, help="work directory, the corpus, the outputs of the stages and the results are written there")
+    parser.add_argument('--stages', type=str, nargs='+', required=False, default=None, choices=list(STAGES), help="Stages to benchmark. Default is all of them.")
+    parser.add_argument('-r', '--repeat', type=int, required=False, default=3, help="Runs of each stage, the best one gives the throughput. Default is 3")
+    parser.add_argument('--shards', type=int, required=False, default=2, help="Shards of the synthetic corpus. Default is 2")
+    parser.add_argument('--rows', type=int, required=False, default=100000, help="1-gram rows per shard. Default is 100000")
+    parser.add_argument('--pentagram-rows', type=int, required=False, default=None, help="5-gram rows per shard. Default is --rows")
+    parser.add_argument('--seed', type=int, required=False, default=0, help="Seed of the synthetic corpus. Default is 0")
+    parser.add_argument('-o', '--output', type=str, required=False, default=None, help="Label of the saved results (benchmarks/<label>.json). Default is the date and time")
+    parser.add_argument('--compare', type=str, nargs=2, required=False, default=None, metavar=('OLD', 'NEW'), help="Compare two saved results instead of running the benchmarks")
+
+    args = parser.parse_args()
+    if args.compare:
+        compare(*args.compare)
+    else:
+        if args.path is None:
+            parser.error('the work directory is required unless --compare is given')
+        work = args.path
+        if work[-1] != '\\' and work[-1] != '/':
+            work += '/'
+        results = run_benchmarks(work, args.stages, args.repeat, args.shards, args.rows, args.pentagram_rows, args.seed)
+        save_results(results, work, args.output)
@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# # Birth and death of lexemes
+#
+# `analyze_birth_and_death()` in `Closed-Lexical-Classes/2. Closed Classes Analysis.ipynb` smooths every unigram with a pandas `rolling(5)`
+# over a dict-of-lists and then walks its 216 smoothed years in Python to find the years where it goes from 0 to in use (birth)
+# and from in use to 0 (death), building an in-use list per word for the median and mean.
+#
+# Here the same analysis runs on a words x years matrix, a chunk of words at a time:
+# - the centered rolling mean is a difference of cumulative sums (see lexicon_stats.py)
+# - births and deaths are the +1/-1 steps of the boolean presence matrix along the years axis
+# - the in-use median is read from the sorted rows (the zeros sort first), the in-use mean divides the row sum by the number of years in use
+#
+# The records (`POS`, `max_usage`, `median_all`, `median_in_use`, `mean_all`, `mean_in_use`, `birth_years`, `death_years`)
+# have the same values as the notebook's, and `CLOSED_CLASSES_SORTABLE.json` is written the same way.
+# Since it no longer takes hours, it can be run on every part of speech of the `-COMPLETE.json` files (or their stores) too,
+# and with `--tags` only the partitions of those tags are read from the files partitioned by `pos_store.py`.
+#
+# Usage:
+# `python birth_death.py C:\path\to\unigram_data\` reads the `*_CLOSED_CLASSES.json` files and saves `CLOSED_CLASSES_SORTABLE.json`
+# `python birth_death.py C:\path\to\amer_unigram_data\ --suffix=-COMPLETE.json --tags NOUN VERB ADJ ADV -o BIRTH_DEATH_OPEN_CLASSES`
+
+import os
+import re
+import numpy as np
+from tqdm import tqdm
+
+from lexicon_stats import rolling_mean, _float_mean
+from create_lexicon import shard_chunks, save_json
+
+#For the Google POS tagging
+underscore = re.compile('_{1}')
+
+FIRST_YEAR = 1800
+LAST_YEAR = 2019
+SMOOTHING = 5
+
+def _group(rows, values, n_rows):
+    #Splits values into one list per row, rows is sorted (np.nonzero returns the indices in row major order)
+    bounds = np.cumsum(np.bincount(rows, minlength=n_rows))[:-1]
+    return [group.tolist() for group in np.split(values, bounds)]
+
+def birth_death_statistics(counts, years, smoothing=SMOOTHING):
+    '''
+    counts is a words x years integer matrix of match counts, years the (int) year of each column.
+    Returns (analyzed, stats) where analyzed is a boolean mask of the words that are in use at least once after smoothing
+    and have at least one birth or death, and stats maps every statistic to one value (or list of years) per analyzed word.
+    '''
+    values = rolling_mean(np.asarray(counts, dtype=np.int64), smoothing)
+    #pandas labels a centered window with its (smoothing//2)-th year and drops the incomplete windows
+    years = np.asarray(years[smoothing//2:smoothing//2+values.shape[1]], dtype=np.int64)
+
+    present = values > 0
+    n_in_use = present.sum(axis=1)
+    step = np.diff(present.astype(np.int8), axis=1)
+    #A birth is a year in use after a year that is not, a death is the last year in use before a year that is not (no death in the final year)
+    has_transition = (step != 0).any(axis=1)
+    analyzed = (n_in_use > 0) & has_transition
+
+    values, n_in_use, step = values[analyzed], n_in_use[analyzed], step[analyzed]
+    n_rows, n_years = values.shape
+
+    stats = dict()
+    stats['max_usage'] = values.max(axis=1)
+    sorted_values = np.sort(values, axis=1)
+    stats['median_all'] = (sorted_values[:,(n_years-1)//2]+sorted_values[:,n_years//2])/2 if n_years % 2 == 0 else sorted_values[:,n_years//2]
+    #The values in use are the last n_in_use of each sorted row
+    first = n_years-n_in_use
+    low = np.take_along_axis(sorted_values, (first+(n_in_use-1)//2)[:,None], axis=1)[:,0]
+    high = np.take_along_axis(sorted_values, (first+n_in_use//2)[:,None], axis=1)[:,0]
+    stats['median_in_use'] = np.where(n_in_use % 2 == 0, (low+high)/2, low)
+    stats['mean_all'] = _float_mean(values)
+    #Adding the zeros does not change the sum, only the count
+    stats['mean_in_use'] = _float_mean(values, n_in_use)
+
+    birth_rows, birth_columns = np.nonzero(step == 1)
+    death_rows, death_columns = np.nonzero(step == -1)
+    stats['birth_years'] = _group(birth_rows, years[birth_columns+1], n_rows)
+    stats['death_years'] = _group(death_rows, years[death_columns], n_rows)
+    return analyzed, stats
+
+def analyze_birth_and_death(words, counts, years, smoothing=SMOOTHING, ngrams_analyzed=None):
+    '''
+    Adds the {word: {POS, max_usage, median_all, median_in_use, mean_all, mean_in_use, birth_years, death_years}} records
+    of the analyzed words (tagged unigrams, the rows of counts) to ngrams_analyzed, like the notebook's analyze_birth_and_death().
+    '''
+    if ngrams_analyzed is None:
+        ngrams_analyzed = dict()
+    analyzed, stats = birth_death_statistics(counts, years, smoothing)
+    values = {stat:(array if isinstance(array, list) else array.tolist()) for stat, array in stats.items()}
+    analyzed_words = [word for word, keep in zip(words, analyzed.tolist()) if keep]
+    for i, unigram in enumerate(analyzed_words):
+        #Replace the tagged unigram with the word and place POS separately
+        word_pos = underscore.split(unigram)
+        ngrams_analyzed[word_pos[0]] = {'POS':word_pos[1],
+                                        'max_usage':values['max_usage'][i],
+                                        'median_all':values['median_all'][i],
+                                        'median_in_use':values['median_in_use'][i],
+                                        'mean_all':values['mean_all'][i],
+                                        'mean_in_use':values['mean_in_use'][i],
+                                        'birth_years':values['birth_years'][i],
+                                        'death_years':values['death_years'][i]}
+    return ngrams_analyzed
+
+def analyze_file(directory, file_name, t_start=FIRST_YEAR, t_end=LAST_YEAR, smoothing=SMOOTHING, tags=None):
+    #Birth and death records of one preprocessed file (or its store), optionally only of the unigrams tagged with one of tags
+    #(read from the POS partitions of the file when pos_store.py wrote them)
+    years = list(range(t_start, t_end+1))
+    ngrams_analyzed = dict()
+    for words, counts in tqdm(shard_chunks(directory, file_name, t_start, t_end, tags), unit='chunk'):
+        analyze_birth_and_death(words, counts, years, smoothing, ngrams_analyzed)
+    return ngrams_analyzed
+
+def analyze_directory(directory, suffix='_CLOSED_CLASSES.json', t_start=FIRST_YEAR, t_end=LAST_YEAR, smoothing=SMOOTHING, tags=None):
+    #Concatenates the records of every file of the directory whose name contains suffix (later files overwrite the records of earlier ones)
+    final_dict = dict()
+    files = os.listdir(directory)
+    for file_path in files:
+        if suffix in file_path:
+            final_dict.update(analyze_file(directory, file_path, t_start, t_end, smoothing, tags))
+            print('Analyzed birth and death')
+    return final_dict
+
+if __name__ == '__main__':
+
+    import argparse
+    parser = argparse.ArgumentParser(description='Finds the birth and death years and the usage statistics of every unigram of the preprocessed files in a directory')
+
+    parser.add_argument('path', type=str, help="absolute path to the directory with the preprocessed files")
+    parser.add_argument('--suffix', type=str, required=False, default='_CLOSED_CLASSES.json', help="Only files whose name contains this are read. Default is _CLOSED_CLASSES.json, use --suffix=-COMPLETE.json for every part of speech.")
+    parser.add_argument('--tags', type=str, nargs='+', required=False, default=None, help="Only analyze the unigrams with one of these tags (e.g. PRON DET ADP CONJ PRT). Default is all of them.")
+    parser.add_argument('-b', '--begin', type=int, required=False, default=FIRST_YEAR, help="Begin year. Default is "+str(FIRST_YEAR))
+    parser.add_argument('-e', '--end', type=int, required=False, default=LAST_YEAR, help="End year. Default is "+str(LAST_YEAR))
+    parser.add_argument('-s', '--smoothing', type=int, required=False, default=SMOOTHING, help="Size of the centered rolling mean. Default is "+str(SMOOTHING))
+    parser.add_argument('-o', '--output', type=str, required=False, default='CLOSED_CLASSES_SORTABLE', help="Name of the saved JSON (without .json). Default is CLOSED_CLASSES_SORTABLE")
+
+    args = parser.parse_args()
+    directory = args.path
+    if directory[-1] != '\\' and directory[-1] != '/':
+        directory += '/'
+    final_dict = analyze_directory(directory, args.suffix, args.begin, args.end, args.smoothing, set(args.tags) if args.tags else None)
+    save_json(final_dict, directory, args.output)
@@ -23,11 +23,26 @@
 
 import json
 import numpy as np
-import pandas as pd
 from tqdm import tqdm
 import os
-import statistics
-from collections import OrderedDict
+
+#Vectorized normalizing, smoothing and statistics over a dense words x years matrix
+from lexicon_stats import sublexicon as window_sublexicon, window_years
+#Memory-mapped stores written by ngram_store.py, used instead of the JSON files when they exist
+from ngram_store import open_store, store_path_for, is_current
+#Streams lexicons to disk instead of holding them in memory
+from lexicon_io import LexiconWriter
+#Per-metric ranking index saved next to every lexicon
+from lexicon_rank import build_rank_index, build_rank_index_from_file
+#POS partitioned stores written by pos_store.py, only the partitions of the tags are read when a lexicon is restricted to some tags
+from pos_store import open_pos_store, pos_path_for, has_pos_store, partition_of
+#Lexicons created before from the same shards, window and code
+from lexicon_cache import LexiconCache, MAX_SIZE as CACHE_MAX_SIZE
+
+#Number of words whose words x years matrix is built at once, bounds the memory used per shard
+CHUNK_WORDS = 100000
+#Bump when a change to the code changes the lexicons it creates, so the lexicons cached before are not reused (see lexicon_cache.py)
+LEXICON_VERSION = 1
 
 def open_json(directory,file_path):
     with open(directory+file_path,'r') as f:
@@ -45,53 +60,66 @@ def save_json(dictionary,directory,file_name):
     else:
         print('unigram dict empty',output)
 
-def normalize(ngrams, t_start, t_end):
-    years = [str(i) for i in range(t_start,t_end+1)]
-    unigram_dict = dict()
-    for word in tqdm(ngrams.keys()):
-        match_count_by_year = []
-        for year in years:
-            if year in ngrams[word].keys():
-                match_count_by_year.append(ngrams[word][year])
-            else:
-                #Zeroes are necessary for smoothing
-                match_count_by_year.append(0)
-        unigram_dict[word] = match_count_by_year
-    return unigram_dict, years
-
-
-def smoothing(unigram_dict, years, smoothing = 5):
-    df = pd.DataFrame.from_dict(unigram_dict #take in the dictionary
-                    ).rolling(smoothing,center=True #create frames of size 5 (smoothing value), and replace value in middle
-                    ).mean( #average accross those frames
-                    ).rename({i:years[i] for i in range(len(years))}, axis = 'index' #rename the indices to years
-                    ).dropna()
-    
-    years = list(df.index.values)
-    unigram_dict = df.to_dict(orient = 'list')
-    
-    return unigram_dict, years
+def save_rank(lexicon,directory,file_name):
+    #Saves the ranking index of a saved lexicon (see lexicon_rank.py), empty lexicons are not saved
+    if len(lexicon)>0:
+        build_rank_index(lexicon, directory, file_name+'.json')
+
+def normalize(ngrams, words, t_start, t_end):
+    #words x years matrix of match counts from a {unigram:{year:match_count}} dictionary
+    #Zeroes are necessary for smoothing
+    records = [ngrams[word] for word in words]
+    lengths = np.fromiter((len(record) for record in records), dtype=np.int64, count=len(records))
+    rows = np.repeat(np.arange(len(records), dtype=np.int64), lengths)
+    years = np.array([year for record in records for year in record], dtype=np.int64) if len(rows) else np.zeros(0, dtype=np.int64)
+    match_counts = np.fromiter((count for record in records for count in record.values()), dtype=np.int64, count=len(rows))
+    in_range = (years >= t_start) & (years <= t_end)
+    counts = np.zeros((len(records), t_end-t_start+1), dtype=np.int64)
+    counts[rows[in_range], years[in_range]-t_start] = match_counts[in_range]
+    return counts
 
-def return_sublexicon(unigram_dict):
+def shard_chunks(directory, file_name, t_start, t_end, tags=None):
+    #Yields (words, words x years matrix) chunks of a shard, in the order of the words in the -COMPLETE.json file
+    #With tags, only the words tagged with one of them, read from the POS partitions of the shard when it has them
+    #(and they were made from the file as it is now, see pos_store.has_pos_store)
+    pos_path = pos_path_for(directory, file_name)
+    if tags is not None and has_pos_store(pos_path):
+        pos_store = open_pos_store(pos_path)
+        print('Opened ',pos_path,' '.join(pos_store.select(tags)))
+        yield from pos_store.chunks(tags, t_start, t_end, CHUNK_WORDS)
+        return
+    for words, counts in _shard_chunks(directory, file_name, t_start, t_end):
+        if tags is not None:
+            keep = np.array([partition_of(word) in tags for word in words], dtype=bool)
+            words = [word for word, k in zip(words, keep) if k]
+            counts = counts[keep]
+        yield words, counts
+
+def _shard_chunks(directory, file_name, t_start, t_end):
+    store_path = store_path_for(directory, file_name)
+    #A store converted before its -COMPLETE.json was written again is not used
+    if is_current(store_path, directory+file_name):
+        store = open_store(store_path)
+        print('Opened ',store_path)
+        order = store.source_order()
+        all_words = store.words()
+        for i in range(0, len(order), CHUNK_WORDS):
+            rows = order[i:i+CHUNK_WORDS]
+            yield [all_words[row] for row in rows.tolist()], store.to_dense(t_start, t_end, rows)
+    else:
+        ngrams = open_json(directory,file_name)
+        print('Opened ',file_name)
+        words = list(ngrams.keys())
+        for i in range(0, len(words), CHUNK_WORDS):
+            yield words[i:i+CHUNK_WORDS], normalize(ngrams, words[i:i+CHUNK_WORDS], t_start, t_end)
+
+def return_sublexicon(directory, file_name, t_start, t_end, t_step):
+    #We only get a sublexicon because each file is only a single piece of the full lexicon.
     sublexicon = dict()
     usage = 0
-    for unigram in tqdm(unigram_dict.keys()):
-        frequency_list = unigram_dict[unigram]
-        #If there are no zeroes in the list of frequencies for that unigram
-        if 0 not in frequency_list:
-            sum_usage = sum(frequency_list)
-            median_usage = statistics.median(frequency_list)
-            mean_usage = statistics.mean(frequency_list)
-            max_usage = max(frequency_list)
-            min_usage = min(frequency_list)
-            
-            usage+=sum_usage
-            sublexicon[unigram] = {'sum_usage':sum_usage,
-                                'median_usage':median_usage,
-                                'mean_usage':mean_usage,
-                                'max_usage':max_usage,
-                                'min_usage':min_usage}
-        
+    for words, counts in tqdm(shard_chunks(directory, file_name, t_start, t_end), unit='chunk'):
+        chunk_sublexicon, usage = window_sublexicon(words, counts, t_step, usage)
+        sublexicon.update(chunk_sublexicon)
     return sublexicon, usage
 
 def add_frequency(lexicon,total_usage):
@@ -99,62 +127,196 @@ def add_frequency(lexicon,total_usage):
         lexicon[lexeme]['frequency'] = lexicon[lexeme]['sum_usage']/total_usage
     return lexicon
 
-def main(directory, t_start, t_end, t_step):
-    lexicon = dict()
-    total_usage = 0
-    files = os.listdir(directory)
-    for file_name in files:
-        if '-COMPLETE.json' in file_name:
-            ngrams = open_json(directory,file_name)
-            print('Opened ',file_name,'Normalizing...')
-            unigram_dict, years = normalize(ngrams, t_start, t_end)
-            del ngrams
-            print('Normalized')
-            if t_step>1:
-                print('Smoothing...')
-                unigram_dict, years = smoothing(unigram_dict, years, t_step)
-                print('Smoothed')
-            #We only get a sublexicon because each file is only a single piece of the full lexicon.
-            print('Getting sublexicon...')
-            sublexicon, usage = return_sublexicon(unigram_dict)
-            del unigram_dict
-            print('Got sublexicon. Updating Lexicon...')
-            lexicon.update(sublexicon)
-            total_usage+=usage
-            del sublexicon #frees up memory for next round, before the compiler gets to it.
-            del usage
-            print('Updated Lexicon')
-            
-    print('Adding frequency...')
-    lexicon = add_frequency(lexicon, total_usage)
+def lexicon_name(t_start, t_end, t_step, tags=None):
+    #A lexicon restricted to some POS tags is named after them, LEXICON_1851-1900_STEP1_NOUN
+    years = window_years(t_start, t_end, t_step)
+    name = str('LEXICON_'+str(years[0])+'-'+str(years[-1])+'_STEP'+str(t_step))
+    if tags:
+        name += '_'+'_'.join(tags)
+    return name
+
+def create_lexicons(directory, windows, stream=False, tags=None):
+    '''
+    Creates the lexicon of every (t_start, t_end, t_step) window in windows while reading each shard of the directory only once.
+    The words x years matrix of a chunk of words is built once over the union of the windows and sliced for every window.
+    Returns {lexicon name: lexicon}, each lexicon is the same as main() would create for that window.
+    With stream=True the lexemes are written to disk as they are finalized (see lexicon_io.py), the saved files are the same
+    and {lexicon name: (path of the saved file, number of lexemes)} is returned instead (an empty lexicon is not saved).
+    With tags (a list of POS tags), the lexicons only have the words tagged with one of them, read from the POS partitions when the shards have them.
+    '''
+    first_year = min(t_start for t_start, t_end, t_step in windows)
+    last_year = max(t_end for t_start, t_end, t_step in windows)
+    if stream:
+        lexicons = {window:LexiconWriter(directory, lexicon_name(*window, tags)) for window in windows}
+    else:
+        lexicons = {window:dict() for window in windows}
+    total_usages = {window:0 for window in windows}
+
+    try:
+        files = os.listdir(directory)
+        for file_name in files:
+            if '-COMPLETE.json' in file_name:
+                print('Getting sublexicons...')
+                usages = {window:0 for window in windows}
+                for words, counts in tqdm(shard_chunks(directory, file_name, first_year, last_year, tags), unit='chunk'):
+                    for window in windows:
+                        t_start, t_end, t_step = window
+                        window_counts = counts[:, t_start-first_year:t_end-first_year+1]
+                        sublexicon, usages[window] = window_sublexicon(words, window_counts, t_step, usages[window])
+                        lexicons[window].update(sublexicon)
+                    del counts
+                for window in windows:
+                    total_usages[window]+=usages[window]
+                print('Updated Lexicons')
+
+        named_lexicons = dict()
+        for window in windows:
+            print('Adding frequency...')
+            if stream:
+                named_lexicons[lexicon_name(*window, tags)] = (lexicons[window].close(total_usages[window]), len(lexicons[window]))
+                print('Size of', lexicon_name(*window, tags), 'is', len(lexicons[window]))
+                if len(lexicons[window]) > 0:
+                    build_rank_index_from_file(directory, lexicon_name(*window, tags)+'.json')
+            else:
+                named_lexicons[lexicon_name(*window, tags)] = add_frequency(lexicons[window], total_usages[window])
+    finally:
+        #Removes the temporary files of the streamed lexicons which were not saved, when a shard or a window failed
+        if stream:
+            for writer in lexicons.values():
+                writer.discard()
+    return named_lexicons
+
+def restore_cached(directory, windows, cache, tags=None):
+    #Restores the lexicons of windows that are in the cache (a LexiconCache) to directory, returns {window: cache key} of the others
+    keys = dict()
+    for window in windows:
+        key = cache.key(directory, window, LEXICON_VERSION, tags)
+        entry = cache.restore(key, directory, lexicon_name(*window, tags))
+        if entry is None:
+            keys[window] = key
+        else:
+            print('Restored', lexicon_name(*window, tags), 'from the cache, size is', entry['lexemes'])
+    return keys
+
+def add_cached(directory, window, key, cache, lexemes, tags=None):
+    #Adds the saved lexicon of window to the cache, lexemes is its size (an empty lexicon is cached without files, it is not saved)
+    cache.add(key, directory, lexicon_name(*window, tags), window, LEXICON_VERSION, lexemes)
+
+def main(directory, t_start, t_end, t_step, stream=False, cache=None, tags=None):
+    #With cache (a LexiconCache), the lexicon is restored from it when it was created before from the same shards
+    #With tags, the lexicon only has the words tagged with one of them (see create_lexicons)
+    if cache is not None:
+        keys = restore_cached(directory, [(t_start, t_end, t_step)], cache, tags)
+        if not keys:
+            return
+    if stream:
+        path, size = create_lexicons(directory, [(t_start, t_end, t_step)], stream=True, tags=tags)[lexicon_name(t_start, t_end, t_step, tags)]
+        if cache is not None:
+            add_cached(directory, (t_start, t_end, t_step), keys[(t_start, t_end, t_step)], cache, size, tags)
+        return
+    lexicon = create_lexicons(directory, [(t_start, t_end, t_step)], tags=tags)[lexicon_name(t_start, t_end, t_step, tags)]
     
-    save_json(lexicon,directory,str('LEXICON_'+str(years[0])+'-'+str(years[-1])+'_STEP'+str(t_step)))
+    save_json(lexicon,directory,lexicon_name(t_start, t_end, t_step, tags))
+    save_rank(lexicon,directory,lexicon_name(t_start, t_end, t_step, tags))
+    if cache is not None:
+        add_cached(directory, (t_start, t_end, t_step), keys[(t_start, t_end, t_step)], cache, len(lexicon), tags)
     print('Frequency added. Lexicon Saved.')
     print('Size of Lexicon is ',len(lexicon.keys()))
 
+def run_jobs(jobs, stream=False, cache=None, tags=None):
+    #jobs is a list of (directory, t_start, t_end, t_step), every corpus directory is read once for all of its windows
+    #With cache, only the windows that are not in it are created
+    corpora = dict()
+    for directory, t_start, t_end, t_step in jobs:
+        if (t_start, t_end, t_step) not in corpora.setdefault(directory, []):
+            corpora[directory].append((t_start, t_end, t_step))
+    for directory, windows in corpora.items():
+        if cache is not None:
+            keys = restore_cached(directory, windows, cache, tags)
+            windows = [window for window in windows if window in keys]
+            if not windows:
+                continue
+        print('Creating', len(windows), 'lexicons from', directory)
+        if stream:
+            saved = create_lexicons(directory, windows, stream=True, tags=tags)
+            if cache is not None:
+                for window in windows:
+                    path, size = saved[lexicon_name(*window, tags)]
+                    add_cached(directory, window, keys[window], cache, size, tags)
+            continue
+        lexicons = create_lexicons(directory, windows, tags=tags)
+        for window in windows:
+            name = lexicon_name(*window, tags)
+            lexicon = lexicons[name]
+            save_json(lexicon, directory, name)
+            save_rank(lexicon, directory, name)
+            if cache is not None:
+                add_cached(directory, window, keys[window], cache, len(lexicon), tags)
+            print('Size of', name, 'is', len(lexicon.keys()))
+
+def read_jobs(file_path, parser):
+    '''
+    Reads a job list, one job per line, either as "directory,begin,end,step"
+    or as a create_lexicon.py command line like the ones in commands.txt. Blank lines and lines starting with # are skipped.
+    '''
+    import shlex
+    jobs = []
+    with open(file_path, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            if line.startswith('python'):
+                tokens = shlex.split(line, posix=False)
+                args = parser.parse_args(tokens[2:])
+                jobs.append((args.path, args.begin, args.end, args.step))
+            else:
+                directory, t_start, t_end, t_step = [value.strip() for value in line.split(',')]
+                jobs.append((directory, int(t_start), int(t_end), int(t_step)))
+    return jobs
+
 if __name__ == '__main__':
     
     import argparse
     parser = argparse.ArgumentParser(description='A program which creates a lexicon over a time period')
 
-    parser.add_argument('-p', '--path', type=str, required=True, help=" absolute path t the directory with the *-COMPLETE.json files")
-    parser.add_argument('-b', '--begin', type=int, required=True, help="Input the year that you want to consider as the lower bound of the lexicon")
-    parser.add_argument('-e', '--end', type=int, required=True, help="Input the year that you want to consider as the upper bound of the lexicon")
+    parser.add_argument('-p', '--path', type=str, required=False, help=" absolute path t the directory with the *-COMPLETE.json files")
+    parser.add_argument('-b', '--begin', type=int, required=False, help="Input the year that you want to consider as the lower bound of the lexicon")
+    parser.add_argument('-e', '--end', type=int, required=False, help="Input the year that you want to consider as the upper bound of the lexicon")
 
     parser.add_argument('-s', '--step', type=int, required=False, default=1, help="This is the minimum timestep for which a unigram can be true in to be in the lexicon. Default is 1. Timestep is usually an odd number (3 years would average the frequency of that year with the frequencies of the year before and after it). Smoothing is a more advanced(but very slow) way to implement the time step (and is code reuse).")
+    parser.add_argument('--stream', action='store_true', help="Write the lexemes to disk as they are finalized instead of holding the lexicon in memory. The saved files are the same.")
+    parser.add_argument('--cache', type=str, required=False, default=None, help="Directory of a lexicon cache (see lexicon_cache.py). Lexicons created before from the same shards, years and step are restored from it instead of created again, new ones are added to it.")
+    parser.add_argument('--cache-size', type=float, required=False, default=CACHE_MAX_SIZE, help="Maximum size of the lexicon cache in GB, the least recently used lexicons are evicted past it. Default is "+str(CACHE_MAX_SIZE))
+    parser.add_argument('--tags', type=str, nargs='+', required=False, default=None, help="Only the words tagged with these POS tags (e.g. NOUN), read from the POS partitions of the shards when pos_store.py wrote them. The lexicon is named after the tags.")
+    parser.add_argument('-j', '--jobs', type=str, required=False, help="File with a list of lexicons to create, one per line as path,begin,end,step or as a create_lexicon.py command (e.g. commands.txt). Each corpus is loaded once for all of its lexicons.")
 
     args = parser.parse_args()
-    directory = args.path
-    if directory[-1] != '\\' or directory[-1] != '/':
-        directory+='/'
-    t_start = args.begin
-    t_end = args.end
-    t_step = args.step
-    
-    if t_start>=t_end:    
-        raise ValueError('Re-Input start year and end year.')
+    cache = LexiconCache(args.cache, args.cache_size) if args.cache else None
+    if args.jobs:
+        jobs = []
+        for directory, t_start, t_end, t_step in read_jobs(args.jobs, parser):
+            if directory[-1] != '\\' and directory[-1] != '/':
+                directory+='/'
+            if t_start>=t_end:
+                raise ValueError('Re-Input start year and end year. '+str((directory, t_start, t_end, t_step)))
+            jobs.append((directory, t_start, t_end, t_step))
+        run_jobs(jobs, args.stream, cache, args.tags)
     else:
-        t_interval = t_end-t_start
-        print("Creating Lexicon from year",t_start,'-',t_end,'with step',t_step)
-        print('Range of time for calculating lexicon size is', t_interval-(t_step-1),'years')
-        main(directory, t_start, t_end, t_step)
+        if args.path is None or args.begin is None or args.end is None:
+            parser.error('-p, -b and -e are required unless a job list is given with -j')
+
+        directory = args.path
+        if directory[-1] != '\\' and directory[-1] != '/':
+            directory+='/'
+        t_start = args.begin
+        t_end = args.end
+        t_step = args.step
+    
+        if t_start>=t_end:    
+            raise ValueError('Re-Input start year and end year.')
+        else:
+            t_interval = t_end-t_start
+            print("Creating Lexicon from year",t_start,'-',t_end,'with step',t_step)
+            print('Range of time for calculating lexicon size is', t_interval-(t_step-1),'years')
+            main(directory, t_start, t_end, t_step, args.stream, cache, args.tags)
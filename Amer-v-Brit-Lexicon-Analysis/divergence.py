@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# # Divergence of two lexicons
+#
+# `Divergence analysis s1.ipynb` computes the Jaccard similarity, the sample-size adjusted $\chi^2$ and the frequency based measures
+# with Python set operations and one dict lookup per word, copied for every window.
+#
+# Here every LEXICON file is read once (lexeme by lexeme, see lexicon_io.py) and its lexemes are given their IDs in a vocabulary shared
+# by all the corpora and windows (see vocabulary.py), so each lexicon becomes a few dense arrays (in lexicon, sum_usage, frequency) indexed by ID.
+# Every measure of a pair of lexicons is then a handful of array operations:
+# - Jaccard similarity index $|A \cap B| / |A \cup B|$
+# - sample-size adjusted $\chi^2 = \sum \frac{(A_i \cdot \frac{\sum B_i}{\sum A_i} -B_i )^2}{B_i}$ over the shared lexemes
+# - normalized and sample-size adjusted $\chi^2 = \sum B_i \cdot \sum \frac{(\frac{A_i}{\sum{A_i}} -\frac{B_i}{\sum{B_i}})^2}{\frac{B_i}{\sum{B_i}}}$
+#   (see the derivation in the README) over the lexemes of B, a lexeme missing from A has a frequency of 0 there
+# - their p-values
+# - heterozygosity $1-\sum(f^2)$ of each lexicon and of the pooled lexicons, and Wright's fixation index $F_{ST} = \frac{H_T-H_S}{H_T}$
+# - pairwise frequency-dependent similarity $1-\sum(f_A-f_B)^2$
+#
+# B is the parent (expected) lexicon, British English in the notebooks. All the results go into one table with a row per window and pair of corpora.
+#
+# Usage:
+# `python divergence.py -c AMER ../Ngrams/amer_unigram_data/ -c BRIT ../Ngrams/brit_unigram_data/ -o DIVERGENCE`
+# compares every LEXICON file the two directories have in common and saves `DIVERGENCE.csv` in the current directory
+# (add `--vocabulary C:\path\to\vocabulary\` to use the IDs of a saved shared vocabulary)
+
+import os
+import csv
+import numpy as np
+from itertools import combinations
+from scipy.stats import chi2
+
+from lexicon_io import iter_lexicon
+from vocabulary import Vocabulary, open_vocabulary
+
+COLUMNS = ('window', 'corpus_a', 'corpus_b', 'size_a', 'size_b', 'intersection', 'unique_a', 'unique_b', 'jaccard',
+           'chi2', 'chi2_dof', 'chi2_p', 'normalized_chi2', 'normalized_chi2_dof', 'normalized_chi2_p',
+           'heterozygosity_a', 'heterozygosity_b', 'heterozygosity_total', 'fst', 'frequency_similarity')
+
+def load_lexicon(directory, file_name, vocabulary):
+    '''
+    Reads a LEXICON file and returns (ids, sum_usage, frequency) arrays, where ids are the IDs of its lexemes
+    in vocabulary (a Vocabulary, new lexemes are added to it).
+    '''
+    lexemes, sum_usage, frequency = [], [], []
+    for lexeme, record in iter_lexicon(directory, file_name):
+        lexemes.append(lexeme)
+        sum_usage.append(record['sum_usage'])
+        frequency.append(record['frequency'])
+    return vocabulary.ids(lexemes), np.array(sum_usage, dtype=np.float64), np.array(frequency, dtype=np.float64)
+
+def align(lexicon, size):
+    #Dense (in lexicon, sum_usage, frequency) arrays of a loaded lexicon over the first size IDs of the vocabulary
+    indices, sum_usage, frequency = lexicon
+    aligned = np.zeros(size, dtype=bool), np.zeros(size), np.zeros(size)
+    aligned[0][indices] = True
+    aligned[1][indices] = sum_usage
+    aligned[2][indices] = frequency
+    return aligned
+
+def heterozygosity(frequency):
+    return 1-np.dot(frequency, frequency)
+
+def divergence(a, b):
+    #All the measures of lexicon a against the parent (expected) lexicon b, both aligned on the same vocabulary
+    in_a, usage_a, frequency_a = a
+    in_b, usage_b, frequency_b = b
+    shared = in_a & in_b
+    n_shared = int(shared.sum())
+    n_union = int((in_a | in_b).sum())
+    row = {'size_a':int(in_a.sum()), 'size_b':int(in_b.sum()), 'intersection':n_shared,
+           'unique_a':int((in_a & ~in_b).sum()), 'unique_b':int((in_b & ~in_a).sum()),
+           'jaccard':n_shared/n_union if n_union else float('nan')}
+
+    sum_a, sum_b = usage_a.sum(), usage_b.sum()
+    #A_i is scaled to the size of B
+    scaled = usage_a[shared]*(sum_b/sum_a)
+    row['chi2'] = float(np.sum((scaled-usage_b[shared])**2/usage_b[shared]))
+    row['chi2_dof'] = n_shared-1
+    row['chi2_p'] = float(chi2.sf(row['chi2'], row['chi2_dof']))
+
+    row['normalized_chi2'] = float(sum_b*np.sum((frequency_a[in_b]-frequency_b[in_b])**2/frequency_b[in_b]))
+    row['normalized_chi2_dof'] = row['size_b']-1
+    row['normalized_chi2_p'] = float(chi2.sf(row['normalized_chi2'], row['normalized_chi2_dof']))
+
+    row['heterozygosity_a'] = float(heterozygosity(frequency_a))
+    row['heterozygosity_b'] = float(heterozygosity(frequency_b))
+    #The pooled population weighs each lexicon by its total usage
+    weight_a = sum_a/(sum_a+sum_b)
+    row['heterozygosity_total'] = float(heterozygosity(weight_a*frequency_a+(1-weight_a)*frequency_b))
+    heterozygosity_s = weight_a*row['heterozygosity_a']+(1-weight_a)*row['heterozygosity_b']
+    row['fst'] = (row['heterozygosity_total']-heterozygosity_s)/row['heterozygosity_total']
+    row['frequency_similarity'] = float(1-np.sum((frequency_a-frequency_b)**2))
+    return row
+
+def common_windows(directories):
+    #LEXICON files (without .json) present in every directory
+    windows = None
+    for directory in directories:
+        names = set(name[:-5] for name in os.listdir(directory) if name.startswith('LEXICON_') and name.endswith('.json'))
+        windows = names if windows is None else windows.intersection(names)
+    return sorted(windows or [])
+
+def divergence_table(corpora, windows=None, pairs=None, vocabulary=None):
+    '''
+    corpora is {corpus name: directory}, in order. windows are LEXICON names (e.g. LEXICON_1851-1900_STEP1), by default the ones
+    every corpus has. pairs are (a, b) corpus names, b being the parent, by default every pair in the order of corpora.
+    vocabulary is the shared Vocabulary, by default a new one in memory.
+    Returns one row (a dict with COLUMNS) per window and pair.
+    '''
+    if windows is None:
+        windows = common_windows(corpora.values())
+    windows = [window[:-5] if window.endswith('.json') else window for window in windows]
+    if pairs is None:
+        pairs = list(combinations(corpora, 2))
+
+    #Every lexicon is read once and indexed on the shared vocabulary
+    if vocabulary is None:
+        vocabulary = Vocabulary()
+    lexicons = dict()
+    for window in windows:
+        for corpus, directory in corpora.items():
+            lexicons[corpus, window] = load_lexicon(directory, window+'.json', vocabulary)
+            print('Opened', corpus, window)
+
+    rows = []
+    for window in windows:
+        aligned = {corpus:align(lexicons[corpus, window], len(vocabulary)) for corpus in corpora}
+        for corpus_a, corpus_b in pairs:
+            row = {'window':window, 'corpus_a':corpus_a, 'corpus_b':corpus_b}
+            row.update(divergence(aligned[corpus_a], aligned[corpus_b]))
+            rows.append(row)
+    return rows
+
+def save_table(rows, file_path):
+    with open(file_path, 'w', newline='') as f_out:
+        writer = csv.DictWriter(f_out, fieldnames=COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
+    print('SAVED: ', file_path, len(rows))
+
+if __name__ == '__main__':
+
+    import argparse
+    parser = argparse.ArgumentParser(description='Computes the divergence measures of the lexicons of two or more corpora for every window into one table')
+
+    parser.add_argument('-c', '--corpus', nargs=2, action='append', required=True, metavar=('NAME', 'DIRECTORY'), help="Name and directory of the LEXICON files of a corpus. Give at least two, the later corpus of each pair is the parent (expected) one.")
+    parser.add_argument('-w', '--windows', nargs='+', required=False, default=None, help="LEXICON names, e.g. LEXICON_1851-1900_STEP1. Default is every LEXICON file all the corpora have.")
+    parser.add_argument('--vocabulary', type=str, required=False, default=None, help="Directory of the shared vocabulary (see vocabulary.py). Default is a vocabulary built in memory.")
+    parser.add_argument('-o', '--output', type=str, required=False, default='DIVERGENCE', help="Name of the saved table (without .csv). Default is DIVERGENCE")
+
+    args = parser.parse_args()
+    corpora = dict()
+    for name, directory in args.corpus:
+        if directory[-1] != '\\' and directory[-1] != '/':
+            directory += '/'
+        corpora[name] = directory
+    vocabulary = open_vocabulary(args.vocabulary) if args.vocabulary else None
+    save_table(divergence_table(corpora, args.windows, vocabulary=vocabulary), args.output+'.csv')
+    if vocabulary is not None:
+        #Lexemes that were not in the vocabulary yet were added with new IDs
+        vocabulary.save()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# # Ingest metrics
+#
+# Timers and counters filled in by `preprocess_ngrams()` while it preprocesses a shard, so that a run shows where its time goes and what the data looked like
+# without attaching a profiler:
+# - timers: seconds spent in each stage (`decompress`, `filter`, `lemmatize`, `parse`, `merge`, `checkpoint`, `save`). The stages are timed a whole block of rows
+#   at a time (`lap()` stops the running stage and starts the next one), so the instrumentation costs a few clock reads per block, not per row
+# - counters: rows, lexemes (the rows that passed the word tests), year entries of the lexemes and the entries dropped by the volume filter (volume_count < 2)
+# - rejections: rows rejected by each rule of the word tests (see `lexeme_filter.REJECTION_RULES`), a row counts for the first rule it breaks
+#
+# The metrics of the pipeline workers and of the shards of a run are added up with `merge()`.
+# Each preprocessed shard gets its metrics next to its output (`1-00000-of-00024-preprocessed-metrics.json` next to `1-00000-of-00024-preprocessed.pickle`),
+# and each run a `preprocess-metrics.json` (`complete-metrics.json` for the `-COMPLETE.json` files) with the totals of its shards.
+
+import json
+import time
+
+STAGES = ('decompress', 'filter', 'lemmatize', 'parse', 'merge', 'checkpoint', 'save')
+
+class IngestMetrics:
+    def __init__(self, timers=None, counters=None, rejections=None):
+        self.timers = dict(timers or {})
+        self.counters = dict(counters or {})
+        self.rejections = dict(rejections or {})
+        self.stage = None
+        self.since = None
+
+    def lap(self, stage=None):
+        #Adds the time since the last lap to the running stage and starts timing stage (None stops timing)
+        now = time.perf_counter()
+        if self.stage is not None:
+            self.timers[self.stage] = self.timers.get(self.stage, 0.0)+now-self.since
+        self.stage, self.since = stage, now
+
+    def count(self, counter, n=1):
+        self.counters[counter] = self.counters.get(counter, 0)+n
+
+    def merge(self, other):
+        #Adds the timers and counters of other (IngestMetrics or the dict of to_dict()), e.g. of a worker or of another shard
+        if isinstance(other, IngestMetrics):
+            other = other.to_dict()
+        for field in ('timers', 'counters', 'rejections'):
+            totals = getattr(self, field)
+            for name, value in other[field].items():
+                totals[name] = totals.get(name, 0)+value
+        return self
+
+    def to_dict(self):
+        #Plain dictionaries, small enough to be sent back by the workers and saved as JSON
+        return {'timers':dict(self.timers), 'counters':dict(self.counters), 'rejections':dict(self.rejections)}
+
+    @classmethod
+    def from_dict(cls, metrics):
+        return cls(metrics['timers'], metrics['counters'], metrics['rejections'])
+
+    def save(self, file_path, **info):
+        #Writes the metrics with info (e.g. shard, wall_time, lemma_cache) as JSON
+        self.lap()
+        metrics = dict(info)
+        metrics.update(self.to_dict())
+        with open(file_path, 'w') as f_out:
+            json.dump(metrics, f_out, indent=1)
+        return file_path
+
+def metrics_path(directory, file_path, output_suffix):
+    #Named like the output of the shard (output_suffix, e.g. '-preprocessed.pickle'), so the drivers do not mistake it for a shard
+    return directory+file_path[:-3]+output_suffix.rpartition('.')[0]+'-metrics.json'
+
+def format_metrics(metrics):
+    #One line summary of an IngestMetrics
+    counters = metrics.counters
+    timers = ', '.join('{} {:.1f}s'.format(stage, metrics.timers[stage]) for stage in STAGES if stage in metrics.timers)
+    rejected = ', '.join('{} {:,}'.format(rule, n) for rule, n in sorted(metrics.rejections.items(), key=lambda item: -item[1]))
+    return ('{:,} rows, {:,} lexemes, {:,} of {:,} entries dropped by the volume filter | {} | rejected: {}'
+            .format(counters.get('rows', 0), counters.get('lexemes', 0), counters.get('entries_dropped', 0), counters.get('entries', 0), timers, rejected or 'none'))
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# # Memoized lemmatization
+#
+# `WordNetLemmatizer.lemmatize()` runs WordNet morphy on every call, and it is the most expensive call per surviving row in `preprocess_ngrams()`.
+# The same (surface form, POS) pairs come up again and again across shards, across the American and British corpora and across re-runs,
+# so the results are kept in a bounded least-recently-used cache which can be saved to disk and loaded by later runs (and by the parallel workers) to start warm.
+# The workers of a pipelined shard (see shard_pipeline.py) each have their own copy of the cache: they send back `delta()`, their lookups and new
+# entries since the last block, with every partial dictionary, and the parent `merge()`s it so its stats and saved file include what they learned.
+
+import os
+import time
+import pickle
+from contextlib import contextmanager
+from collections import OrderedDict, deque
+
+#A lock file older than this (in seconds) was left by a process that died while saving, it is taken over
+LOCK_TIMEOUT = 60
+
+@contextmanager
+def file_lock(file_path, timeout=LOCK_TIMEOUT, poll=0.05):
+    #Holds file_path+'.lock' (created exclusively, so only one process at a time) for the duration of the block
+    lock_path = file_path+'.lock'
+    while True:
+        try:
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            break
+        except FileExistsError:
+            try:
+                if time.time()-os.path.getmtime(lock_path) > timeout:
+                    os.remove(lock_path)
+                    continue
+            except OSError:
+                #Released in the meantime
+                continue
+            time.sleep(poll)
+    try:
+        os.write(fd, str(os.getpid()).encode('ascii'))
+        os.close(fd)
+        yield lock_path
+    finally:
+        try:
+            os.remove(lock_path)
+        except OSError:
+            pass
+
+class LemmaCache:
+    def __init__(self, lemmatizer, max_size=500000):
+        self.lemmatizer = lemmatizer
+        self.max_size = max_size
+        #{(word,pos):lemma}, ordered from least to most recently used
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        #Keys of the latest misses, and the counters already sent back by delta()
+        self.new = deque(maxlen=max_size)
+        self.reported = (0, 0, 0)
+
+    def lemmatize(self, word, pos='n'):
+        key = (word, pos)
+        cache = self.cache
+        if key in cache:
+            self.hits += 1
+            cache.move_to_end(key)
+            return cache[key]
+        self.misses += 1
+        lemma = self.lemmatizer.lemmatize(word, pos)
+        cache[key] = lemma
+        self.new.append(key)
+        if len(cache) > self.max_size:
+            #Evict the least recently used entry
+            cache.popitem(last=False)
+            self.evictions += 1
+        return lemma
+
+    def load(self, file_path):
+        #Warm the cache from a file written by save(), entries already in memory are kept
+        if not os.path.exists(file_path):
+            return 0
+        with open(file_path, 'rb') as f_in:
+            entries = pickle.load(f_in)
+        #Loaded entries are placed behind the ones already in memory, keeping their own recency order
+        for key, lemma in reversed(entries):
+            if key not in self.cache:
+                self.cache[key] = lemma
+                self.cache.move_to_end(key, last=False)
+        while len(self.cache) > self.max_size:
+            self.cache.popitem(last=False)
+        return len(entries)
+
+    def save(self, file_path):
+        #Merges with whatever is already on disk (e.g. written by another worker) and replaces the file atomically
+        #The read, merge and replace hold a lock file, so workers saving at the same time do not drop each other's entries
+        with file_lock(file_path):
+            merged = OrderedDict()
+            if os.path.exists(file_path):
+                with open(file_path, 'rb') as f_in:
+                    merged.update(pickle.load(f_in))
+            merged.update(self.cache)
+            entries = list(merged.items())[-self.max_size:]
+            tmp_path = file_path+'.'+str(os.getpid())+'.tmp'
+            with open(tmp_path, 'wb') as f_out:
+                pickle.dump(entries, f_out)
+            os.replace(tmp_path, file_path)
+        return len(entries)
+
+    def stats(self):
+        return {'hits':self.hits,
+                'misses':self.misses,
+                'evictions':self.evictions,
+                'size':len(self.cache)}
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.reported = (0, 0, 0)
+
+    def delta(self):
+        #Lookups and new (word,pos):lemma entries since the last call, sent back by a pipeline worker with each block
+        hits, misses, evictions = self.reported
+        delta = {'hits':self.hits-hits,
+                 'misses':self.misses-misses,
+                 'evictions':self.evictions-evictions,
+                 'new':[(key, self.cache[key]) for key in self.new if key in self.cache]}
+        self.new.clear()
+        self.reported = (self.hits, self.misses, self.evictions)
+        return delta
+
+    def merge(self, delta):
+        #Adds the lookups of a worker's delta() to the stats and its new entries to the cache
+        self.hits += delta['hits']
+        self.misses += delta['misses']
+        self.evictions += delta['evictions']
+        #Counted as reported, so the workers forked from this process later do not send them back again
+        self.reported = tuple(reported+delta[name] for reported, name in zip(self.reported, ('hits', 'misses', 'evictions')))
+        cache = self.cache
+        for key, lemma in delta['new']:
+            cache[key] = lemma
+            cache.move_to_end(key)
+        while len(cache) > self.max_size:
+            cache.popitem(last=False)
+
+def format_stats(stats):
+    lookups = stats['hits']+stats['misses']
+    hit_rate = stats['hits']/lookups if lookups else 0
+    return 'Lemma cache: {} hits, {} misses ({:.1%} hit rate), {} evictions'.format(stats['hits'], stats['misses'], hit_rate, stats['evictions'])
@@ -0,0 +1,284 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# # Compiled lexeme filter
+#
+# `unigram_tests()` decides whether a tagged 1-gram is a lexeme. The original version (kept below as `reference_unigram_tests`)
+# runs a regex, builds `set(unigram)` twice, indexes several characters and calls `unidecode()` for every token.
+#
+# All of its rules can be expressed as a single regular expression over one character class:
+# - `unidecode(unigram) == unigram` only holds for pure ASCII strings (unidecode returns ASCII for every other character),
+#   so only ASCII characters are allowed, which also rules out the non-ASCII dashes and quotes
+# - no character from STOPS (punctuation and digits, except the ASCII dash and underscore)
+# - exactly one underscore, which is neither the first nor the last character
+# - the first and last characters are not dashes
+# - at least one vowel
+#
+# `lexeme_rows()` runs the same filter on a raw block of rows, before anything is decoded: since a lexeme is pure ASCII, the filter
+# is also a bytes regular expression, built from the same pattern as `LEXEME`, and one `findall()` over the block returns the token
+# and entries of the rows that pass.
+# The rows that do not are skipped inside the regex engine without being split, copied or decoded, and the rows that pass give
+# the same (unigram, entries) as `row.partition('\t')` and `unigram_tests()` on the stripped and decoded rows.
+# To count the rejected rows by rule (see ingest_metrics.py), `lexeme_rows(block, rejections)` also captures the skipped rows and
+# `rejection_rule()` finds the first rule each one breaks, in the order of the original tests.
+#
+# `tests/test_lexeme_filter.py` checks the compiled filter against the reference. Run `python lexeme_filter.py` to compare them
+# on a large random token corpus and measure their speed.
+
+import re
+import string
+
+PUNCTUATION = set(char for char in string.punctuation).union({'“','”'})
+DIGITS = set(string.digits)
+VOWELS = set("aeiouyAEIOUY")
+#Excluding '_' (underscore) from DASHES precludes the tagged 1grams "_NOUN", add it to also include the tagged 1grams
+DASHES = {'—','–','—','―','‒','-','_'}
+PUNCTUATION.difference_update(DASHES)
+STOPS = PUNCTUATION.union(DIGITS)
+
+underscore = re.compile('_{1}')
+
+def _char_class(chars):
+    return '['+''.join(re.escape(char) for char in sorted(chars))+']'
+
+#Every ASCII character which may appear in the word or tag part of a lexeme
+_WORD_CHARS = set(chr(i) for i in range(128)).difference(STOPS, {'_'})
+#The first and last characters additionally cannot be dashes
+_EDGE_CHARS = _WORD_CHARS.difference(DASHES)
+_VOWEL_CLASS = _char_class(VOWELS)
+
+def _lexeme_pattern(excluded=(), excluded_first=()):
+    '''
+    The word tests as a pattern over the character classes above. No character of excluded may be in the token and none of
+    excluded_first may start it: the row filter below is built from the same pattern, kept inside the token of one row.
+    '''
+    return (_char_class(_EDGE_CHARS.difference(excluded, excluded_first))  #word, not starting with a dash or underscore
+            #at least one vowel, the first character is checked before looking further in the token
+            +'(?:(?<='+_VOWEL_CLASS+')|(?=[^'+_VOWEL_CLASS[1:-1]+''.join(re.escape(char) for char in sorted(excluded))+']*'+_VOWEL_CLASS+'))'
+            +_char_class(_WORD_CHARS.difference(excluded))+'*'
+            +'_'  #exactly one underscore
+            +_char_class(_WORD_CHARS.difference(excluded))+'*'+_char_class(_EDGE_CHARS.difference(excluded)))  #tag, not ending with a dash or underscore
+
+LEXEME = re.compile(_lexeme_pattern())
+_lexeme_match = LEXEME.fullmatch
+
+def unigram_tests(unigram):
+    #Same result as reference_unigram_tests(unigram)
+    return _lexeme_match(unigram) is not None
+
+#Rules of reference_unigram_tests(), in the order they are checked
+REJECTION_RULES = ('underscores', 'punctuation_or_digits', 'underscore_edge', 'no_vowel', 'dash_edge', 'non_ascii')
+
+def rejection_rule(unigram):
+    #First rule of REJECTION_RULES the unigram breaks, None if it is a lexeme
+    if unigram.count('_') != 1:
+        return 'underscores'
+    chars = set(unigram)
+    if not STOPS.isdisjoint(chars):
+        return 'punctuation_or_digits'
+    if unigram[0] == '_' or unigram[-1] == '_':
+        return 'underscore_edge'
+    if VOWELS.isdisjoint(chars):
+        return 'no_vowel'
+    if unigram[0] in DASHES or unigram[-1] in DASHES:
+        return 'dash_edge'
+    if not unigram.isascii():
+        return 'non_ascii'
+    return None
+
+#Every character str.strip() removes (they are all below U+3000) except the newline which ends the rows
+WHITESPACE = set(chr(i) for i in range(0x3001) if chr(i).isspace()).difference({'\n'})
+
+def _byte_class(chars):
+    return _char_class(chars).encode('ascii')
+
+def whitespace_bytes(whitespace=WHITESPACE):
+    #Bytes pattern of one of the utf8 encoded characters, the multibyte ones grouped by their first byte so most rows are ruled out by two byte classes
+    multibyte = dict()
+    for char in sorted(whitespace):
+        if ord(char) >= 128:
+            encoded = char.encode('utf8')
+            multibyte.setdefault(encoded[:1], []).append(re.escape(encoded[1:]))
+    return (b'(?:'+_byte_class(set(char for char in whitespace if ord(char) < 128))+b'|(?='+b'['+b''.join(re.escape(lead) for lead in multibyte)+b'])(?:'
+            +b'|'.join(re.escape(lead)+b'(?:'+b'|'.join(tails)+b')' for lead, tails in multibyte.items())+b'))')
+WHITESPACE_BYTES = whitespace_bytes()
+
+#The token of a row never holds a tab or a newline, and does not start with whitespace once the row is stripped
+#A lexeme is pure ASCII, so the pattern is the same as a bytes pattern
+_ROW_TOKEN = _lexeme_pattern('\t\n', WHITESPACE).encode('ascii')
+
+def _lexeme_row(group=b'('):
+    #The whitespace strip() removes, the token (group 1), then a tab and the entries (group 2) or the whitespace at the end of the row
+    return b'^'+WHITESPACE_BYTES+b'*'+group+_ROW_TOKEN+b')(?:\t'+group+b'.*)|'+WHITESPACE_BYTES+b'*)$'
+
+#Each match skips the rows that are not lexemes and ends with the next row that is, or with the rest of the block (empty groups) after the last one.
+#Matching from the first position every time keeps the scan linear, and the rejected rows never leave the regex engine
+LEXEME_ROWS = re.compile(b'(?:(?!'+_lexeme_row(b'(?:')+b').*\n)*(?:'+_lexeme_row()+b'|.*\\Z)', re.M)
+#Same matches, with the skipped rows (group 1) and the partial row at the end of the block (group 4)
+LEXEME_ROWS_REJECTED = re.compile(b'((?:(?!'+_lexeme_row(b'(?:')+b').*\n)*)(?:'+_lexeme_row()+b'|(.*)\\Z)', re.M)
+
+def _reject(row, rejections):
+    rule = rejection_rule(row.decode('utf8').strip().partition('\t')[0])
+    rejections[rule] = rejections.get(rule, 0)+1
+
+def _counting_rejections(matches, rejections):
+    for i, (skipped, unigram, entries, tail) in enumerate(matches):
+        #After the first match, the skipped rows start with the newline that ends the lexeme row of the previous match
+        #and every skipped row ends with a newline
+        for row in skipped[i > 0:].split(b'\n')[:-1]:
+            _reject(row, rejections)
+        if tail:
+            _reject(tail, rejections)
+        yield unigram, entries
+
+def lexeme_rows(block, rejections=None):
+    '''
+    Yields (unigram, entries) for the rows of a block of raw bytes whose unigram is a lexeme, the same pairs as
+    row.partition('\t') of every stripped and decoded row that passes unigram_tests().
+    With a rejections dictionary, the other rows are counted in it by the first rule they break ({rule: rows}).
+    '''
+    if rejections is None:
+        matches = LEXEME_ROWS.findall(block)
+    else:
+        matches = _counting_rejections(LEXEME_ROWS_REJECTED.findall(block), rejections)
+    for unigram, entries in matches:
+        if not unigram:
+            continue
+        #Only the end of the row is stripped
+        entries = entries.decode('utf8').rstrip()
+        if entries:
+            yield unigram.decode('ascii'), entries
+            continue
+        #Without entries, strip() also removes the tab and the whitespace at the end of the token
+        unigram = unigram.decode('ascii').rstrip()
+        if unigram_tests(unigram):
+            yield unigram, ''
+        elif rejections is not None:
+            rule = rejection_rule(unigram)
+            rejections[rule] = rejections.get(rule, 0)+1
+
+def reference_unigram_tests(unigram):
+    #The original per-token implementation, kept for the equivalence check
+    from unidecode import unidecode
+
+    #Exclude words with more than one underscore, can make this != to only include tagged words
+    if len(underscore.findall(unigram))!=1:
+        return False
+
+    #Checks each character in the unigram against the characters in the STOP set. (character level filtering) - no punctuation or digits allowed
+    if set(unigram).intersection(STOPS):
+        return False
+
+    #Excluded all of the form _PRON_ (or anything that starts or ends with an underscore)
+    if unigram[0] == '_' or unigram[-1] == '_':
+        return False
+
+    #must have a vowel (presupposes that it must also have a letter of the alphabet inside)
+    if not set(unigram).intersection(VOWELS):
+        return False
+
+    #Words cannot start or end with dashes
+    if unigram[0] in DASHES or unigram[-1] in DASHES:
+        return False
+
+    #must have 0 non-english letters
+    test = unidecode(unigram, errors='replace')
+    if test != unigram:
+        return False
+
+    #Can implement more tests here if you need to do more filtering
+
+    else:
+        return True
+
+def random_tokens(n, seed=0):
+    #Token corpus mixing realistic tagged words with every kind of character the rules look at
+    import random
+    rng = random.Random(seed)
+    tags = ['NOUN','VERB','ADJ','ADV','PRON','DET','ADP','NUM','CONJ','PRT','X','']
+    words = ['colour','color','the','she','running','rhythm','brrr','co-op','naïve','día','kožušček','Über','ab','Y','a']
+    pool = (string.ascii_letters*4+string.digits+string.punctuation+'__--'+''.join(DASHES)
+            +'“”’ éüßçñ ́漢字ЖΩ\t ')
+    tokens = []
+    for i in range(n):
+        kind = rng.random()
+        if kind < 0.5:
+            token = rng.choice(words)+'_'+rng.choice(tags)
+        else:
+            token = ''.join(rng.choice(pool) for _ in range(rng.randint(0,12)))
+            if kind < 0.8:
+                cut = rng.randint(0,len(token))
+                token = token[:cut]+'_'+token[cut:]
+        tokens.append(token)
+    return tokens
+
+def compare(n=1000000, seed=0):
+    import time
+    tokens = random_tokens(n, seed)
+
+    start = time.perf_counter()
+    expected = [reference_unigram_tests(token) for token in tokens]
+    reference_time = time.perf_counter()-start
+
+    start = time.perf_counter()
+    found = [unigram_tests(token) for token in tokens]
+    compiled_time = time.perf_counter()-start
+
+    mismatches = [token for token, e, f in zip(tokens, expected, found) if e != f or (rejection_rule(token) is None) != e]
+    print(n, 'tokens,', sum(expected), 'accepted by the reference,', len(mismatches), 'mismatches')
+    print('reference unigram_tests: {:,.0f} tokens/sec'.format(n/reference_time))
+    print('compiled  unigram_tests: {:,.0f} tokens/sec ({:.1f}x)'.format(n/compiled_time, reference_time/compiled_time))
+    return mismatches
+
+def random_block(n, seed=0):
+    #Raw rows of random tokens, with the whitespace strip() removes around them and entries that are sometimes missing or blank
+    import random
+    rng = random.Random(seed)
+    spaces = ['', ' ', '\t', '\r', '\x1c', '\xa0', '\u3000', ' \t ']
+    tails = ['\t1850,3,2\t1851,1,1', '\t1850,3,2', '\t', '\t \t', '', ' ', '\t1850,3,2\r']
+    rows = [rng.choice(spaces)+token+rng.choice(tails)+rng.choice(spaces) if rng.random() < 0.3 else token+rng.choice(tails[:2])
+            for token in random_tokens(n, seed)]
+    return '\n'.join(rows).encode('utf8')
+
+def compare_rows(n=1000000, seed=0):
+    import time
+    block = random_block(n, seed)
+
+    start = time.perf_counter()
+    expected = []
+    for line in block.split(b'\n'):
+        unigram, _, entries = line.decode('utf8').strip().partition('\t')
+        if unigram_tests(unigram):
+            expected.append((unigram, entries))
+    decode_time = time.perf_counter()-start
+    expected_rejections = dict()
+    for line in block.split(b'\n'):
+        rule = rejection_rule(line.decode('utf8').strip().partition('\t')[0])
+        if rule is not None:
+            expected_rejections[rule] = expected_rejections.get(rule, 0)+1
+
+    start = time.perf_counter()
+    found = list(lexeme_rows(block))
+    bytes_time = time.perf_counter()-start
+
+    start = time.perf_counter()
+    rejections = dict()
+    counted = list(lexeme_rows(block, rejections))
+    counting_time = time.perf_counter()-start
+
+    print(n, 'rows,', len(expected), 'kept by decoding every row,', 'same rows' if found == expected else 'DIFFERENT ROWS', 'from lexeme_rows')
+    print('decode, partition and unigram_tests: {:,.0f} rows/sec'.format(n/decode_time))
+    print('lexeme_rows on the raw block:        {:,.0f} rows/sec ({:.1f}x)'.format(n/bytes_time, decode_time/bytes_time))
+    print('counting the rejections:             {:,.0f} rows/sec,'.format(n/counting_time), 'same counts' if rejections == expected_rejections else 'DIFFERENT COUNTS', rejections)
+    mismatches = [row for row in found if row not in expected]+[row for row in expected if row not in found] if found != expected else []
+    if counted != found or rejections != expected_rejections:
+        mismatches.append(('rejections', rejections, expected_rejections))
+    return mismatches
+
+if __name__ == '__main__':
+    import sys
+    mismatches = compare(int(sys.argv[1]) if len(sys.argv)>1 else 1000000)
+    mismatches += compare_rows(int(sys.argv[1]) if len(sys.argv)>1 else 1000000)
+    if mismatches:
+        print('MISMATCHES:', mismatches[:20])
+        raise SystemExit(1)
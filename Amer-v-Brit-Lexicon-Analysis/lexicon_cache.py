@@ -0,0 +1,246 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# # Result cache of the lexicons
+#
+# `create_lexicon.py` creates a lexicon from the `-COMPLETE.json` shards every time it is run, even for a window it already created
+# from the same shards, and the name of a LEXICON file only says which years and step it covers, not which shards it was created from.
+#
+# The cache keeps every lexicon it is given under a fingerprint of everything that determines it:
+# - the sha256 of every `-COMPLETE.json` of the corpus, in the order `create_lexicons()` reads them
+#   (a lemma in several shards takes its record from the last one, so the order is part of the input)
+# - t_start, t_end and t_step (and the POS tags of a lexicon restricted to some tags)
+# - the version of the code that creates lexicons (`create_lexicon.LEXICON_VERSION`)
+# so a lexicon is only created again when its shards, its window or the code change, whatever the directory or the name of the files.
+#
+# A cache is a directory with:
+# - `<fingerprint>/`: one entry per lexicon, with the LEXICON JSON file and its ranking index as `create_lexicon.py` saves them
+#   and `entry.json` (name, window, version, shards, size in bytes, time of creation and of last use)
+# - `hashes.json`: the sha256 of the shards, reused as long as their size and modification time do not change, so a shard is only hashed once
+#
+# A hit copies the files of the entry back to the corpus directory (nothing is copied if they are still there unchanged since the last copy).
+# The entries are evicted least recently used first when the cache grows past its maximum size.
+#
+# Usage:
+# `python create_lexicon.py -p C:\path\to\amer_unigram_data\ -b 1851 -e 1900 --cache C:\path\to\lexicon_cache\` only creates the lexicon if the cache does not have it
+# `python lexicon_cache.py C:\path\to\lexicon_cache\` lists the entries of a cache
+# `python lexicon_cache.py C:\path\to\lexicon_cache\ --prune --max-size 10 --older-than 30` evicts entries down to 10 GB and removes the ones unused for 30 days
+
+import os
+import json
+import time
+import shutil
+import hashlib
+
+CACHE_FORMAT = 1
+#Default maximum size of a cache in GB
+MAX_SIZE = 20
+ENTRY_NAME = 'entry.json'
+HASHES_NAME = 'hashes.json'
+
+def _directory_size(path):
+    return sum(os.path.getsize(os.path.join(root, file_name)) for root, _, file_names in os.walk(path) for file_name in file_names)
+
+def _copy(source, destination):
+    #Copies a file or a directory (a ranking index), replacing what is at destination
+    #Modification times are kept, a ranking index records the size and modification time of its LEXICON file
+    if os.path.isdir(source):
+        if os.path.exists(destination):
+            shutil.rmtree(destination)
+        shutil.copytree(source, destination)
+    else:
+        shutil.copy2(source, destination)
+
+def _stat(path):
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+def file_hash(path, block_size=1024*1024):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+class LexiconCache:
+    def __init__(self, path, max_size=MAX_SIZE):
+        self.path = path
+        self.max_bytes = int(max_size*1024**3)
+        os.makedirs(path, exist_ok=True)
+        hashes_path = os.path.join(path, HASHES_NAME)
+        self.hashes = dict()
+        if os.path.exists(hashes_path):
+            with open(hashes_path, 'r') as f:
+                self.hashes = json.load(f)
+
+    def _save_hashes(self):
+        tmp_path = os.path.join(self.path, HASHES_NAME+'.'+str(os.getpid())+'.tmp')
+        with open(tmp_path, 'w') as f_out:
+            json.dump(self.hashes, f_out, indent=1)
+        os.replace(tmp_path, os.path.join(self.path, HASHES_NAME))
+
+    def shard_hash(self, path):
+        #sha256 of a shard, hashed again only when its size or modification time changed
+        path = os.path.abspath(path)
+        stat = _stat(path)
+        known = self.hashes.get(path)
+        if known is not None and known['stat'] == stat:
+            return known['sha256']
+        print('Hashing', os.path.basename(path))
+        self.hashes[path] = {'stat':stat, 'sha256':file_hash(path)}
+        self._save_hashes()
+        return self.hashes[path]['sha256']
+
+    def shards(self, directory):
+        #[(file name, sha256)] of the -COMPLETE.json files, in the order create_lexicons() reads them
+        return [(file_name, self.shard_hash(directory+file_name)) for file_name in os.listdir(directory) if '-COMPLETE.json' in file_name]
+
+    def key(self, directory, window, version, tags=None):
+        #Fingerprint of the lexicon of window (t_start, t_end, t_step) created from the shards of directory by version of the code
+        #(restricted to the POS tags tags, if any)
+        t_start, t_end, t_step = window
+        inputs = {'format':CACHE_FORMAT, 'version':version, 'window':[t_start, t_end, t_step], 'shards':self.shards(directory)}
+        if tags:
+            inputs['tags'] = list(tags)
+        return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode('utf8')).hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.path, key)
+
+    def entry(self, key):
+        #entry.json of a key, None if the cache does not have it
+        entry_file = os.path.join(self._entry_path(key), ENTRY_NAME)
+        if not os.path.exists(entry_file):
+            return None
+        with open(entry_file, 'r') as f:
+            return json.load(f)
+
+    def _save_entry(self, key, entry, entry_path=None):
+        entry_file = os.path.join(entry_path or self._entry_path(key), ENTRY_NAME)
+        tmp_path = entry_file+'.'+str(os.getpid())+'.tmp'
+        with open(tmp_path, 'w') as f_out:
+            json.dump(entry, f_out, indent=1)
+        os.replace(tmp_path, entry_file)
+
+    def restore(self, key, directory, name):
+        '''
+        Copies the lexicon name (LEXICON file and ranking index) of key back to directory.
+        Returns the entry, or None if the cache does not have it.
+        '''
+        entry = self.entry(key)
+        if entry is None:
+            return None
+        copies = entry.setdefault('copies', dict())
+        for file_name in entry['files']:
+            destination = os.path.abspath(directory+name+os.path.splitext(file_name)[1])
+            #Still the file copied the last time, nothing to do
+            if os.path.exists(destination) and copies.get(destination) == _stat(destination):
+                continue
+            _copy(os.path.join(self._entry_path(key), file_name), destination)
+            copies[destination] = _stat(destination)
+        entry['used'] = time.time()
+        self._save_entry(key, entry)
+        return entry
+
+    def add(self, key, directory, name, window, version, lexemes):
+        '''
+        Adds the lexicon name saved in directory (its LEXICON file and ranking index, none for an empty lexicon) under key,
+        then evicts the least recently used entries past the maximum size.
+        '''
+        entry_path = self._entry_path(key)
+        if os.path.exists(os.path.join(entry_path, ENTRY_NAME)):
+            return entry_path
+        tmp_path = entry_path+'.'+str(os.getpid())+'.tmp'
+        os.makedirs(tmp_path, exist_ok=True)
+        files, copies = [], dict()
+        for suffix in ('.json', '.rank') if lexemes else ():
+            source = directory+name+suffix
+            if os.path.exists(source):
+                _copy(source, os.path.join(tmp_path, name+suffix))
+                files.append(name+suffix)
+                copies[os.path.abspath(source)] = _stat(source)
+        now = time.time()
+        self._save_entry(key, {'format':CACHE_FORMAT, 'name':name, 'window':list(window), 'version':version, 'lexemes':lexemes,
+                               'directory':os.path.abspath(directory), 'shards':self.shards(directory), 'files':files, 'copies':copies,
+                               'bytes':_directory_size(tmp_path), 'created':now, 'used':now}, tmp_path)
+        try:
+            os.replace(tmp_path, entry_path)
+        except OSError:
+            #Added by another process in the meantime
+            shutil.rmtree(tmp_path, ignore_errors=True)
+        self.evict()
+        return entry_path
+
+    def entries(self):
+        #[(key, entry)] of every complete entry, least recently used first
+        entries = []
+        for key in os.listdir(self.path):
+            entry = self.entry(key) if os.path.isdir(self._entry_path(key)) else None
+            if entry is not None:
+                entries.append((key, entry))
+        return sorted(entries, key=lambda item: item[1]['used'])
+
+    def size(self):
+        return sum(entry['bytes'] for key, entry in self.entries())
+
+    def remove(self, key):
+        shutil.rmtree(self._entry_path(key), ignore_errors=True)
+
+    def evict(self, max_bytes=None):
+        #Removes the least recently used entries until the cache holds at most max_bytes, returns the removed entries
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        entries = self.entries()
+        total = sum(entry['bytes'] for key, entry in entries)
+        removed = []
+        for key, entry in entries:
+            if total <= max_bytes:
+                break
+            self.remove(key)
+            total -= entry['bytes']
+            removed.append((key, entry))
+        return removed
+
+    def prune(self, max_bytes=None, older_than=None):
+        #Removes the entries unused for older_than days, then evicts down to max_bytes
+        removed = []
+        if older_than is not None:
+            for key, entry in self.entries():
+                if time.time()-entry['used'] > older_than*86400:
+                    self.remove(key)
+                    removed.append((key, entry))
+        #Interrupted additions
+        for file_name in os.listdir(self.path):
+            if file_name.endswith('.tmp') and os.path.isdir(os.path.join(self.path, file_name)):
+                shutil.rmtree(os.path.join(self.path, file_name), ignore_errors=True)
+        return removed+self.evict(max_bytes)
+
+def format_entry(key, entry):
+    #One line per entry
+    return '{}  {:<30} {:>12,} lexemes {:>10.1f} MB  used {}  {}'.format(key[:12], entry['name'], entry['lexemes'], entry['bytes']/1024**2,
+                                                                           time.strftime('%Y-%m-%d %H:%M', time.localtime(entry['used'])), entry['directory'])
+
+if __name__ == '__main__':
+
+    import argparse
+    parser = argparse.ArgumentParser(description='Lists and prunes a cache of lexicons created by create_lexicon.py --cache')
+
+    parser.add_argument('path', type=str, help="absolute path to the cache directory")
+    parser.add_argument('--prune', action='store_true', help="Evict the least recently used entries down to --max-size and remove the ones older than --older-than")
+    parser.add_argument('--max-size', type=float, required=False, default=MAX_SIZE, help="Maximum size of the cache in GB. Default is "+str(MAX_SIZE))
+    parser.add_argument('--older-than', type=float, required=False, default=None, help="With --prune, remove the entries unused for this many days")
+    parser.add_argument('--clear', action='store_true', help="Remove every entry")
+
+    args = parser.parse_args()
+    cache = LexiconCache(args.path, args.max_size)
+    if args.clear:
+        removed = cache.prune(max_bytes=0)
+        print('Removed', len(removed), 'entries')
+    elif args.prune:
+        removed = cache.prune(older_than=args.older_than)
+        for key, entry in removed:
+            print('REMOVED: ', format_entry(key, entry))
+        print('Removed', len(removed), 'entries')
+    entries = cache.entries()
+    for key, entry in reversed(entries):
+        print(format_entry(key, entry))
+    print(len(entries), 'entries,', '{:.1f} of {:.1f} GB'.format(sum(entry['bytes'] for key, entry in entries)/1024**3, cache.max_bytes/1024**3))
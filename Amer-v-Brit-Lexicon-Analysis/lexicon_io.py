@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# # Streaming LEXICON writer and reader
+#
+# `create_lexicon.main()` keeps the whole lexicon in memory, makes another pass over it in `add_frequency()` and dumps it with one `json.dump`,
+# and the notebooks `json.load` the whole file back.
+#
+# `LexiconWriter` serializes every lexeme as soon as its sublexicon is finalized and only keeps track of the total usage.
+# A lexeme can be in more than one shard: to keep the `dict.update` semantics (first position, last record) without remembering
+# every lexeme, the serialized lexemes are spilled to a temporary file in sorted runs of at most `RUN_LEXEMES`.
+# When the total usage is known, `close()` merges the runs to resolve the duplicates, sorts them back into their first positions
+# (again in runs) and makes a last streaming pass which adds the frequency and writes the LEXICON JSON,
+# byte for byte what `json.dump` would have written for the in-memory lexicon.
+#
+# `iter_lexicon()` reads a LEXICON JSON one lexeme at a time.
+
+import os
+import json
+import heapq
+
+#Serialized lexemes held in memory before they are spilled as a sorted run, bounds the memory of a LexiconWriter
+RUN_LEXEMES = 100000
+
+def _iter_run(f_in, start, end, buffer_size=64*1024):
+    #Entries of the run written between the offsets start and end of the open file f_in, read in chunks
+    #The runs being merged share f_in, so there is one open file however many runs there are
+    rest = b''
+    while start < end:
+        f_in.seek(start)
+        chunk = f_in.read(min(buffer_size, end-start))
+        start += len(chunk)
+        lines = (rest+chunk).split(b'\n')
+        rest = lines.pop()
+        for line in lines:
+            yield line.decode('utf8').split('\t')
+
+class LexiconWriter:
+    def __init__(self, directory, file_name):
+        self.path = directory+file_name+'.json'
+        self.tmp_path = self.path+'.part'
+        self.order_path = self.path+'.order'
+        self.f_tmp = open(self.tmp_path, 'wb')
+        #(start, end) offsets of the sorted runs in the temporary file
+        self.runs = []
+        #(lexeme JSON, position, record JSON) not spilled yet, position is the order in which the lexemes were written
+        self.buffer = []
+        self.count = 0
+        self.size = 0
+
+    def _spill(self, f_out, entries):
+        #Writes entries as one sorted run, each field of an entry is a JSON value or an int so none of them has a tab
+        start = f_out.tell()
+        for entry in sorted(entries):
+            f_out.write(('\t'.join(map(str, entry))+'\n').encode('utf8'))
+        return start, f_out.tell()
+
+    def update(self, sublexicon):
+        #Same semantics as lexicon.update(sublexicon): a lexeme keeps its first position and takes its last record
+        for lexeme, record in sublexicon.items():
+            self.buffer.append((json.dumps(lexeme), self.count, json.dumps(record)))
+            self.count += 1
+            if len(self.buffer) >= RUN_LEXEMES:
+                self.runs.append(self._spill(self.f_tmp, self.buffer))
+                self.buffer = []
+
+    def __len__(self):
+        #Number of lexemes, known once the writer is closed
+        return self.size
+
+    def _resolved(self):
+        #(position, lexeme JSON, record JSON) of every lexeme once: the runs are merged by lexeme, the first position and the last record are kept
+        with open(self.tmp_path, 'rb') as f_tmp:
+            runs = [_iter_run(f_tmp, start, end) for start, end in self.runs]
+            runs.append(map(lambda entry: list(map(str, entry)), sorted(self.buffer)))
+            self.buffer = []
+            lexeme = None
+            for entry_lexeme, position, record in heapq.merge(*runs, key=lambda entry: (entry[0], int(entry[1]))):
+                if entry_lexeme != lexeme:
+                    if lexeme is not None:
+                        yield first, lexeme, last
+                    lexeme, first = entry_lexeme, int(position)
+                last = record
+            if lexeme is not None:
+                yield first, lexeme, last
+
+    def close(self, total_usage):
+        #Resolves the lexemes written more than once, then a last pass adds the frequency of every lexeme and writes the final JSON
+        output = os.path.basename(self.path)
+        try:
+            self.f_tmp.close()
+            if self.count == 0:
+                print('unigram dict empty',output)
+                return self.path
+            #Back into the order of their first positions, sorted in runs too
+            self.size = 0
+            runs, entries = [], []
+            with open(self.order_path, 'wb') as f_order:
+                for entry in self._resolved():
+                    entries.append(entry)
+                    self.size += 1
+                    if len(entries) >= RUN_LEXEMES:
+                        runs.append(self._spill(f_order, entries))
+                        entries = []
+                runs.append(self._spill(f_order, entries))
+            os.remove(self.tmp_path)
+            with open(self.order_path, 'rb') as f_order, open(self.path+'.tmp', 'w') as f_out:
+                f_out.write('{')
+                separator = ''
+                for position, lexeme, record in heapq.merge(*[_iter_run(f_order, start, end) for start, end in runs], key=lambda entry: int(entry[0])):
+                    record = json.loads(record)
+                    record['frequency'] = record['sum_usage']/total_usage
+                    f_out.write(separator+lexeme+': '+json.dumps(record))
+                    separator = ', '
+                f_out.write('}')
+            os.replace(self.path+'.tmp', self.path)
+            print('SAVED: ',output,self.size)
+            return self.path
+        finally:
+            self.discard()
+
+    def discard(self):
+        #Closes and removes the temporary files, the lexicon is not saved unless close() got to the end
+        self.f_tmp.close()
+        self.buffer = []
+        for tmp_path in (self.tmp_path, self.order_path, self.path+'.tmp'):
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+def iter_lexicon(directory, file_path, buffer_size=1024*1024):
+    '''
+    Yields (lexeme, record) pairs of a LEXICON JSON (or any JSON object of objects) without loading the whole file.
+    '''
+    decoder = json.JSONDecoder()
+    with open(directory+file_path, 'r') as f:
+        buffer = ''
+        position = 0
+        eof = False
+
+        def fill():
+            nonlocal buffer, position, eof
+            chunk = f.read(buffer_size)
+            if not chunk:
+                eof = True
+            buffer = buffer[position:]+chunk
+            position = 0
+
+        def skip(expected):
+            #Skips whitespace and returns the next character, which has to be one of expected
+            nonlocal position
+            while True:
+                while position < len(buffer) and buffer[position].isspace():
+                    position += 1
+                if position < len(buffer):
+                    char = buffer[position]
+                    if char not in expected:
+                        raise ValueError('Expected one of '+expected+' at '+repr(buffer[position:position+50]))
+                    position += 1
+                    return char
+                if eof:
+                    raise ValueError('Unexpected end of '+file_path)
+                fill()
+
+        def value():
+            #Decodes the next JSON value, reading more of the file if it is cut by the end of the buffer
+            nonlocal position
+            while True:
+                while position < len(buffer) and buffer[position].isspace():
+                    position += 1
+                try:
+                    decoded, end = decoder.raw_decode(buffer, position)
+                    #A number at the very end of the buffer could continue in the next chunk
+                    if end < len(buffer) or eof:
+                        position = end
+                        return decoded
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                fill()
+
+        skip('{')
+        if skip('"}') == '}':
+            return
+        position -= 1
+        while True:
+            lexeme = value()
+            skip(':')
+            record = value()
+            yield lexeme, record
+            if skip(',}') == '}':
+                return
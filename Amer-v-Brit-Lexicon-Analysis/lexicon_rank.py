@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# # Ranking index of a lexicon
+#
+# The notebooks get the top 25 or 500 lexemes of a metric with
+# `top_counts(dictionary, count_type)`, which sorts every `dictionary.items()` in Python for every call.
+#
+# A ranking index is saved next to a LEXICON file (`LEXICON_1851-1900_STEP1.rank`) when the lexicon is created. It is a directory of numpy arrays:
+# - `vocab_blob.npy`, `vocab_offsets.npy`: the lexemes in the order of the LEXICON file, and `by_word.npy`, their order by utf8 bytes for lookups
+# - for every metric (`sum_usage`, `median_usage`, `mean_usage`, `max_usage`, `min_usage`, `frequency`):
+#   `<metric>.npy` with the values, `<metric>_order.npy` with the lexemes from highest to lowest and `<metric>_rank.npy` with the rank of each lexeme
+# - `meta.json`: number of lexemes, metrics and the file it was built from, with its size and modification time
+#
+# An index whose LEXICON file changed since (e.g. the lexicon was created again without its index) is stale: `open_rank_index()` builds it again.
+#
+# The arrays are opened memory-mapped, so the top K of a metric is a slice of its order and the rank of a lexeme is one binary search and one read.
+# The order is the same as `sorted(..., reverse=True)`: lexemes with equal values keep the order of the LEXICON file.
+# `top_indices()` does the same by partial selection for a bottom K or for any array of values (e.g. `total_uses` of the 5-gram clusters),
+# and `top_counts()` is a drop-in for the notebooks' function on a dictionary.
+#
+# Usage:
+# `python lexicon_rank.py C:\path\to\amer_unigram_data\` builds the index of every LEXICON file of a directory that does not have a current one
+
+import os
+import json
+import numpy as np
+from collections import OrderedDict
+
+from lexicon_io import iter_lexicon
+from ngram_store import file_stat
+
+RANK_FORMAT = 1
+RANK_SUFFIX = '.rank'
+
+def top_indices(values, k, head=True):
+    '''
+    Indices of the k highest (head=True) or lowest values, in the order sorted(range(len(values)), key=values.__getitem__, reverse=head)[:k]
+    would give, without sorting all the values.
+    '''
+    values = np.asarray(values)
+    k = max(0, min(k, len(values)))
+    keys = -values if head else values
+    if k == 0:
+        return np.zeros(0, dtype=np.int64)
+    if k < len(values):
+        kth = np.partition(keys, k-1)[k-1]
+        smaller = np.flatnonzero(keys < kth)
+        #Equal values keep their original order, so the first ones are taken
+        ties = np.flatnonzero(keys == kth)[:k-len(smaller)]
+        candidates = np.sort(np.concatenate([smaller, ties]))
+    else:
+        candidates = np.arange(len(values))
+    return candidates[np.argsort(keys[candidates], kind='stable')]
+
+def top_counts(dictionary, count_type, num_hits=25, head=True):
+    #Same as the notebooks' top_counts(): OrderedDict of the num_hits records with the highest (head) or lowest count_type
+    items = list(dictionary.items())
+    values = np.array([record[count_type] for lexeme, record in items])
+    return OrderedDict(items[i] for i in top_indices(values, num_hits, head).tolist())
+
+def rank_path_for(directory, file_name):
+    #LEXICON_1851-1900_STEP1.json -> LEXICON_1851-1900_STEP1.rank
+    return directory+os.path.splitext(file_name)[0]+RANK_SUFFIX
+
+def _metric_array(values):
+    #int64 when every value is an int, so the records read back from the index have the same types as the LEXICON file
+    if all(type(value) is int for value in values):
+        return np.array(values, dtype=np.int64)
+    return np.array(values, dtype=np.float64)
+
+def save_rank_index(lexemes, metrics, rank_path, source=None, source_stat=None):
+    '''
+    lexemes are in the order of the LEXICON file, metrics is {metric: list of values of every lexeme}.
+    source_stat is the file_stat() of the LEXICON file the lexemes were read from.
+    Writes the ranking index directory and returns its path.
+    '''
+    encoded = [lexeme.encode('utf8') for lexeme in lexemes]
+    vocab_offsets = np.zeros(len(encoded)+1, dtype=np.int64)
+    np.cumsum([len(word) for word in encoded], out=vocab_offsets[1:])
+    by_word = np.array(sorted(range(len(encoded)), key=encoded.__getitem__), dtype=np.int64)
+
+    os.makedirs(rank_path, exist_ok=True)
+    np.save(os.path.join(rank_path, 'vocab_blob.npy'), np.frombuffer(b''.join(encoded), dtype=np.uint8))
+    np.save(os.path.join(rank_path, 'vocab_offsets.npy'), vocab_offsets)
+    np.save(os.path.join(rank_path, 'by_word.npy'), by_word)
+    for metric, values in metrics.items():
+        values = _metric_array(values)
+        order = top_indices(values, len(values))
+        rank = np.empty(len(values), dtype=np.int64)
+        rank[order] = np.arange(1, len(values)+1)
+        np.save(os.path.join(rank_path, metric+'.npy'), values)
+        np.save(os.path.join(rank_path, metric+'_order.npy'), order)
+        np.save(os.path.join(rank_path, metric+'_rank.npy'), rank)
+    #meta.json is written last, an index without it is incomplete
+    with open(os.path.join(rank_path, 'meta.json'), 'w') as f_out:
+        json.dump({'format':RANK_FORMAT,
+                   'lexemes':len(encoded),
+                   'metrics':list(metrics),
+                   'source':source,
+                   'source_stat':source_stat}, f_out)
+    return rank_path
+
+def _columns(records):
+    #{metric: values} of the numeric fields of the records, in the order of the fields of the first record
+    metrics = dict()
+    for record in records:
+        for metric, value in record.items():
+            metrics.setdefault(metric, []).append(value)
+    return {metric:values for metric, values in metrics.items()
+            if len(values) == len(records) and all(type(value) in (int, float) for value in values)}
+
+def build_rank_index(lexicon, directory, file_name):
+    #Index of an in-memory {lexeme: record} lexicon saved as directory+file_name
+    lexemes = list(lexicon.keys())
+    source_stat = file_stat(directory+file_name) if os.path.exists(directory+file_name) else None
+    return save_rank_index(lexemes, _columns([lexicon[lexeme] for lexeme in lexemes]), rank_path_for(directory, file_name), source=file_name, source_stat=source_stat)
+
+def build_rank_index_from_file(directory, file_name):
+    #Index of a saved LEXICON file, read lexeme by lexeme
+    source_stat = file_stat(directory+file_name)
+    lexemes, records = [], []
+    for lexeme, record in iter_lexicon(directory, file_name):
+        lexemes.append(lexeme)
+        records.append(record)
+    return save_rank_index(lexemes, _columns(records), rank_path_for(directory, file_name), source=file_name, source_stat=source_stat)
+
+def is_current(rank_path, source_path):
+    #True if the index is complete and its LEXICON file (source_path) has the size and modification time it had when the index was built
+    meta_path = os.path.join(rank_path, 'meta.json')
+    if not os.path.exists(meta_path):
+        return False
+    with open(meta_path, 'r') as f:
+        meta = json.load(f)
+    if not os.path.exists(source_path):
+        return True
+    return meta.get('source_stat') == file_stat(source_path)
+
+class RankIndex:
+    def __init__(self, rank_path, mmap_mode='r'):
+        self.path = rank_path
+        with open(os.path.join(rank_path, 'meta.json'), 'r') as f:
+            self.meta = json.load(f)
+        if self.meta['format'] != RANK_FORMAT:
+            raise ValueError('Unsupported rank index format '+str(self.meta['format'])+' in '+rank_path)
+        load = lambda name: np.load(os.path.join(rank_path, name+'.npy'), mmap_mode=mmap_mode)
+        self.vocab_blob = load('vocab_blob')
+        self.vocab_offsets = load('vocab_offsets')
+        self.by_word = load('by_word')
+        self.metrics = self.meta['metrics']
+        self.values = {metric:load(metric) for metric in self.metrics}
+        self.order = {metric:load(metric+'_order') for metric in self.metrics}
+        self.ranks = {metric:load(metric+'_rank') for metric in self.metrics}
+
+    def __len__(self):
+        return len(self.vocab_offsets)-1
+
+    def _word_bytes(self, i):
+        return self.vocab_blob[self.vocab_offsets[i]:self.vocab_offsets[i+1]].tobytes()
+
+    def lexeme(self, i):
+        return self._word_bytes(i).decode('utf8')
+
+    def index(self, lexeme):
+        #Position of the lexeme in the LEXICON file (binary search through by_word), -1 if it is not in the lexicon
+        key = lexeme.encode('utf8')
+        lo, hi = 0, len(self)
+        while lo < hi:
+            mid = (lo+hi)//2
+            if self._word_bytes(self.by_word[mid]) < key:
+                lo = mid+1
+            else:
+                hi = mid
+        if lo < len(self) and self._word_bytes(self.by_word[lo]) == key:
+            return int(self.by_word[lo])
+        return -1
+
+    def __contains__(self, lexeme):
+        return self.index(lexeme) >= 0
+
+    def record(self, i):
+        #{metric: value} of the i-th lexeme, the same record as in the LEXICON file
+        return {metric:self.values[metric][i].item() for metric in self.metrics}
+
+    def top_indices(self, metric, k=25, head=True):
+        if head:
+            return np.asarray(self.order[metric][:k])
+        return top_indices(self.values[metric], k, head=False)
+
+    def top(self, metric, k=25, head=True):
+        #[(lexeme, value)] of the k highest (or lowest) lexemes of metric
+        values = self.values[metric]
+        return [(self.lexeme(i), values[i].item()) for i in self.top_indices(metric, k, head).tolist()]
+
+    def top_counts(self, count_type, num_hits=25, head=True):
+        #Same result as top_counts(lexicon, count_type, num_hits, head) on the lexicon the index was built from
+        return OrderedDict((self.lexeme(i), self.record(i)) for i in self.top_indices(count_type, num_hits, head).tolist())
+
+    def rank(self, lexeme, metric):
+        #1 for the lexeme with the highest value of metric, None if the lexeme is not in the lexicon
+        i = self.index(lexeme)
+        if i < 0:
+            return None
+        return int(self.ranks[metric][i])
+
+def open_rank_index(directory, file_name, mmap_mode='r'):
+    #Ranking index of directory+file_name (a LEXICON JSON), built from the file if it does not exist yet or the file changed since
+    rank_path = rank_path_for(directory, file_name)
+    if not is_current(rank_path, directory+file_name):
+        build_rank_index_from_file(directory, file_name)
+    return RankIndex(rank_path, mmap_mode)
+
+def index_directory(directory, overwrite=False):
+    #Builds the index of every LEXICON file in the directory that does not have a current one
+    built = []
+    for file_name in sorted(os.listdir(directory)):
+        if not (file_name.startswith('LEXICON_') and file_name.endswith('.json')):
+            continue
+        if not overwrite and is_current(rank_path_for(directory, file_name), directory+file_name):
+            continue
+        built.append(build_rank_index_from_file(directory, file_name))
+        print('SAVED: ', built[-1])
+    return built
+
+if __name__ == '__main__':
+
+    import argparse
+    parser = argparse.ArgumentParser(description='Builds the ranking index of every LEXICON file in a directory')
+
+    parser.add_argument('path', type=str, help="absolute path to the directory with the LEXICON files")
+    parser.add_argument('--overwrite', action='store_true', help="Build again the indexes that already exist")
+
+    args = parser.parse_args()
+    directory = args.path
+    if directory[-1] != '\\' and directory[-1] != '/':
+        directory += '/'
+    print('Indexed', len(index_directory(directory, args.overwrite)), 'lexicons')
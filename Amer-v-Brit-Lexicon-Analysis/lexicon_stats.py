@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# # Vectorized windowed statistics for `create_lexicon.py`
+#
+# `normalize()`, `smoothing()` and `return_sublexicon()` built a list per word, ran a pandas rolling mean over a dict-of-lists
+# and called `statistics.median`/`mean`, `max` and `min` once per word.
+# Here the same numbers are computed over a dense words x years matrix of match counts with whole-array operations:
+# - the centered rolling mean of `t_step` years is a difference of cumulative sums divided by `t_step`
+#   (the same value pandas produces, since the sums of integer counts are exact)
+# - a word is in the lexicon if none of its (smoothed) yearly values is 0
+# - sum, median, mean, max and min are computed for all words at once
+#
+# `sublexicon()` turns the arrays back into the `{unigram:{sum_usage, median_usage, mean_usage, max_usage, min_usage}}` records
+# with the same values and the same int/float types as the per-word code, so the saved LEXICON JSON is unchanged.
+
+import sys
+import numpy as np
+
+STATISTICS = ('sum_usage', 'median_usage', 'mean_usage', 'max_usage', 'min_usage')
+
+def window_years(t_start, t_end, t_step):
+    #Years (as strings, like the LEXICON file names) that are left after smoothing with a centered window of t_step years
+    years = [str(i) for i in range(t_start, t_end+1)]
+    if t_step > 1:
+        #pandas labels a centered window of t_step values with its (t_step//2)-th year and drops the incomplete windows
+        years = years[t_step//2:t_step//2+len(years)-t_step+1]
+    return years
+
+def rolling_mean(counts, t_step):
+    #Centered rolling mean over the years axis of an integer words x years matrix, only the complete windows are kept
+    cumulative = np.zeros((counts.shape[0], counts.shape[1]+1), dtype=np.int64)
+    np.cumsum(counts, axis=1, out=cumulative[:,1:])
+    return (cumulative[:,t_step:]-cumulative[:,:-t_step])/t_step
+
+def _sequential_sum(values):
+    #Float sum of each row in the order the baseline's sum() of a list adds them (np.sum uses pairwise summation which can round differently)
+    #Before Python 3.12 sum() is a naive left to right loop, since 3.12 it compensates the rounding errors (Neumaier)
+    if sys.version_info < (3, 12):
+        return np.cumsum(values, axis=1)[:,-1]
+    total = np.zeros(values.shape[0])
+    compensation = np.zeros(values.shape[0])
+    for j in range(values.shape[1]):
+        x = values[:,j]
+        t = total+x
+        compensation += np.where(np.abs(total) >= np.abs(x), (total-t)+x, (x-t)+total)
+        total = t
+    return total+compensation
+
+def _float_mean(values, n=None):
+    #Correctly rounded mean of each row like statistics.mean (which sums exactly), using a compensated sum and a compensated division
+    #n is the number of values of each row (an array), when only the nonzero values of the rows are averaged
+    total = np.zeros(values.shape[0])
+    compensation = np.zeros(values.shape[0])
+    for j in range(values.shape[1]):
+        x = values[:,j]
+        t = total+x
+        virtual = t-total
+        compensation += (total-(t-virtual))+(x-virtual)
+        total = t
+    if n is None:
+        n = values.shape[1]
+    quotient = total/n
+    #Exact error of quotient*n (Dekker product, n is a small integer so it does not need splitting)
+    split = quotient*134217729.0
+    high = split-(split-quotient)
+    low = quotient-high
+    product = quotient*n
+    product_error = (high*n-product)+low*n
+    return quotient+(((total-product)-product_error)+compensation)/n
+
+def _median(values):
+    n = values.shape[1]
+    if n % 2:
+        return np.partition(values, n//2, axis=1)[:,n//2]
+    partitioned = np.partition(values, (n//2-1, n//2), axis=1)
+    #statistics.median returns (a+b)/2 for an even number of values
+    return (partitioned[:,n//2-1]+partitioned[:,n//2])/2
+
+def window_statistics(counts, t_step=1):
+    '''
+    counts is a words x years integer matrix of match counts (0 where a word has no entry in a year).
+    Returns (in_lexicon, stats) where in_lexicon is a boolean mask of the words with no zero in the (smoothed) window
+    and stats maps each of STATISTICS to an array with the value of every word in the lexicon.
+    '''
+    counts = np.asarray(counts, dtype=np.int64)
+    values = rolling_mean(counts, t_step) if t_step > 1 else counts
+    in_lexicon = (values != 0).all(axis=1)
+    values = values[in_lexicon]
+
+    stats = dict()
+    if values.dtype.kind == 'f':
+        stats['sum_usage'] = _sequential_sum(values)
+        stats['mean_usage'] = _float_mean(values)
+    else:
+        stats['sum_usage'] = values.sum(axis=1)
+        stats['mean_usage'] = stats['sum_usage']/values.shape[1]
+    stats['median_usage'] = _median(values)
+    stats['max_usage'] = values.max(axis=1)
+    stats['min_usage'] = values.min(axis=1)
+    return in_lexicon, stats
+
+def _python_values(stats, n_years, integer):
+    #Converts the arrays to lists of python numbers with the types the statistics module returns
+    values = {stat:array.tolist() for stat, array in stats.items()}
+    if integer:
+        #statistics.mean of ints is an int when the mean is a whole number, statistics.median of an odd number of ints is an int
+        sums = values['sum_usage']
+        values['mean_usage'] = [total//n_years if total % n_years == 0 else mean for total, mean in zip(sums, values['mean_usage'])]
+    return values
+
+def sublexicon(words, counts, t_step=1, usage=0):
+    '''
+    Same output as return_sublexicon(smoothing(normalize(...))) for the words (rows) of counts:
+    ({unigram:{sum_usage, median_usage, mean_usage, max_usage, min_usage}}, usage)
+    usage is added to the total usage of the words, so a shard can be processed in chunks and still sum its usage in the same order.
+    '''
+    in_lexicon, stats = window_statistics(counts, t_step)
+    n_years = counts.shape[1]-(t_step-1 if t_step > 1 else 0)
+    values = _python_values(stats, n_years, integer=t_step <= 1)
+    lexicon_words = [word for word, keep in zip(words, in_lexicon.tolist()) if keep]
+
+    sublexicon = dict()
+    for i, unigram in enumerate(lexicon_words):
+        sublexicon[unigram] = {stat:values[stat][i] for stat in STATISTICS}
+        usage += values['sum_usage'][i]
+    return sublexicon, usage
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# # Bulk parser for the year,match_count,volume_count columns
+#
+# Each row of the 2020 export is of the form: ngram TAB year,match_count,volume_count TAB year,match_count,volume_count ... NEWLINE
+# `csv2tuple()` converted the entries one at a time (and `np.int8(year)` cannot hold a year like 1850).
+# Here all the entries of a row, or of a whole block of rows, are converted in one call into contiguous typed arrays.
+# The preprocessors parse the entries of all the lexemes of a block at once with `records_from_entries_list()`.
+
+import warnings
+import numpy as np
+
+#Years go up to 2019, match counts of the most common words go past 2**31 over a shard, volume counts stay well below 2**31
+YEAR_DTYPE = np.int16
+MATCH_COUNT_DTYPE = np.int64
+VOLUME_COUNT_DTYPE = np.int32
+
+def _parse_values(entries, n_entries):
+    #One C level pass over 'year,match_count,volume_count' triples separated by tabs
+    #Malformed text is only read up to the first bad value, with a DeprecationWarning (a ValueError in later numpy versions)
+    with warnings.catch_warnings():
+        warnings.simplefilter('error', DeprecationWarning)
+        try:
+            values = np.fromstring(entries.replace('\t', ','), dtype=np.int64, sep=',') if n_entries else np.empty(0, dtype=np.int64)
+        except (DeprecationWarning, ValueError):
+            values = None
+    if values is None or values.size != 3*n_entries:
+        raise ValueError('Malformed year,match_count,volume_count entries: '+entries[:100])
+    values = values.reshape(-1, 3)
+    return (values[:,0].astype(YEAR_DTYPE),
+            np.ascontiguousarray(values[:,1], dtype=MATCH_COUNT_DTYPE),
+            values[:,2].astype(VOLUME_COUNT_DTYPE))
+
+def parse_entries(entries):
+    '''
+    Parses the tab separated entries of one row (everything after the ngram) into
+    (years, match_counts, volume_counts) arrays.
+    '''
+    return _parse_values(entries, entries.count('\t')+1 if entries else 0)
+
+def parse_entries_list(entries_list):
+    '''
+    Parses the entries of many rows (everything after each ngram) in one call.
+    Returns offsets, years, match_counts, volume_counts where the entries of entries_list[i] are years[offsets[i]:offsets[i+1]].
+    '''
+    tails, counts = [], []
+    for entries in entries_list:
+        if entries:
+            tails.append(entries)
+            counts.append(entries.count('\t')+1)
+        else:
+            counts.append(0)
+    offsets = np.zeros(len(counts)+1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    return (offsets,)+_parse_values('\t'.join(tails), int(offsets[-1]))
+
+def volume_filter(years, match_counts, volume_counts, min_volumes=2):
+    #This is the crucial filtering by volume count because only words in >1 volume are reasonably assumed to be used by >1 person
+    #Words only used by one person - which translates the computational parameter 1 volume - are not considered part of the lexicon
+    mask = volume_counts >= min_volumes
+    return years[mask], match_counts[mask]
+
+def records_from_entries(entries):
+    #{year:match_count} for the entries of one row that pass the volume filter, with plain int keys and values
+    years, match_counts = volume_filter(*parse_entries(entries))
+    return dict(zip(years.tolist(), match_counts.tolist()))
+
+def records_from_entries_list(entries_list, min_volumes=2):
+    #records_from_entries() of the entries of many rows (e.g. all the lexemes of a block), parsed and filtered in one call
+    offsets, years, match_counts, volume_counts = parse_entries_list(entries_list)
+    mask = volume_counts >= min_volumes
+    #Where the entries of each row start once the filtered ones are dropped
+    kept = np.concatenate([[0], np.cumsum(mask)])[offsets].tolist()
+    years, match_counts = years[mask].tolist(), match_counts[mask].tolist()
+    return [dict(zip(years[kept[i]:kept[i+1]], match_counts[kept[i]:kept[i+1]])) for i in range(len(entries_list))]
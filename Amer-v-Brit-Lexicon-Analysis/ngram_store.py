@@ -0,0 +1,303 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# # Compact columnar store for preprocessed n-gram time series
+#
+# The preprocessed shards are `{ngram:{year:match_count}}` dictionaries saved as JSON (`-COMPLETE.json`) or pickle (`-preprocessed.pickle`).
+# Both have to be parsed completely before a single word can be looked up, and the dict-of-dicts takes many times the size of the data in RAM.
+#
+# A store is a directory of flat numpy arrays in compressed sparse row layout:
+# - `vocab_blob.npy`, `vocab_offsets.npy`: the ngrams sorted by their utf8 bytes, concatenated, with the start of each one
+# - `offsets.npy`: the entries of the i-th ngram are `years[offsets[i]:offsets[i+1]]` and `counts[offsets[i]:offsets[i+1]]`
+# - `years.npy`, `counts.npy`: the years (sorted within each ngram) and match counts of all the ngrams
+# - `order.npy`: the ngrams in the order of the source dictionary (as indices into the sorted vocabulary), so outputs keyed by ngram can be written in the same order as before
+# - `ids.npy` (when converted with a shared vocabulary, see vocabulary.py): the vocabulary ID of each ngram
+# - `meta.json`: number of ngrams and entries, and the file it was converted from with its size and modification time
+#
+# A store is only used while its source file is unchanged: `is_current()` compares the size and modification time of the source
+# with the ones in `meta.json`, `create_lexicon.shard_chunks()` reads the source instead of a stale store, `open_corpus()` refuses one,
+# and `python ngram_store.py <directory>` converts stale stores again.
+# Pickles written by the old notebooks with `np.int8` years (which overflowed, 1850 became 58) are refused instead of converted.
+#
+# The arrays are opened memory-mapped, so opening a store takes milliseconds and only the pages that are read are loaded.
+#
+# Usage:
+# `python ngram_store.py C:\path\to\amer_unigram_data\` converts every `-COMPLETE.json` and `-preprocessed.pickle` in the directory
+# `python ngram_store.py C:\path\to\amer_unigram_data\ --vocabulary C:\path\to\vocabulary\` also gives every ngram its ID in the shared vocabulary
+
+import os
+import json
+import pickle
+import numpy as np
+
+from ngram_parser import YEAR_DTYPE, MATCH_COUNT_DTYPE
+
+STORE_FORMAT = 1
+STORE_SUFFIX = '.store'
+#No ngram year is below this, the years of the old np.int8 pickles all are (-128 to 127)
+MIN_YEAR = 128
+
+def file_stat(path):
+    #[size, modification time] of a file, recorded with a store to tell whether its source changed since
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+def save_store(ngram_dict, store_path, source=None, vocabulary=None, source_stat=None):
+    #Writes a {ngram:{year:match_count}} dictionary (year keys can be str, as in the JSON files, or int) as a store directory
+    #With a Vocabulary, the ID of every ngram is saved too (new ngrams are added to the vocabulary, which the caller saves)
+    #source_stat is the file_stat() of the source file, read before the file was loaded
+    encoded = sorted((ngram.encode('utf8'), ngram) for ngram in ngram_dict)
+    vocab_offsets = np.zeros(len(encoded)+1, dtype=np.int64)
+    np.cumsum([len(word) for word, ngram in encoded], out=vocab_offsets[1:])
+    vocab_blob = np.frombuffer(b''.join(word for word, ngram in encoded), dtype=np.uint8)
+
+    offsets = np.zeros(len(encoded)+1, dtype=np.int64)
+    np.cumsum([len(ngram_dict[ngram]) for word, ngram in encoded], out=offsets[1:])
+    years = np.empty(offsets[-1], dtype=YEAR_DTYPE)
+    counts = np.empty(offsets[-1], dtype=MATCH_COUNT_DTYPE)
+    for i, (word, ngram) in enumerate(encoded):
+        records = sorted((int(year), match_count) for year, match_count in ngram_dict[ngram].items())
+        if records:
+            years[offsets[i]:offsets[i+1]], counts[offsets[i]:offsets[i+1]] = zip(*records)
+    if len(years) and years.min() < MIN_YEAR:
+        raise ValueError('Years below '+str(MIN_YEAR)+' in '+str(source)+', it was probably saved with np.int8 years which overflowed. Preprocess it again.')
+
+    position = {ngram:i for i, (word, ngram) in enumerate(encoded)}
+    order = np.fromiter((position[ngram] for ngram in ngram_dict), dtype=np.int64, count=len(encoded))
+
+    os.makedirs(store_path, exist_ok=True)
+    np.save(os.path.join(store_path, 'vocab_blob.npy'), vocab_blob)
+    np.save(os.path.join(store_path, 'vocab_offsets.npy'), vocab_offsets)
+    np.save(os.path.join(store_path, 'offsets.npy'), offsets)
+    np.save(os.path.join(store_path, 'years.npy'), years)
+    np.save(os.path.join(store_path, 'counts.npy'), counts)
+    np.save(os.path.join(store_path, 'order.npy'), order)
+    if vocabulary is not None:
+        np.save(os.path.join(store_path, 'ids.npy'), vocabulary.ids([ngram for word, ngram in encoded]))
+    #meta.json is written last, a store without it is incomplete
+    with open(os.path.join(store_path, 'meta.json'), 'w') as f_out:
+        json.dump({'format':STORE_FORMAT,
+                   'ngrams':len(encoded),
+                   'entries':int(offsets[-1]),
+                   'source':source,
+                   'source_stat':source_stat}, f_out)
+    print('SAVED: ', store_path, len(encoded))
+    return store_path
+
+class NgramStore:
+    def __init__(self, store_path, mmap_mode='r'):
+        self.path = store_path
+        with open(os.path.join(store_path, 'meta.json'), 'r') as f:
+            self.meta = json.load(f)
+        if self.meta['format'] != STORE_FORMAT:
+            raise ValueError('Unsupported store format '+str(self.meta['format'])+' in '+store_path)
+        load = lambda name: np.load(os.path.join(store_path, name+'.npy'), mmap_mode=mmap_mode)
+        self.vocab_blob = load('vocab_blob')
+        self.vocab_offsets = load('vocab_offsets')
+        self.offsets = load('offsets')
+        self.years = load('years')
+        self.counts = load('counts')
+        self.order = load('order') if os.path.exists(os.path.join(store_path, 'order.npy')) else None
+        self.ids = load('ids') if os.path.exists(os.path.join(store_path, 'ids.npy')) else None
+
+    def __len__(self):
+        return len(self.offsets)-1
+
+    def _word_bytes(self, i):
+        return self.vocab_blob[self.vocab_offsets[i]:self.vocab_offsets[i+1]].tobytes()
+
+    def source_order(self):
+        #Indices of the ngrams in the order of the dictionary the store was converted from
+        if self.order is None:
+            return np.arange(len(self), dtype=np.int64)
+        return np.asarray(self.order)
+
+    def vocabulary_ids(self, vocabulary=None):
+        #Shared vocabulary ID of every ngram in store order, saved with the store or looked up (and added) in vocabulary
+        if self.ids is not None:
+            return np.asarray(self.ids)
+        return vocabulary.ids(self.words())
+
+    def word(self, i):
+        return self._word_bytes(i).decode('utf8')
+
+    def words(self):
+        #All the ngrams in store order (sorted by utf8 bytes)
+        blob = self.vocab_blob.tobytes()
+        vocab_offsets = self.vocab_offsets.tolist()
+        return [blob[vocab_offsets[i]:vocab_offsets[i+1]].decode('utf8') for i in range(len(self))]
+
+    def index(self, ngram):
+        #Binary search of the sorted vocabulary, returns -1 if the ngram is not in the store
+        key = ngram.encode('utf8')
+        lo, hi = 0, len(self)
+        while lo < hi:
+            mid = (lo+hi)//2
+            if self._word_bytes(mid) < key:
+                lo = mid+1
+            else:
+                hi = mid
+        if lo < len(self) and self._word_bytes(lo) == key:
+            return lo
+        return -1
+
+    def prefix_range(self, prefix):
+        #Indices [start, stop) of the ngrams that start with prefix
+        key = prefix.encode('utf8')
+        lo, hi = 0, len(self)
+        while lo < hi:
+            mid = (lo+hi)//2
+            if self._word_bytes(mid) < key:
+                lo = mid+1
+            else:
+                hi = mid
+        start = lo
+        hi = len(self)
+        while lo < hi:
+            mid = (lo+hi)//2
+            if self._word_bytes(mid)[:len(key)] == key:
+                lo = mid+1
+            else:
+                hi = mid
+        return start, lo
+
+    def __contains__(self, ngram):
+        return self.index(ngram) >= 0
+
+    def series(self, ngram):
+        #(years, match_counts) arrays of one ngram, views into the memory-mapped arrays
+        i = self.index(ngram)
+        if i < 0:
+            raise KeyError(ngram)
+        return self.years[self.offsets[i]:self.offsets[i+1]], self.counts[self.offsets[i]:self.offsets[i+1]]
+
+    def get(self, ngram, default=None):
+        #{year:match_count} of one ngram, like one entry of the preprocessed dictionaries (with int years)
+        if ngram not in self:
+            return default
+        years, counts = self.series(ngram)
+        return dict(zip(years.tolist(), counts.tolist()))
+
+    def items(self):
+        for i, ngram in enumerate(self.words()):
+            start, stop = self.offsets[i], self.offsets[i+1]
+            yield ngram, dict(zip(self.years[start:stop].tolist(), self.counts[start:stop].tolist()))
+
+    def to_dict(self, str_years=True):
+        #Back to the {ngram:{year:match_count}} form, with str years like the JSON files by default
+        if str_years:
+            return {ngram:{str(year):count for year, count in records.items()} for ngram, records in self.items()}
+        return dict(self.items())
+
+    def entry_index(self, rows=None):
+        #(row, entry) index pairs of all the entries of the given ngrams (all of them, a slice or an array of indices)
+        if rows is None:
+            rows = slice(0, len(self))
+        if isinstance(rows, slice):
+            start, stop, step = rows.indices(len(self))
+            rows = np.arange(start, stop, step, dtype=np.int64)
+        rows = np.asarray(rows, dtype=np.int64)
+        starts = np.asarray(self.offsets[rows])
+        lengths = np.asarray(self.offsets[rows+1])-starts
+        row_of_entry = np.repeat(np.arange(len(rows), dtype=np.int64), lengths)
+        #Position of every entry inside its ngram, added to the start of the ngram
+        first = np.cumsum(lengths)-lengths
+        entries = np.arange(row_of_entry.size, dtype=np.int64)-np.repeat(first, lengths)+np.repeat(starts, lengths)
+        return row_of_entry, entries
+
+    def to_dense(self, t_start, t_end, rows=None, dtype=MATCH_COUNT_DTYPE):
+        #words x years matrix of match counts for t_start..t_end (inclusive) of the given ngrams, zeroes where a word has no entry
+        row_of_entry, entries = self.entry_index(rows)
+        years = np.asarray(self.years[entries])
+        in_range = (years >= t_start) & (years <= t_end)
+        n_rows = len(self) if rows is None else len(range(len(self))[rows]) if isinstance(rows, slice) else len(rows)
+        dense = np.zeros((n_rows, t_end-t_start+1), dtype=dtype)
+        dense[row_of_entry[in_range], years[in_range].astype(np.int64)-t_start] = np.asarray(self.counts[entries])[in_range]
+        return dense
+
+def open_store(store_path, mmap_mode='r'):
+    return NgramStore(store_path, mmap_mode)
+
+def is_current(store_path, source_path=None):
+    '''
+    True if the store is complete and its source file (source_path, by default the file named in meta.json next to the store)
+    has the size and modification time it had when it was converted. A store whose source is gone is current.
+    '''
+    meta_path = os.path.join(store_path, 'meta.json')
+    if not os.path.exists(meta_path):
+        return False
+    with open(meta_path, 'r') as f:
+        meta = json.load(f)
+    if source_path is None:
+        if not meta['source']:
+            return True
+        source_path = os.path.join(os.path.dirname(os.path.normpath(store_path)), meta['source'])
+    if not os.path.exists(source_path):
+        return True
+    return meta.get('source_stat') == file_stat(source_path)
+
+def store_path_for(directory, file_name):
+    #1-00000-of-00004-COMPLETE.json -> 1-00000-of-00004-COMPLETE.store
+    return directory+os.path.splitext(file_name)[0]+STORE_SUFFIX
+
+def list_stores(directory, suffix='-COMPLETE'+STORE_SUFFIX):
+    #Store directories of a corpus, sorted, completed stores only
+    return sorted(name for name in os.listdir(directory)
+                  if name.endswith(suffix) and os.path.exists(os.path.join(directory, name, 'meta.json')))
+
+def open_corpus(directory, suffix='-COMPLETE'+STORE_SUFFIX):
+    #Opens every store of a corpus, {store name: NgramStore}, a store whose source changed since it was converted is refused
+    stores = dict()
+    for name in list_stores(directory, suffix):
+        if not is_current(os.path.join(directory, name)):
+            raise ValueError(os.path.join(directory, name)+' is older than its source file, convert it again with ngram_store.py')
+        stores[name] = open_store(os.path.join(directory, name))
+    return stores
+
+def convert_json(directory, file_name, vocabulary=None):
+    source_stat = file_stat(directory+file_name)
+    with open(directory+file_name, 'r') as f:
+        ngram_dict = json.load(f)
+    return save_store(ngram_dict, store_path_for(directory, file_name), source=file_name, vocabulary=vocabulary, source_stat=source_stat)
+
+def convert_pickle(directory, file_name, vocabulary=None):
+    source_stat = file_stat(directory+file_name)
+    with open(directory+file_name, 'rb') as f:
+        ngram_dict = pickle.load(f)
+    return save_store(ngram_dict, store_path_for(directory, file_name), source=file_name, vocabulary=vocabulary, source_stat=source_stat)
+
+def convert_directory(directory, overwrite=False, vocabulary=None):
+    #Converts every -COMPLETE.json and -preprocessed.pickle file in the directory that does not have a store yet, or whose store is stale
+    converted = []
+    for file_name in sorted(os.listdir(directory)):
+        if file_name.endswith('-COMPLETE.json'):
+            convert = convert_json
+        elif file_name.endswith('-preprocessed.pickle'):
+            convert = convert_pickle
+        else:
+            continue
+        if not overwrite and is_current(store_path_for(directory, file_name), directory+file_name):
+            continue
+        converted.append(convert(directory, file_name, vocabulary))
+    return converted
+
+if __name__ == '__main__':
+
+    import argparse
+    parser = argparse.ArgumentParser(description='Converts the preprocessed -COMPLETE.json and -preprocessed.pickle files of a directory into memory-mappable stores')
+
+    parser.add_argument('path', type=str, help="absolute path to the directory with the preprocessed files")
+    parser.add_argument('--overwrite', action='store_true', help="Convert again files which already have a store")
+    parser.add_argument('--vocabulary', type=str, required=False, default=None, help="Directory of the shared vocabulary (see vocabulary.py), the ngrams are given their IDs in it and new ones are added")
+
+    args = parser.parse_args()
+    directory = args.path
+    if directory[-1] != '\\' and directory[-1] != '/':
+        directory += '/'
+    vocabulary = None
+    if args.vocabulary:
+        from vocabulary import open_vocabulary
+        vocabulary = open_vocabulary(args.vocabulary)
+    print('Converted', len(convert_directory(directory, args.overwrite, vocabulary)), 'files')
+    if vocabulary is not None:
+        vocabulary.save()
@@ -20,8 +20,8 @@ from tqdm import tqdm
 from nltk import WordNetLemmatizer
 lemmatizer = WordNetLemmatizer()
 
-#For checking if the word has any non-English-alphabetical letters
-from unidecode import unidecode
+#Compiled version of the lexeme tests (see lexeme_filter.py for the rules)
+from lexeme_filter import unigram_tests
 
 import re
 #For the Google POS tagging mapping
@@ -50,16 +50,6 @@ underscore = re.compile('_{1}')
 # - _CONJ_	conjunction
 # - _PRT_	particle
 
-# Define sets which are going to be used in the unigram tests
-
-import string
-PUNCTUATION = set(char for char in string.punctuation).union({'“','”'})
-DIGITS = set(string.digits)
-VOWELS = set("aeiouyAEIOUY")
-#Excluding '_' (underscore) from DASHES precludes the tagged 1grams "_NOUN", add it to also include the tagged 1grams
-DASHES = {'—','–','—','―','‒','-','_'}
-PUNCTUATION.difference_update(DASHES)
-STOPS = PUNCTUATION.union(DIGITS)
 #GOOGLE_TAGS = {'_NOUN','_VERB','_ADJ','_ADV','_PRON','_DET','_ADP','_NUM','_CONJ','_PRT'}
 
 def open_gzip(directory,file_path):
@@ -81,37 +71,6 @@ def csv2tuple(string):
     return int(year),int(match_count),int(volume_count)
 
 
-def unigram_tests(unigram):
-    #Exclude words with more than one underscore, can make this != to only include tagged words
-    if len(underscore.findall(unigram))!=1:
-        return False
-    
-    #Checks each character in the unigram against the characters in the STOP set. (character level filtering) - no punctuation or digits allowed
-    if set(unigram).intersection(STOPS):
-        return False
-    
-    #Excluded all of the form _PRON_ (or anything that starts or ends with an underscore)
-    if unigram[0] == '_' or unigram[-1] == '_':
-        return False
-    
-    #must have a vowel (presupposes that it must also have a letter of the alphabet inside)
-    if not set(unigram).intersection(VOWELS):
-        return False 
-    
-    #Words cannot start or end with dashes
-    if unigram[0] in DASHES or unigram[-1] in DASHES:
-        return False
-    
-    #must have 0 non-english letters
-    test = unidecode(unigram, errors='replace')
-    if test != unigram:
-        return False
-    
-    #Can implement more tests here if you need to do more filtering
-    
-    else:
-        return True
-
 #maps Google pos_tag to Wordnet pos_tag
 def POS_mapper(pos_tag):
     if pos_tag == 'NOUN':
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# # Parallel preprocessing driver
+#
+# Runs `preprocess_ngrams()` over every raw `.gz` shard in a directory with a pool of worker processes.
+# Each worker preprocesses one shard and writes its own output file (the same `-preprocessed.pickle` the serial loop writes),
+# so a shard's dictionary never has to be shipped back to the parent and a shard that fails does not take the finished ones down with it.
+#
+# Finished shards are recorded in the manifest of the directory and skipped by the next run, and every worker checkpoints
+# the shard it is working on (see shard_manifest.py), so an interrupted run picks up where it stopped.
+# Every shard saves its ingest metrics next to its output and the run adds them up in `preprocess-metrics.json` (see ingest_metrics.py).
+#
+# Usage:
+# `python parallel_preprocess.py C:\path\to\amer_unigram_data\ -j 32 -m 8`
+
+import os
+import time
+import traceback
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from shard_manifest import ShardManifest, ShardCheckpoint, CHECKPOINT_ROWS
+
+def list_shards(directory):
+    #Same selection as the serial loop in preprocess.py, sorted so that runs are reproducible
+    return sorted(file_path for file_path in os.listdir(os.path.abspath(directory))
+                  if '.gz' in file_path and not '.json' in file_path)
+
+def preprocess_shard(directory, file_path, lemma_cache_path=None, checkpoint_rows=CHECKPOINT_ROWS, pos_store=False):
+    #Imported here so every worker process sets up its own lemmatizer and lemma cache
+    from preprocess import preprocess_ngrams, save_pickle, save_metrics, lemma_cache, MANIFEST_PARAMS, save_partitioned, pos_path_for
+    from ingest_metrics import IngestMetrics
+    start = time.perf_counter()
+    if lemma_cache_path:
+        #Every worker starts warm from the shared cache file, and merges what it learned back after each shard
+        lemma_cache.load(lemma_cache_path)
+    lemma_cache.reset_stats()
+    metrics = IngestMetrics()
+    checkpoint = ShardCheckpoint(directory, file_path, MANIFEST_PARAMS, checkpoint_rows)
+    ngram_dict = preprocess_ngrams(directory, file_path, checkpoint=checkpoint, metrics=metrics)
+    #Save as Pickle
+    metrics.lap('save')
+    output = save_pickle(ngram_dict, directory, file_path)
+    if pos_store and output:
+        #Partitioned by POS tag as well (see pos_store.py)
+        save_partitioned(ngram_dict, pos_path_for(directory, output), source=output)
+    checkpoint.remove()
+    if lemma_cache_path:
+        lemma_cache.save(lemma_cache_path)
+    save_metrics(metrics, directory, file_path, output=output, ngrams=len(ngram_dict), wall_time=time.perf_counter()-start, lemma_cache=lemma_cache.stats())
+    return {'output':output, 'rows':checkpoint.rows, 'ngrams':len(ngram_dict), 'lemma_cache':lemma_cache.stats(), 'metrics':metrics.to_dict()}
+
+def _run_shard(worker, directory, file_path):
+    #Exceptions are turned into a return value so that a bad shard is reported instead of cancelling the whole run
+    try:
+        return file_path, worker(directory, file_path), None
+    except Exception:
+        return file_path, None, traceback.format_exc()
+
+def run_shards(directory, file_paths, worker=preprocess_shard, workers=None, max_in_memory=None, manifest=None):
+    '''
+    Calls worker(directory, file_path) for every shard in file_paths on a process pool.
+    workers is the number of processes (defaults to the number of cores).
+    max_in_memory caps how many shards are being processed (and therefore held in memory) at once, it defaults to workers.
+    With a ShardManifest, the shards it records as done are skipped and every completed or failed shard is recorded
+    (the worker then has to return a dict with the 'output', 'rows' and 'ngrams' of the shard).
+    Returns ({file_path: worker result}, {file_path: traceback}) for the completed and failed shards.
+    '''
+    workers = workers or os.cpu_count()
+    max_in_memory = min(max_in_memory or workers, workers)
+    if manifest is not None:
+        pending = manifest.pending(file_paths)
+        for file_path in file_paths:
+            if file_path not in pending:
+                print('SKIPPED: ', file_path)
+        file_paths = pending
+
+    completed, failed = dict(), dict()
+    pending = list(reversed(file_paths))
+    running = set()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        while pending or running:
+            #Only hand out a new shard when a slot is free, so no more than max_in_memory shards are loaded at a time
+            while pending and len(running) < max_in_memory:
+                running.add(executor.submit(_run_shard, worker, directory, pending.pop()))
+            done, running = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                file_path, result, error = future.result()
+                if error is None:
+                    completed[file_path] = result
+                    print('DONE: ', file_path)
+                    if manifest is not None:
+                        manifest.finish(file_path, result['output'], result['rows'], result['ngrams'])
+                else:
+                    failed[file_path] = error
+                    print('FAILED: ', file_path)
+                    print(error)
+                    if manifest is not None:
+                        manifest.fail(file_path, error)
+
+    print(len(completed), 'shards completed,', len(failed), 'shards failed')
+    for file_path in sorted(failed):
+        print('FAILED: ', file_path)
+    return completed, failed
+
+if __name__ == '__main__':
+
+    import argparse
+    parser = argparse.ArgumentParser(description='Preprocesses every Google Ngrams shard in a directory in parallel')
+
+    parser.add_argument('path', type=str, help="absolute path to the directory with the raw *.gz files")
+    parser.add_argument('-j', '--workers', type=int, required=False, default=os.cpu_count(), help="Number of worker processes. Default is the number of cores.")
+    parser.add_argument('-m', '--max-in-memory', type=int, required=False, default=None, help="Maximum number of shards being processed (held in memory) at once. Default is the number of workers. Lower it if the largest shards do not fit in memory together.")
+    parser.add_argument('--lemma-cache', type=str, required=False, default=None, help="File used to persist the lemmatization cache between runs and share it between workers")
+    parser.add_argument('--checkpoint-rows', type=int, required=False, default=CHECKPOINT_ROWS, help="Rows between two checkpoints of a shard, 0 disables checkpoints. Default is "+str(CHECKPOINT_ROWS)+".")
+    parser.add_argument('--force', action='store_true', help="Preprocess again the shards the manifest records as done")
+    parser.add_argument('--pos-store', action='store_true', help="Also save every shard partitioned by POS tag (see pos_store.py), so analyses of a few tags only read their partitions")
+
+    args = parser.parse_args()
+    directory = args.path
+    if directory[-1] != '\\' and directory[-1] != '/':
+        directory += '/'
+
+    from preprocess import MANIFEST_NAME, MANIFEST_PARAMS, RUN_METRICS_NAME
+    manifest = ShardManifest(directory, MANIFEST_NAME, MANIFEST_PARAMS)
+    file_paths = list_shards(directory)
+    if args.force:
+        #Every shard is preprocessed again, the manifest still records them
+        manifest.shards = dict()
+
+    run_start = time.perf_counter()
+    worker = partial(preprocess_shard, lemma_cache_path=args.lemma_cache, checkpoint_rows=args.checkpoint_rows, pos_store=args.pos_store)
+    completed, failed = run_shards(directory, file_paths, worker=worker, workers=args.workers, max_in_memory=args.max_in_memory, manifest=manifest)
+
+    from lemma_cache import format_stats
+    totals = {'hits':0, 'misses':0, 'evictions':0}
+    for result in completed.values():
+        for stat in totals:
+            totals[stat] += result['lemma_cache'][stat]
+    print(format_stats(totals))
+
+    from ingest_metrics import IngestMetrics, format_metrics
+    run_metrics = IngestMetrics()
+    for result in completed.values():
+        run_metrics.merge(result['metrics'])
+    #The timers add up the time of all the workers, compare them with the wall time of the run
+    run_metrics.save(directory+RUN_METRICS_NAME, shards=sorted(completed), failed=sorted(failed), wall_time=time.perf_counter()-run_start, lemma_cache=totals)
+    print(format_metrics(run_metrics))
+    if failed:
+        raise SystemExit(1)
@@ -0,0 +1,272 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# # POS partitioned stores
+#
+# `Closed-Lexical-Classes/1. Closed Classes Preprocessing.ipynb` reads every raw 1-gram shard to keep the few `PRON/DET/ADP/CONJ/PRT` rows,
+# the lemmatizing preprocessors read the same shards again for everything else, and an analysis of a single part of speech
+# (`birth_death.py --tags ADV`, a NOUN-only lexicon) reads all the words of the `-COMPLETE.json` files and drops most of them.
+#
+# A POS partitioned store splits a `{ngram:{year:match_count}}` dictionary by the Google POS tag of its ngrams, and saves every part as its own store
+# (see ngram_store.py), so reading one part of speech only reads the files of its partition:
+# - `<TAG>.store` for each tag of GOOGLE_TAGS, `OTHER.store` for the untagged ngrams and any other suffix
+# - `positions.npy` in every partition: the position of each ngram (in the order of its partition's source dictionary) in the whole dictionary,
+#   so the partitions can be read back together in the original order of the ngrams
+# - `index.json` (written last): the number of ngrams, entries and bytes of every partition and the file it was made from with its size
+#   and modification time. A POS store is only used while that file is unchanged: otherwise `shard_chunks()` reads the whole file,
+#   `--export` refuses it and `python pos_store.py <directory>` partitions it again
+#
+# `python pos_store.py <directory>` makes one from:
+# - every raw `.gz` shard (`1-00000-of-00024.pos`), in one pass over its raw bytes: the rows that pass the word tests (lexeme_filter.py)
+#   with the word lowercased but not lemmatized (`she_PRON`), and the entries used in more than one volume, like the closed classes notebook.
+#   `--export` then writes the `_CLOSED_CLASSES.json` files of the notebook (years after 1800) from the closed class partitions only
+# - every `-COMPLETE.json` and `-preprocessed.pickle` (`1-00000-of-00024-COMPLETE.pos`, `preprocess.py --pos-store` and `parallel_preprocess.py --pos-store`
+#   also write one with every `-preprocessed.pickle`), which `create_lexicon.shard_chunks(..., tags=...)` reads instead of the whole file
+#   when a lexicon (`create_lexicon.py --tags NOUN`) or `birth_death.py --tags ADV` only needs some tags
+#
+# Usage:
+# `python pos_store.py C:\path\to\unigram_data\ -j 8` partitions every raw shard and every preprocessed file of the directory
+# `python pos_store.py C:\path\to\unigram_data\ --export PRON DET ADP CONJ PRT` writes the `_CLOSED_CLASSES.json` files from the partitioned raw shards
+
+import os
+import json
+import pickle
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from tqdm import tqdm
+
+from ngram_store import save_store, open_store, file_stat, STORE_SUFFIX
+from lexeme_filter import lexeme_rows
+from ngram_parser import records_from_entries_list, MATCH_COUNT_DTYPE
+from shard_pipeline import read_blocks, merge_ngram_dicts
+
+POS_FORMAT = 1
+POS_SUFFIX = '.pos'
+INDEX_NAME = 'index.json'
+GOOGLE_TAGS = ('NOUN', 'VERB', 'ADJ', 'ADV', 'PRON', 'DET', 'ADP', 'NUM', 'CONJ', 'PRT', 'X')
+OTHER = 'OTHER'
+CLOSED_CLASSES = ('PRON', 'DET', 'ADP', 'CONJ', 'PRT')
+#The closed classes notebook only keeps the years after 1800
+CLOSED_CLASSES_FIRST_YEAR = 1801
+
+def partition_of(ngram):
+    #'she_PRON' -> 'PRON', untagged ngrams and unknown tags -> OTHER
+    tag = ngram.rpartition('_')[2] if '_' in ngram else ''
+    return tag if tag in GOOGLE_TAGS else OTHER
+
+def pos_path_for(directory, file_name):
+    #1-00000-of-00004-COMPLETE.json -> 1-00000-of-00004-COMPLETE.pos, 1-00000-of-00004.gz -> 1-00000-of-00004.pos
+    return directory+os.path.splitext(file_name)[0]+POS_SUFFIX
+
+def _directory_size(path):
+    return sum(os.path.getsize(os.path.join(root, file_name)) for root, _, file_names in os.walk(path) for file_name in file_names)
+
+def save_partitioned(ngram_dict, pos_path, source=None, source_stat=None):
+    #Writes a {ngram:{year:match_count}} dictionary as one store per POS tag and the index of the partitions
+    #source is the name of the file of the dictionary, next to pos_path, and source_stat its file_stat() (by default, as it is now)
+    if source_stat is None and source is not None:
+        source_stat = file_stat(os.path.join(os.path.dirname(os.path.normpath(pos_path)), source))
+    partitions, positions = dict(), dict()
+    for position, ngram in enumerate(ngram_dict):
+        tag = partition_of(ngram)
+        partitions.setdefault(tag, dict())[ngram] = ngram_dict[ngram]
+        positions.setdefault(tag, []).append(position)
+    os.makedirs(pos_path, exist_ok=True)
+    index = dict()
+    for tag, partition in partitions.items():
+        store_path = os.path.join(pos_path, tag+STORE_SUFFIX)
+        save_store(partition, store_path, source=source)
+        np.save(os.path.join(store_path, 'positions.npy'), np.array(positions[tag], dtype=np.int64))
+        with open(os.path.join(store_path, 'meta.json'), 'r') as f:
+            meta = json.load(f)
+        index[tag] = {'ngrams':meta['ngrams'], 'entries':meta['entries'], 'bytes':_directory_size(store_path)}
+    #index.json is written last, a partitioned store without it is incomplete
+    with open(os.path.join(pos_path, INDEX_NAME), 'w') as f_out:
+        json.dump({'format':POS_FORMAT, 'ngrams':len(ngram_dict), 'source':source, 'source_stat':source_stat, 'partitions':index}, f_out, indent=1)
+    return pos_path
+
+class PosStore:
+    def __init__(self, pos_path):
+        self.path = pos_path
+        with open(os.path.join(pos_path, INDEX_NAME), 'r') as f:
+            self.index = json.load(f)
+        if self.index['format'] != POS_FORMAT:
+            raise ValueError('Unsupported POS store format '+str(self.index['format'])+' in '+pos_path)
+        self.partitions = dict()
+
+    def tags(self):
+        return list(self.index['partitions'])
+
+    def select(self, tags=None):
+        #The tags of tags (all of them by default) that have a partition
+        return [tag for tag in (self.tags() if tags is None else tags) if tag in self.index['partitions']]
+
+    def size(self, tags=None):
+        #Bytes of the partitions of tags
+        return sum(self.index['partitions'][tag]['bytes'] for tag in self.select(tags))
+
+    def partition(self, tag):
+        #NgramStore of one tag, only opened (memory-mapped) when it is first needed
+        if tag not in self.partitions:
+            self.partitions[tag] = open_store(os.path.join(self.path, tag+STORE_SUFFIX))
+        return self.partitions[tag]
+
+    def _merged_order(self, tags):
+        #(partition of every ngram, row of the ngram in its store) of the ngrams of tags, in the order of the source dictionary
+        parts, rows, positions = [], [], []
+        for i, tag in enumerate(self.select(tags)):
+            store = self.partition(tag)
+            order = store.source_order()
+            parts.append(np.full(len(order), i, dtype=np.int64))
+            rows.append(order)
+            positions.append(np.load(os.path.join(store.path, 'positions.npy')))
+        if not parts:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        order = np.argsort(np.concatenate(positions), kind='stable')
+        return np.concatenate(parts)[order], np.concatenate(rows)[order]
+
+    def chunks(self, tags, t_start, t_end, chunk_words=100000):
+        #Yields (words, words x years matrix) chunks of the ngrams of tags, in the order of the source dictionary, like create_lexicon.shard_chunks()
+        tags = self.select(tags)
+        parts, rows = self._merged_order(tags)
+        stores = [self.partition(tag) for tag in tags]
+        words = [store.words() for store in stores]
+        for start in range(0, len(rows), chunk_words):
+            chunk_parts, chunk_rows = parts[start:start+chunk_words], rows[start:start+chunk_words]
+            dense = np.zeros((len(chunk_rows), t_end-t_start+1), dtype=MATCH_COUNT_DTYPE)
+            chunk_ngrams = [None]*len(chunk_rows)
+            for i, store in enumerate(stores):
+                where = np.flatnonzero(chunk_parts == i)
+                if len(where):
+                    dense[where] = store.to_dense(t_start, t_end, chunk_rows[where])
+                    for j, row in zip(where.tolist(), chunk_rows[where].tolist()):
+                        chunk_ngrams[j] = words[i][row]
+            yield chunk_ngrams, dense
+
+    def items(self, tags=None, first_year=None):
+        #(ngram, {year:match_count}) of the ngrams of tags in the order of the source dictionary, only the years from first_year
+        tags = self.select(tags)
+        parts, rows = self._merged_order(tags)
+        stores = [self.partition(tag) for tag in tags]
+        words = [store.words() for store in stores]
+        for i, row in zip(parts.tolist(), rows.tolist()):
+            store = stores[i]
+            start, stop = store.offsets[row], store.offsets[row+1]
+            records = zip(store.years[start:stop].tolist(), store.counts[start:stop].tolist())
+            yield words[i][row], {year:count for year, count in records if first_year is None or year >= first_year}
+
+    def to_dict(self, tags=None, first_year=None, str_years=True):
+        #{ngram:{year:match_count}} of the ngrams of tags, with str years like the JSON files by default
+        if str_years:
+            return {ngram:{str(year):count for year, count in records.items()} for ngram, records in self.items(tags, first_year)}
+        return dict(self.items(tags, first_year))
+
+def open_pos_store(pos_path):
+    return PosStore(pos_path)
+
+def is_complete(pos_path):
+    return os.path.exists(os.path.join(pos_path, INDEX_NAME))
+
+def has_pos_store(pos_path):
+    #True if the POS store is complete and its source file is unchanged since it was partitioned (or gone)
+    if not is_complete(pos_path):
+        return False
+    with open(os.path.join(pos_path, INDEX_NAME), 'r') as f:
+        index = json.load(f)
+    if not index['source']:
+        return True
+    source_path = os.path.join(os.path.dirname(os.path.normpath(pos_path)), index['source'])
+    return not os.path.exists(source_path) or index.get('source_stat') == file_stat(source_path)
+
+def tagged_lexemes(directory, file_path):
+    #{word_TAG:{year:match_count}} of a raw shard: the lexemes lowercased but not lemmatized, only the entries used in more than one volume
+    ngram_dict = dict()
+    for block in read_blocks(directory, file_path):
+        lexemes = list(lexeme_rows(block))
+        for (unigram, entries), records in zip(lexemes, records_from_entries_list([entries for unigram, entries in lexemes])):
+            word, underscore, tag = unigram.partition('_')
+            unigram = word.lower().strip()+underscore+tag
+            #Words which only differ by case are added up
+            if unigram in ngram_dict:
+                merge_ngram_dicts(ngram_dict, {unigram:records})
+            else:
+                ngram_dict[unigram] = records
+    return ngram_dict
+
+def partition_shard(directory, file_path):
+    #One pass over a raw shard, saved as a POS partitioned store
+    source_stat = file_stat(directory+file_path)
+    return save_partitioned(tagged_lexemes(directory, file_path), pos_path_for(directory, file_path), source=file_path, source_stat=source_stat)
+
+def partition_file(directory, file_name):
+    #POS partitioned store of a -COMPLETE.json or -preprocessed.pickle file
+    source_stat = file_stat(directory+file_name)
+    if file_name.endswith('.json'):
+        with open(directory+file_name, 'r') as f:
+            ngram_dict = json.load(f)
+    else:
+        with open(directory+file_name, 'rb') as f:
+            ngram_dict = pickle.load(f)
+    return save_partitioned(ngram_dict, pos_path_for(directory, file_name), source=file_name, source_stat=source_stat)
+
+def partition_directory(directory, overwrite=False, workers=None):
+    #Partitions every raw shard, -COMPLETE.json and -preprocessed.pickle of the directory that does not have a POS store yet, or whose POS store is stale
+    shards, files = [], []
+    for file_name in sorted(os.listdir(directory)):
+        if not overwrite and has_pos_store(pos_path_for(directory, file_name)):
+            continue
+        if '.gz' in file_name and not '.json' in file_name:
+            shards.append(file_name)
+        elif file_name.endswith('-COMPLETE.json') or file_name.endswith('-preprocessed.pickle'):
+            files.append(file_name)
+    partitioned = [partition_file(directory, file_name) for file_name in files]
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        partitioned.extend(tqdm(executor.map(partial(partition_shard, directory), shards), total=len(shards), unit='shard'))
+    return partitioned
+
+def export_json(directory, tags=CLOSED_CLASSES, name='_CLOSED_CLASSES', first_year=CLOSED_CLASSES_FIRST_YEAR):
+    #Writes <shard><name>.json with the ngrams of tags of every partitioned raw shard, returns the bytes read and the bytes of all the partitions
+    pos_names = [file_name for file_name in sorted(os.listdir(directory))
+                 if file_name.endswith(POS_SUFFIX) and is_complete(directory+file_name) and not file_name[:-len(POS_SUFFIX)].endswith(('-COMPLETE', '-preprocessed'))]
+    #Nothing is written if any of them is stale
+    for file_name in pos_names:
+        if not has_pos_store(directory+file_name):
+            raise ValueError(directory+file_name+' is older than its raw shard, partition it again with pos_store.py')
+    read, total = 0, 0
+    for file_name in pos_names:
+        pos_store = open_pos_store(directory+file_name)
+        ngram_dict = pos_store.to_dict(tags, first_year)
+        output = file_name[:-len(POS_SUFFIX)]+name+'.json'
+        if len(ngram_dict)>0:
+            with open(directory+output, 'w') as f_out:
+                json.dump(ngram_dict, f_out)
+            print('SAVED: ',output,len(ngram_dict))
+        else:
+            print('unigram dict empty',output)
+        read += pos_store.size(tags)
+        total += pos_store.size()
+    return read, total
+
+if __name__ == '__main__':
+
+    import argparse
+    parser = argparse.ArgumentParser(description='Partitions the raw shards and preprocessed files of a directory by POS tag, or exports some tags of the partitioned raw shards')
+
+    parser.add_argument('path', type=str, help="absolute path to the directory with the raw *.gz files or the preprocessed files")
+    parser.add_argument('-j', '--workers', type=int, required=False, default=os.cpu_count(), help="Number of worker processes for the raw shards. Default is the number of cores.")
+    parser.add_argument('--overwrite', action='store_true', help="Partition again the files which already have a POS store")
+    parser.add_argument('--export', type=str, nargs='*', default=None, help="Write the ngrams of these tags (default "+' '.join(CLOSED_CLASSES)+") of every partitioned raw shard to <shard><name>.json instead")
+    parser.add_argument('--name', type=str, required=False, default='_CLOSED_CLASSES', help="Suffix of the exported files. Default is _CLOSED_CLASSES")
+    parser.add_argument('--first-year', type=int, required=False, default=CLOSED_CLASSES_FIRST_YEAR, help="First year of the exported records. Default is "+str(CLOSED_CLASSES_FIRST_YEAR))
+
+    args = parser.parse_args()
+    directory = args.path
+    if directory[-1] != '\\' and directory[-1] != '/':
+        directory += '/'
+    if args.export is not None:
+        read, total = export_json(directory, args.export or CLOSED_CLASSES, args.name, args.first_year)
+        print('Read {:,} of {:,} bytes ({:.1%})'.format(read, total, read/total if total else 0))
+    else:
+        print('Partitioned', len(partition_directory(directory, args.overwrite, args.workers)), 'files')
@@ -7,17 +7,29 @@
 # The purpose of this is to filter through the entire dataset without limiting years. It will create \*\-COMPLETE.json files. It can be used to find the size of the lexicon.
 
 import os
-import gzip
-import numpy as np
+import time
 import pickle
 #for progress bars
 from tqdm import tqdm
 
 from nltk import WordNetLemmatizer
 lemmatizer = WordNetLemmatizer()
+#Memoizes lemmatizer.lemmatize(word,pos), optionally persisted to disk with --lemma-cache
+from lemma_cache import LemmaCache, format_stats
+lemma_cache = LemmaCache(lemmatizer)
 
-#For checking if the word has any non-English-alphabetical letters
-from unidecode import unidecode
+#Compiled version of the lexeme tests (see lexeme_filter.py for the rules), also run on the raw bytes of the rows
+from lexeme_filter import lexeme_rows
+#Parses the year,match_count,volume_count entries of all the lexemes of a block into typed arrays in one call
+from ngram_parser import records_from_entries_list
+#Records finished shards and checkpoints partial ones so an interrupted run can resume
+from shard_manifest import ShardManifest, ShardCheckpoint, CHECKPOINT_ROWS
+#Inflates the shards into line-aligned blocks of bytes
+from shard_pipeline import read_blocks, block_rows, merge_ngram_dicts, BLOCK_SIZE
+#Per-stage timers and rejection counters of each shard
+from ingest_metrics import IngestMetrics, metrics_path, format_metrics
+#Writes the ngrams of a shard partitioned by POS tag as well, with --pos-store
+from pos_store import save_partitioned, pos_path_for
 
 import re
 #For the Google POS tagging mapping
@@ -46,18 +58,6 @@ underscore = re.compile('_{1}')
 # - _CONJ_	conjunction
 # - _PRT_	particle
 
-# Define sets which are going to be used in the unigram tests
-
-import string
-PUNCTUATION = set(char for char in string.punctuation).union({'“','”'})
-#ALPHABET = set(string.ascii_letters)
-
-DIGITS = set(string.digits)
-VOWELS = set("aeiouyAEIOUY")
-#Excluding '_' (underscore) from DASHES precludes the tagged 1grams "_NOUN", add it to also include the tagged 1grams
-DASHES = {'—','–','—','―','‒','-','_'}
-PUNCTUATION.difference_update(DASHES)
-STOPS = PUNCTUATION.union(DIGITS)
 #GOOGLE_TAGS = {'_NOUN','_VERB','_ADJ','_ADV','_PRON','_DET','_ADP','_NUM','_CONJ','_PRT'}
 
 #maps Google pos_tag to Wordnet pos_tag
@@ -66,117 +66,197 @@ POS_mapper = {'NOUN':'n',
               'ADJ':'a',
               'ADV':'v'}
 
-def open_gzip(directory,file_path):
-    with gzip.open(directory+file_path,'r') as f_in:
-        for line in f_in:
-            yield line.decode('utf8').strip()
-
 def save_pickle(ngram_dict,directory,file_path):
     output = file_path[:-3]+'-preprocessed.pickle'
     if len(ngram_dict)>0:
         with open(directory+output, 'wb') as f_out:
             pickle.dump(ngram_dict, f_out)
         print('SAVED: ',output,len(ngram_dict))
+        return output
     else:
         print('unigram dict empty',output)
 
-def csv2tuple(string):
-    year,match_count,volume_count = tuple(string.split(','))
-    return np.int8(year),np.int32(match_count),np.int16(volume_count)
-
-def unigram_tests(unigram):
-    #Exclude words with more than one underscore, can make this != to only include tagged words
-    if len(underscore.findall(unigram))!=1:
-        return False
-    
-    #Checks each character in the unigram against the characters in the STOP set. (character level filtering) - no punctuation or digits allowed
-    if set(unigram).intersection(STOPS):
-        return False
-    
-    #Excluded all of the form _PRON_ (or anything that starts or ends with an underscore)
-    if unigram[0] == '_' or unigram[-1] == '_':
-        return False
+def lemmatize_unigram(unigram):
+    word_tag = underscore.split(unigram) # list of [word,tag]
     
-    #must have a vowel (presupposes that it must also have a letter of the alphabet inside)
-    if not set(unigram).intersection(VOWELS):
-        return False 
+    pos = "n" #Default for wordnet lemmatizer
+    if word_tag[1] in POS_mapper.keys():
+        pos = POS_mapper[word_tag[1]]
     
-    #Words cannot start or end with dashes
-    if unigram[0] in DASHES or unigram[-1] in DASHES:
-        return False
+    #word_tag[0] removes the tag before processing unigram string
+    #Lemmatize based on POS
+    unigram = lemma_cache.lemmatize(word_tag[0].lower().strip(),pos)
     
-    #must have 0 non-english letters
-    test = unidecode(unigram, errors='replace')
-    if test != unigram:
-        return False
-    
-    #Can implement more tests here if you need to do more filtering
-    
-    else:
-        return True
+    #Adds the tag back onto the unigram
+    return unigram+'_'+word_tag[1]
 
-def preprocess_ngrams(directory,file_path):
+def preprocess_lexemes(lexemes, ngram_dict=None, metrics=None):
+    #lexemes are the (unigram, entries) of the rows that passed the word tests
+    #Each stage runs over all the lexemes at once, so that with metrics (an IngestMetrics) it is timed once per block
     
-    ngram_dict = dict()
+    if ngram_dict is None:
+        ngram_dict = dict()
+
+    lexemes = list(lexemes)
+    if metrics is not None:
+        metrics.count('lexemes', len(lexemes))
+        metrics.lap('lemmatize')
+    unigrams = [lemmatize_unigram(unigram) for unigram, entries in lexemes]
+
+    if metrics is not None:
+        metrics.lap('parse')
+    #Parse all the entries of each row at once and create a dictionary of records in form {year:match_count}
+    #Only years with volume_count>1 are kept, because only words in >1 volume are reasonably assumed to be used by >1 person
+    all_records = records_from_entries_list([entries for unigram, entries in lexemes])
+    if metrics is not None:
+        n_entries = sum(entries.count('\t')+1 for unigram, entries in lexemes if entries)
+        metrics.count('entries', n_entries)
+        metrics.count('entries_dropped', n_entries-sum(map(len, all_records)))
+        metrics.lap('merge')
 
     #This implementation uses {1gram:{year:match_count ...} ...}
-    i=0
-    for row in tqdm(open_gzip(directory,file_path)):
-        columns = row.split('\t')
-        #unigram is the first entry, the rest of the entries are of the form year,match_count,volume_count\t n times, where n is variable each line
-        
-        unigram = columns[0]
-        #If it passes the word tests continue parsing and lemmatizing the unigram
-        if unigram_tests(unigram):
-            word_tag = underscore.split(unigram) # list of [word,tag]
-            
-            pos = "n" #Default for wordnet lemmatizer
-            if word_tag[1] in POS_mapper.keys():
-                pos = POS_mapper[word_tag[1]]
-            
-            #word_tag[0] removes the tag before processing unigram string
-            #Lemmatize based on POS
-            unigram = lemmatizer.lemmatize(word_tag[0].lower().strip(),pos)
-            
-            #Adds the tag back onto the unigram
-            unigram+='_'+word_tag[1]
-            
-            #Parse the new entry and create a dictionary of records in form {year:match_count}
-            records = dict()
-            for entry in columns[1:]:
-                year,match_count,volume_count = csv2tuple(str(entry))
-                #This is the crucial filtering by volume count because only words in >1 volume are reasonably assumed to be used by >1 person
-                #Words only used by one person - which translates the computational parameter 1 volume - are not considered part of the lexicon
-                if volume_count>1:
-                    records[year] = match_count
-
-            #Modify the dictionary if new entry is already there, else just add it as a new unigram:records to the dict
-            if unigram in ngram_dict.keys():
-                #accessing the ngram dictionary and seeing if each year is present, if so add match count, else add a new record entry to the dictionary.
-                for yr, match_ct in records.items(): #each record should be of the form {year:match_count}
-                    #If the year in the new record is in the dict for this 1gram, then find where it is.
-                    if yr in ngram_dict[unigram].keys():
-                        ngram_dict[unigram][yr] += match_ct
-                    else:
-                        #This just adds the record to the end, will need to sort later
-                        ngram_dict[unigram][yr] = match_ct
-            else:
-                ngram_dict[unigram] = records
+    for unigram, records in zip(unigrams, all_records):
+        #Modify the dictionary if new entry is already there, else just add it as a new unigram:records to the dict
+        if unigram in ngram_dict.keys():
+            #accessing the ngram dictionary and seeing if each year is present, if so add match count, else add a new record entry to the dictionary.
+            for yr, match_ct in records.items(): #each record should be of the form {year:match_count}
+                #If the year in the new record is in the dict for this 1gram, then find where it is.
+                if yr in ngram_dict[unigram].keys():
+                    ngram_dict[unigram][yr] += match_ct
+                else:
+                    #This just adds the record to the end, will need to sort later
+                    ngram_dict[unigram][yr] = match_ct
+        else:
+            ngram_dict[unigram] = records
+    
+    return ngram_dict
+
+def preprocess_block(block, ngram_dict=None, metrics=None):
+    #A line-aligned block of raw bytes -> partial {1gram:{year:match_count ...} ...}, only the rows that pass the word tests are decoded
+    #Also the pipeline stage run by the workers
+    if metrics is None:
+        return preprocess_lexemes(lexeme_rows(block), ngram_dict)
+    metrics.lap('filter')
+    metrics.count('rows', block_rows(block))
+    return preprocess_lexemes(lexeme_rows(block, metrics.rejections), ngram_dict, metrics)
+
+def preprocess_block_metrics(block):
+    #Pipeline stage run by the workers when the shard is instrumented, the metrics of the block and what the worker's lemma cache
+    #learned from it (see LemmaCache.delta()) are sent back with its partial dictionary
+    metrics = IngestMetrics()
+    ngram_dict = preprocess_block(block, metrics=metrics)
+    metrics.lap()
+    return ngram_dict, metrics.to_dict(), lemma_cache.delta()
+
+def preprocess_block_cached(block):
+    #Pipeline stage run by the workers otherwise, only the lemma cache delta is sent back with the partial dictionary
+    return preprocess_block(block), lemma_cache.delta()
+
+#Bump when a change to the preprocessing changes its output, so the shards preprocessed before are not skipped by the manifest
+PREPROCESS_VERSION = 1
+MANIFEST_NAME = 'preprocess-manifest.json'
+RUN_METRICS_NAME = 'preprocess-metrics.json'
+MANIFEST_PARAMS = {'version':PREPROCESS_VERSION, 'output':'-preprocessed.pickle'}
+
+def preprocess_ngrams(directory,file_path,workers=1,checkpoint=None,metrics=None):
+    #With metrics (an IngestMetrics), the stages are timed and the rows, lexemes, rejections and entries dropped by the volume filter are counted
     
+    if workers>1:
+        #Pipelined mode, the shard is inflated in blocks which are preprocessed by a pool of workers and merged in file order
+        #The lookups happen in the workers, their stats and new entries are merged into this process' lemma cache
+        from shard_pipeline import run_pipeline
+        if metrics is None:
+            def merge_cached(ngram_dict, result):
+                partial_dict, cache_delta = result
+                lemma_cache.merge(cache_delta)
+                merge_ngram_dicts(ngram_dict, partial_dict)
+            return run_pipeline(directory, file_path, preprocess_block_cached, workers=workers, checkpoint=checkpoint, merge_fn=merge_cached)
+        def merge_fn(ngram_dict, result):
+            #The timers of the workers add up to more than the wall time, the time they wait for the blocks to be inflated is not counted
+            partial_dict, block_metrics, cache_delta = result
+            metrics.merge(block_metrics)
+            lemma_cache.merge(cache_delta)
+            metrics.lap('merge')
+            merge_ngram_dicts(ngram_dict, partial_dict)
+            metrics.lap()
+        return run_pipeline(directory, file_path, preprocess_block_metrics, workers=workers, checkpoint=checkpoint, merge_fn=merge_fn)
+    
+    blocks = read_blocks(directory,file_path)
+    if checkpoint is None:
+        ngram_dict = dict()
+    else:
+        #Resumes from the checkpoint of an interrupted run (if there is one) and checkpoints the dictionary every checkpoint.every rows
+        ngram_dict = checkpoint.resume('blocks of '+str(BLOCK_SIZE))
+        blocks = checkpoint.skip(blocks)
+    if metrics is not None:
+        metrics.lap('decompress')
+    for block in tqdm(blocks, desc=file_path, unit='block', initial=0 if checkpoint is None else checkpoint.position):
+        preprocess_block(block, ngram_dict, metrics)
+        if metrics is not None:
+            metrics.lap('checkpoint')
+        if checkpoint is not None:
+            checkpoint.advance(ngram_dict, block_rows(block))
+        if metrics is not None:
+            metrics.lap('decompress')
+    if metrics is not None:
+        metrics.lap()
     return ngram_dict
 
+def save_metrics(metrics, directory, file_path, **info):
+    #Saves the metrics of a preprocessed shard next to its output
+    return metrics.save(metrics_path(directory, file_path, MANIFEST_PARAMS['output']), shard=file_path, **info)
+
 if __name__=='__main__':
-    import sys
+    import argparse
+    parser = argparse.ArgumentParser(description='Preprocesses every Google Ngrams shard in a directory into *-preprocessed.pickle files')
 
-    directory_absolute_path = sys.argv[1]
-    if directory_absolute_path[-1] != '\\' or directory_absolute_path[-1] != '/':
+    parser.add_argument('path', type=str, help="absolute path to the directory with the raw *.gz files")
+    parser.add_argument('workers', type=int, nargs='?', default=1, help="Number of workers used to pipeline each shard. Default is 1 (serial).")
+    parser.add_argument('--lemma-cache', type=str, required=False, default=None, help="File used to persist the lemmatization cache between runs")
+    parser.add_argument('--checkpoint-rows', type=int, required=False, default=CHECKPOINT_ROWS, help="Rows between two checkpoints of a shard, 0 disables checkpoints. Default is "+str(CHECKPOINT_ROWS)+".")
+    parser.add_argument('--force', action='store_true', help="Preprocess again the shards the manifest records as done")
+    parser.add_argument('--pos-store', action='store_true', help="Also save every shard partitioned by POS tag (see pos_store.py), so analyses of a few tags only read their partitions")
+
+    args = parser.parse_args()
+    directory_absolute_path = args.path
+    if directory_absolute_path[-1] != '\\' and directory_absolute_path[-1] != '/':
         directory_absolute_path += '/'
+    workers = args.workers
+    if args.lemma_cache:
+        print('Loaded', lemma_cache.load(args.lemma_cache), 'cached lemmas')
+
+    #Shards that are done (same input, same parameters, output still there) are skipped
+    manifest = ShardManifest(directory_absolute_path, MANIFEST_NAME, MANIFEST_PARAMS)
 
     #Run from command line
+    run_metrics = IngestMetrics()
+    run_start = time.perf_counter()
+    shards = []
     files = os.listdir(os.path.abspath(directory_absolute_path))
     for file_path in files:
         if '.gz' in file_path and not '.json' in file_path:
-            ngram_dict = preprocess_ngrams(directory_absolute_path, file_path)
+            if not args.force and manifest.is_done(file_path):
+                print('SKIPPED: ',file_path)
+                continue
+            start = time.perf_counter()
+            metrics = IngestMetrics()
+            checkpoint = ShardCheckpoint(directory_absolute_path, file_path, MANIFEST_PARAMS, args.checkpoint_rows)
+            ngram_dict = preprocess_ngrams(directory_absolute_path, file_path, workers, checkpoint, metrics)
             #Save as Pickle
-            save_pickle(ngram_dict,directory_absolute_path,file_path)
-            del ngram_dict
\ No newline at end of file
+            metrics.lap('save')
+            output = save_pickle(ngram_dict,directory_absolute_path,file_path)
+            if args.pos_store and output:
+                save_partitioned(ngram_dict, pos_path_for(directory_absolute_path, output), source=output)
+            manifest.finish(file_path, output, checkpoint.rows, len(ngram_dict))
+            checkpoint.remove()
+            save_metrics(metrics, directory_absolute_path, file_path, output=output, ngrams=len(ngram_dict), wall_time=time.perf_counter()-start)
+            print(format_metrics(metrics))
+            run_metrics.merge(metrics)
+            shards.append(file_path)
+            del ngram_dict
+            if args.lemma_cache:
+                lemma_cache.save(args.lemma_cache)
+    run_metrics.save(directory_absolute_path+RUN_METRICS_NAME, shards=shards, wall_time=time.perf_counter()-run_start, lemma_cache=lemma_cache.stats())
+    
+    #In pipelined mode these include the lookups of the workers
+    print(format_stats(lemma_cache.stats()))
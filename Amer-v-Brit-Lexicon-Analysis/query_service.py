@@ -0,0 +1,352 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# # Local query service
+#
+# A notebook that only needs the time series of a few words or the top lexemes of one window still starts by loading whole
+# `-COMPLETE.json` files with `open_json()` (or pickles with `open_pickle()`), and every notebook and every analyst loads its own copy.
+# The query service opens each corpus once and answers queries over a small local HTTP API, so the notebooks share one loaded copy:
+# - the `-COMPLETE.store` stores of every corpus (see ngram_store.py) are memory-mapped, a word is a binary search in each store.
+#   A lemma can be in several shards, its series is the sum of its counts in all of them
+# - the lexicons are read through their ranking indexes (see lexicon_rank.py), a lexicon that has not been created yet is created
+#   and saved once by `create_lexicon.create_lexicons()`, like `create_lexicon.py` would (or restored from a lexicon cache, `--lexicon-cache`, see lexicon_cache.py)
+# - the encoded responses are kept in a bounded least-recently-used cache, so a repeated query is a dictionary lookup.
+#   The responses and the ranking indexes are keyed on the size and modification time (`file_stat()`) of the files they were read
+#   from, so a store converted again, a changed source file or a changed LEXICON file is read again instead of answered from the cache
+#
+# Queries (GET, the answers are JSON):
+# - `/corpora`: names, directories and number of stores of the corpora
+# - `/series?corpus=AMER&word=colour_NOUN&word=color_NOUN&start=1800&end=2019`: {word: {year: match_count}} (start and end are optional)
+# - `/prefix?corpus=AMER&prefix=colo&limit=100`: the words that start with prefix, sorted
+# - `/lexicon?corpus=AMER&start=1851&end=1900&step=1&offset=0&limit=1000`: name and size of the lexicon and a page of its lexemes (all of them without limit)
+# - `/top?corpus=AMER&start=1851&end=1900&step=1&metric=frequency&k=25&tail=0`: [[lexeme, record]] like `top_counts()`
+# - `/stats`: hits, misses, evictions and size of the response cache
+#
+# `QueryClient` calls the service from Python and returns the same types as the notebooks' functions, and `QueryEngine` answers the same
+# queries in process without a server.
+#
+# Usage:
+# `python query_service.py -c AMER C:\path\to\amer_unigram_data\ -c BRIT C:\path\to\brit_unigram_data\ --port 8765` serves both corpora on
+# http://127.0.0.1:8765, then in a notebook `QueryClient('http://127.0.0.1:8765').series('AMER', 'colour_NOUN')`
+
+import os
+import json
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs, urlencode
+from urllib.request import urlopen
+from urllib.error import HTTPError
+
+from ngram_store import open_corpus, list_stores, file_stat
+from lexicon_rank import open_rank_index
+from create_lexicon import create_lexicons, lexicon_name, save_json, save_rank, restore_cached, add_cached
+from lexicon_cache import LexiconCache
+
+HOST = '127.0.0.1'
+PORT = 8765
+CACHE_SIZE = 4096
+
+def _stat(path):
+    #file_stat() of a file, None if it does not exist
+    return tuple(file_stat(path)) if os.path.exists(path) else None
+
+class ResponseCache:
+    def __init__(self, max_size=CACHE_SIZE):
+        self.max_size = max_size
+        #{query:encoded response}, ordered from least to most recently used
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self.lock:
+            if key in self.cache:
+                self.hits += 1
+                self.cache.move_to_end(key)
+                return self.cache[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, response):
+        with self.lock:
+            self.cache[key] = response
+            self.cache.move_to_end(key)
+            while len(self.cache) > self.max_size:
+                self.cache.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        return {'hits':self.hits,
+                'misses':self.misses,
+                'evictions':self.evictions,
+                'size':len(self.cache)}
+
+class QueryEngine:
+    def __init__(self, corpora, cache_size=CACHE_SIZE, lexicon_cache=None):
+        #corpora is {name: directory of the -COMPLETE.json files and their stores}
+        #With lexicon_cache (a LexiconCache), missing lexicons are restored from it when it has them and added to it when they are created
+        self.directories = dict()
+        self.stores = dict()
+        #{corpus: stat of its stores when they were opened}, see _corpus_stat()
+        self.stats = dict()
+        #{(corpus, t_start, t_end, t_step): (stat of the LEXICON file, its ranking index or None)}
+        self.indexes = dict()
+        self.open_lock = threading.Lock()
+        for name, directory in corpora.items():
+            self.directories[name] = directory
+            self._open(name)
+        #Creating a missing lexicon takes a pass over the corpus, one at a time
+        self.lexicon_lock = threading.Lock()
+        self.cache = ResponseCache(cache_size)
+        self.lexicon_cache = lexicon_cache
+
+    def _corpus_stat(self, corpus, stores):
+        #file_stat() of the meta.json of every store of the corpus and of the source files of the open stores,
+        #it changes when a store is added, removed or converted again, or when a source file changes
+        directory = self.directories[corpus]
+        return (tuple((name, _stat(os.path.join(directory, name, 'meta.json'))) for name in list_stores(directory)),
+                tuple(_stat(os.path.join(os.path.dirname(os.path.normpath(store.path)), store.meta['source']))
+                      for store in stores if store.meta['source']))
+
+    def _open(self, corpus):
+        directory = self.directories[corpus]
+        stores = open_corpus(directory)
+        if not stores:
+            raise ValueError('No -COMPLETE.store in '+directory+', convert the -COMPLETE.json files with ngram_store.py first')
+        stores = list(stores.values())
+        self.stats[corpus] = self._corpus_stat(corpus, stores)
+        self.stores[corpus] = stores
+        #The lexicons of the corpus are looked up again, an empty one may not be empty anymore
+        for key in list(self.indexes):
+            if key[0] == corpus:
+                self.indexes.pop(key, None)
+        print('Opened', corpus, len(stores), 'stores')
+
+    def _refresh(self, corpus):
+        #Opens the stores of the corpus again if they changed since they were opened (open_corpus() refuses a stale one), returns their stat
+        stat = self._corpus_stat(corpus, self.stores[corpus])
+        if stat != self.stats[corpus]:
+            with self.open_lock:
+                if self._corpus_stat(corpus, self.stores[corpus]) != self.stats[corpus]:
+                    self._open(corpus)
+        return self.stats[corpus]
+
+    def _stores(self, corpus):
+        if corpus not in self.stores:
+            raise KeyError('Unknown corpus '+str(corpus))
+        self._refresh(corpus)
+        return self.stores[corpus]
+
+    def corpora(self):
+        return {name:{'directory':self.directories[name], 'stores':len(self._stores(name))} for name in self.stores}
+
+    def series(self, corpus, words, t_start=None, t_end=None):
+        #{word: {year: match_count}} summed over the stores, {} for a word that is in none of them
+        stores = self._stores(corpus)
+        series = dict()
+        for word in words:
+            records = dict()
+            for store in stores:
+                i = store.index(word)
+                if i < 0:
+                    continue
+                start, stop = store.offsets[i], store.offsets[i+1]
+                for year, count in zip(store.years[start:stop].tolist(), store.counts[start:stop].tolist()):
+                    if (t_start is None or year >= t_start) and (t_end is None or year <= t_end):
+                        records[year] = records.get(year, 0)+count
+            series[word] = dict(sorted(records.items()))
+        return series
+
+    def prefix(self, corpus, prefix, limit=None):
+        #Sorted words of any store that start with prefix, the first limit of them
+        if limit is not None and limit < 0:
+            raise ValueError('limit must not be negative')
+        words = set()
+        for store in self._stores(corpus):
+            start, stop = store.prefix_range(prefix)
+            if limit is not None:
+                stop = min(stop, start+limit)
+            words.update(store.word(i) for i in range(start, stop))
+        #The stores are sorted by utf8 bytes, and so are the first limit words of their union
+        words = sorted(words, key=lambda word: word.encode('utf8'))
+        return words if limit is None else words[:limit]
+
+    def rank_index(self, corpus, t_start, t_end, t_step=1):
+        #Ranking index of the lexicon of a window, the lexicon is created and saved first if the corpus does not have it
+        #None for an empty lexicon (create_lexicon.py does not save those)
+        #The index is opened again when the LEXICON file changed since (open_rank_index() rebuilds it from the file)
+        key = (corpus, t_start, t_end, t_step)
+        self._stores(corpus)
+        directory = self.directories[corpus]
+        name = lexicon_name(t_start, t_end, t_step)
+        cached = self.indexes.get(key)
+        if cached is None or cached[0] != _stat(directory+name+'.json'):
+            with self.lexicon_lock:
+                cached = self.indexes.get(key)
+                if cached is not None and cached[0] == _stat(directory+name+'.json'):
+                    return cached[1]
+                window = (t_start, t_end, t_step)
+                missing = not os.path.exists(directory+name+'.json')
+                if missing and self.lexicon_cache is not None:
+                    keys = restore_cached(directory, [window], self.lexicon_cache)
+                    #Still missing unless the cache had it (restored, or cached as empty)
+                    missing = window in keys
+                if missing:
+                    print('Creating', name, 'for', corpus)
+                    lexicon = create_lexicons(directory, [window])[name]
+                    save_json(lexicon, directory, name)
+                    save_rank(lexicon, directory, name)
+                    if self.lexicon_cache is not None:
+                        add_cached(directory, window, keys[window], self.lexicon_cache, len(lexicon))
+                stat = _stat(directory+name+'.json')
+                cached = (stat, None if stat is None else open_rank_index(directory, name+'.json'))
+                self.indexes[key] = cached
+        return cached[1]
+
+    def lexicon(self, corpus, t_start, t_end, t_step=1, offset=0, limit=None):
+        #Name, size and the lexemes [offset, offset+limit) of a lexicon, in the order of its LEXICON file
+        if offset < 0 or (limit is not None and limit < 0):
+            raise ValueError('offset and limit must not be negative')
+        index = self.rank_index(corpus, t_start, t_end, t_step)
+        size = 0 if index is None else len(index)
+        stop = size if limit is None else min(size, offset+limit)
+        return {'name':lexicon_name(t_start, t_end, t_step), 'size':size,
+                'lexemes':[index.lexeme(i) for i in range(offset, stop)]}
+
+    def top(self, corpus, t_start, t_end, t_step=1, metric='frequency', k=25, head=True):
+        #[(lexeme, record)] of the k lexemes with the highest (or lowest) metric, the items of top_counts()
+        index = self.rank_index(corpus, t_start, t_end, t_step)
+        if index is None:
+            return []
+        if metric not in index.metrics:
+            raise KeyError('Unknown metric '+str(metric))
+        return list(index.top_counts(metric, k, head).items())
+
+    def _version(self, path, one):
+        #Stats of the files the answer of a query is read from: the stores of its corpus (of every corpus for /corpora)
+        #and the LEXICON file of its window, a response cached before one of them changed is not found again
+        corpora = list(self.stores) if path == '/corpora' else [one('corpus')]
+        version = tuple(self._refresh(corpus) for corpus in corpora if corpus in self.stores)
+        if path in ('/lexicon', '/top') and one('corpus') in self.stores:
+            version += (_stat(self.directories[one('corpus')]+lexicon_name(one('start', None, int), one('end', None, int), one('step', 1, int))+'.json'),)
+        return version
+
+    def query(self, path, params):
+        #Encoded JSON answer of a query, params is {name: [values]} as parse_qs() returns it
+        if path == '/stats':
+            #Not cached
+            return json.dumps(self.cache.stats()).encode('utf8')
+        one = lambda name, default=None, convert=str: convert(params[name][0]) if name in params else default
+        key = (path, tuple(sorted((name, tuple(values)) for name, values in params.items())), self._version(path, one))
+        response = self.cache.get(key)
+        if response is not None:
+            return response
+        if path == '/corpora':
+            answer = self.corpora()
+        elif path == '/series':
+            answer = self.series(one('corpus'), params.get('word', []), one('start', None, int), one('end', None, int))
+        elif path == '/prefix':
+            answer = self.prefix(one('corpus'), one('prefix', ''), one('limit', None, int))
+        elif path == '/lexicon':
+            answer = self.lexicon(one('corpus'), one('start', None, int), one('end', None, int), one('step', 1, int), one('offset', 0, int), one('limit', None, int))
+        elif path == '/top':
+            answer = self.top(one('corpus'), one('start', None, int), one('end', None, int), one('step', 1, int), one('metric', 'frequency'), one('k', 25, int), not one('tail', 0, int))
+        else:
+            raise KeyError('Unknown query '+path)
+        response = json.dumps(answer).encode('utf8')
+        #A missing lexicon was created by the query, the response is cached under the stat of its new LEXICON file
+        self.cache.put(key[:2]+(self._version(path, one),), response)
+        return response
+
+class QueryHandler(BaseHTTPRequestHandler):
+    #The engine is set on the server by serve()
+    def do_GET(self):
+        url = urlsplit(self.path)
+        try:
+            status, response = 200, self.server.engine.query(url.path, parse_qs(url.query))
+        except (KeyError, ValueError, TypeError) as e:
+            status, response = 400, json.dumps({'error':str(e.args[0]) if e.args else str(e)}).encode('utf8')
+        except Exception as e:
+            status, response = 500, json.dumps({'error':repr(e)}).encode('utf8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, format, *args):
+        #Only the errors are printed
+        pass
+
+def serve(engine, host=HOST, port=PORT):
+    #Answers the queries on host:port until interrupted, each request on its own thread
+    server = ThreadingHTTPServer((host, port), QueryHandler)
+    server.engine = engine
+    print('Serving', ', '.join(engine.stores), 'on http://'+host+':'+str(server.server_address[1]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return server
+
+class QueryClient:
+    def __init__(self, url='http://'+HOST+':'+str(PORT), timeout=None):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+
+    def _get(self, path, **params):
+        query = urlencode([(name, value) for name, values in params.items() if values is not None
+                           for value in (values if isinstance(values, (list, tuple)) else [values])])
+        try:
+            with urlopen(self.url+path+'?'+query, timeout=self.timeout) as response:
+                return json.load(response)
+        except HTTPError as e:
+            raise ValueError(json.load(e).get('error', str(e)))
+
+    def corpora(self):
+        return self._get('/corpora')
+
+    def series(self, corpus, word, t_start=None, t_end=None):
+        #{year: match_count} of one word, or {word: {year: match_count}} of a list of words, with int years
+        words = [word] if isinstance(word, str) else list(word)
+        series = {lexeme:{int(year):count for year, count in records.items()}
+                  for lexeme, records in self._get('/series', corpus=corpus, word=words, start=t_start, end=t_end).items()}
+        return series[word] if isinstance(word, str) else series
+
+    def prefix(self, corpus, prefix, limit=None):
+        return self._get('/prefix', corpus=corpus, prefix=prefix, limit=limit)
+
+    def lexicon(self, corpus, t_start, t_end, t_step=1, offset=0, limit=None):
+        return self._get('/lexicon', corpus=corpus, start=t_start, end=t_end, step=t_step, offset=offset, limit=limit)
+
+    def top_counts(self, corpus, t_start, t_end, t_step=1, count_type='frequency', num_hits=25, head=True):
+        #Same as the notebooks' top_counts() on the lexicon of the window
+        return OrderedDict(self._get('/top', corpus=corpus, start=t_start, end=t_end, step=t_step, metric=count_type, k=num_hits, tail=int(not head)))
+
+    def stats(self):
+        return self._get('/stats')
+
+if __name__ == '__main__':
+
+    import argparse
+    parser = argparse.ArgumentParser(description='Serves word series, prefix lookups, lexicons and top lexemes of preprocessed corpora over a local HTTP API')
+
+    parser.add_argument('-c', '--corpus', nargs=2, action='append', required=True, metavar=('NAME', 'DIRECTORY'), help="Name and directory of the -COMPLETE.json files and their stores of a corpus, can be repeated")
+    parser.add_argument('--host', type=str, required=False, default=HOST, help="Address to listen on. Default is "+HOST+" (this machine only)")
+    parser.add_argument('--port', type=int, required=False, default=PORT, help="Port to listen on. Default is "+str(PORT))
+    parser.add_argument('--cache-size', type=int, required=False, default=CACHE_SIZE, help="Number of responses kept in the cache. Default is "+str(CACHE_SIZE))
+    parser.add_argument('--lexicon-cache', type=str, required=False, default=None, help="Directory of a lexicon cache (see lexicon_cache.py) to restore missing lexicons from and add the created ones to")
+
+    args = parser.parse_args()
+    corpora = dict()
+    for name, directory in args.corpus:
+        if directory[-1] != '\\' and directory[-1] != '/':
+            directory += '/'
+        corpora[name] = directory
+    lexicon_cache = LexiconCache(args.lexicon_cache) if args.lexicon_cache else None
+    serve(QueryEngine(corpora, args.cache_size, lexicon_cache), args.host, args.port)
@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# # Shard manifest and checkpoints for resumable preprocessing
+#
+# A preprocessing run writes one output file per raw `.gz` shard, but nothing recorded which shards were finished,
+# so a run that died halfway through a corpus had to redo every shard.
+#
+# `ShardManifest` keeps a JSON file in the corpus directory with, for every shard:
+# - the fingerprint of its input (size and modification time of the `.gz` file)
+# - the preprocessing parameters it was run with
+# - the output file, the number of rows read and of ngrams saved, and its status (`done` or `failed`)
+#
+# A shard is skipped when it is `done`, its input and parameters have not changed and its output still exists.
+#
+# `ShardCheckpoint` periodically pickles the partial `{ngram:{year:match_count}}` dictionary of the shard being processed,
+# together with how far into the shard it got. An interrupted shard resumes from its last checkpoint:
+# the rows before it are still inflated, but not filtered, lemmatized or aggregated again.
+
+import os
+import json
+import time
+import pickle
+from collections import deque
+from itertools import islice
+
+MANIFEST_FORMAT = 1
+#Number of rows between two checkpoints of the same shard
+CHECKPOINT_ROWS = 2000000
+
+def file_fingerprint(path):
+    #Cheap fingerprint of an input file, a re-downloaded or modified shard gets a new one
+    stat = os.stat(path)
+    return {'size':stat.st_size, 'mtime_ns':stat.st_mtime_ns}
+
+def _replace(path, write, mode='w'):
+    #Writes to a temporary file first so that an interrupted write never leaves a truncated file behind
+    tmp_path = path+'.tmp'
+    with open(tmp_path, mode) as f_out:
+        write(f_out)
+    os.replace(tmp_path, path)
+
+class ShardManifest:
+    def __init__(self, directory, name, params=None):
+        self.directory = directory
+        self.path = directory+name
+        self.params = params or dict()
+        self.shards = dict()
+        if os.path.exists(self.path):
+            with open(self.path, 'r') as f:
+                manifest = json.load(f)
+            if manifest.get('format') == MANIFEST_FORMAT:
+                self.shards = manifest['shards']
+
+    def is_done(self, file_path):
+        entry = self.shards.get(file_path)
+        if entry is None or entry['status'] != 'done':
+            return False
+        if entry['params'] != self.params or entry['fingerprint'] != file_fingerprint(self.directory+file_path):
+            return False
+        #An empty shard has no output file
+        return entry['output'] is None or os.path.exists(self.directory+entry['output'])
+
+    def pending(self, file_paths):
+        #The shards of file_paths that still have to be preprocessed
+        return [file_path for file_path in file_paths if not self.is_done(file_path)]
+
+    def _record(self, file_path, **entry):
+        entry['fingerprint'] = file_fingerprint(self.directory+file_path)
+        entry['params'] = self.params
+        entry['time'] = time.strftime('%Y-%m-%d %H:%M:%S')
+        self.shards[file_path] = entry
+        self.save()
+
+    def finish(self, file_path, output, rows, ngrams):
+        self._record(file_path, status='done', output=output, rows=rows, ngrams=ngrams)
+
+    def fail(self, file_path, error):
+        #Only the last line of the traceback is kept, the full one is printed by the driver
+        self._record(file_path, status='failed', error=error.strip().split('\n')[-1])
+
+    def save(self):
+        _replace(self.path, lambda f_out: json.dump({'format':MANIFEST_FORMAT, 'shards':self.shards}, f_out, indent=1))
+
+class ShardCheckpoint:
+    '''
+    Checkpoint of one shard. position counts the units (rows or blocks) that have been added to the partial dictionary,
+    rows counts the rows among them.
+    '''
+    def __init__(self, directory, file_path, params=None, every=CHECKPOINT_ROWS):
+        #Named like the outputs (without '.gz') so the drivers do not mistake it for a shard
+        self.path = directory+file_path[:-3]+'-checkpoint.pickle'
+        self.fingerprint = file_fingerprint(directory+file_path)
+        self.params = params or dict()
+        self.every = every
+        self.unit = None
+        self.position = 0
+        self.rows = 0
+        self.since_saved = 0
+
+    def resume(self, unit):
+        #Returns the partial dictionary saved by an interrupted run of the same shard, in the same unit and with the same parameters, or a new one
+        self.unit = unit
+        if os.path.exists(self.path):
+            with open(self.path, 'rb') as f:
+                state = pickle.load(f)
+            if (state['fingerprint'], state['params'], state['unit']) == (self.fingerprint, self.params, unit):
+                self.position, self.rows = state['position'], state['rows']
+                print('RESUMING: ', os.path.basename(self.path), 'from', self.rows, 'rows')
+                return state['ngram_dict']
+        self.position, self.rows = 0, 0
+        return dict()
+
+    def skip(self, units):
+        #Drops the units the checkpoint already covers
+        units = iter(units)
+        deque(islice(units, self.position), maxlen=0)
+        return units
+
+    def advance(self, ngram_dict, rows=1):
+        #Called once a unit has been added to ngram_dict, saves a checkpoint every `every` rows
+        self.position += 1
+        self.rows += rows
+        self.since_saved += rows
+        if self.every and self.since_saved >= self.every:
+            self.save(ngram_dict)
+
+    def rows_of(self, rows, ngram_dict):
+        '''
+        Yields the rows that are not covered by the checkpoint. The next row is only requested once the previous one
+        has been added to ngram_dict, so the dictionary is complete up to self.position whenever a checkpoint is saved.
+        '''
+        for row in self.skip(rows):
+            yield row
+            self.advance(ngram_dict)
+
+    def save(self, ngram_dict):
+        state = {'fingerprint':self.fingerprint, 'params':self.params, 'unit':self.unit,
+                 'position':self.position, 'rows':self.rows, 'ngram_dict':ngram_dict}
+        _replace(self.path, lambda f_out: pickle.dump(state, f_out), 'wb')
+        self.since_saved = 0
+
+    def remove(self):
+        #The shard's output is saved, its checkpoint is no longer needed
+        if os.path.exists(self.path):
+            os.remove(self.path)
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# # Pipelined preprocessing of a single shard
+#
+# The serial `preprocess_ngrams()` inflates, splits, filters, lemmatizes and merges every row on one thread, so the largest shard sets the wall time.
+# Here the work is split into three stages:
+# 1. the parent process inflates the `.gz` file and cuts it into line-aligned blocks of bytes
+# 2. a pool of workers turns each block into a partial `{ngram:{year:match_count}}` dictionary (filtering, lemmatizing and aggregating inside the block)
+# 3. the parent merges the partial dictionaries back together **in block order**
+#
+# Merging in block order means every key and every year is inserted in the same order as the serial loop would insert it,
+# so the merged dictionary (and the file it is saved to) is identical to the serial output.
+
+import os
+import gzip
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from tqdm import tqdm
+
+#Size of the inflated blocks handed to the workers
+BLOCK_SIZE = 16*1024*1024
+
+def read_blocks(directory, file_path, block_size=BLOCK_SIZE):
+    #Yields line-aligned blocks of raw (still utf8 encoded) bytes from a gzip file
+    with gzip.open(directory+file_path, 'rb') as f_in:
+        leftover = b''
+        while True:
+            chunk = f_in.read(block_size)
+            if not chunk:
+                break
+            chunk = leftover+chunk
+            #Cut after the last complete line, the partial line is carried over to the next block
+            cut = chunk.rfind(b'\n')+1
+            if cut == 0:
+                leftover = chunk
+                continue
+            leftover = chunk[cut:]
+            yield chunk[:cut]
+        if leftover:
+            yield leftover
+
+def merge_ngram_dicts(ngram_dict, partial_dict):
+    #Adds the {ngram:{year:match_count}} records of partial_dict into ngram_dict, keeping first-seen order of ngrams and years
+    for ngram, records in partial_dict.items():
+        if ngram in ngram_dict:
+            merged = ngram_dict[ngram]
+            for yr, match_ct in records.items():
+                if yr in merged:
+                    merged[yr] += match_ct
+                else:
+                    merged[yr] = match_ct
+        else:
+            ngram_dict[ngram] = records
+    return ngram_dict
+
+def block_rows(block):
+    #Number of rows in a block, the last one may not end with a newline
+    return block.count(b'\n')+(not block.endswith(b'\n'))
+
+def run_pipeline(directory, file_path, block_fn, workers=None, block_size=BLOCK_SIZE, max_in_flight=None, merge_fn=merge_ngram_dicts, checkpoint=None):
+    '''
+    Preprocesses one shard with block_fn(block) -> partial dictionary on a pool of workers and returns the merged dictionary.
+    block_fn must be a module level function (so it can be sent to the workers) that takes a block of raw bytes.
+    max_in_flight caps the number of blocks that are inflated but not yet merged, which bounds the memory used by the pipeline.
+    checkpoint (a ShardCheckpoint, see shard_manifest.py) resumes an interrupted run and saves the merged dictionary periodically.
+    '''
+    workers = workers or os.cpu_count()
+    max_in_flight = max_in_flight or 2*workers
+
+    blocks = read_blocks(directory, file_path, block_size)
+    if checkpoint is None:
+        ngram_dict = dict()
+    else:
+        #Blocks are only the same from one run to the next if they are cut at the same size
+        ngram_dict = checkpoint.resume('blocks of '+str(block_size))
+        blocks = checkpoint.skip(blocks)
+
+    def merge(future, rows):
+        merge_fn(ngram_dict, future.result())
+        if checkpoint is not None:
+            checkpoint.advance(ngram_dict, rows)
+
+    in_flight = deque()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for block in tqdm(blocks, desc=file_path, unit='block'):
+            in_flight.append((executor.submit(block_fn, block), block_rows(block)))
+            #Reduce the oldest block first so the merge order is the file order
+            while len(in_flight) >= max_in_flight:
+                merge(*in_flight.popleft())
+        while in_flight:
+            merge(*in_flight.popleft())
+    return ngram_dict
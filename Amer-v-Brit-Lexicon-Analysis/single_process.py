@@ -1,6 +1,5 @@
 import os
 import gzip
-import numpy as np
 import pickle
 #for progress bars
 from tqdm import tqdm
@@ -8,23 +7,15 @@ from tqdm import tqdm
 from nltk import WordNetLemmatizer
 lemmatizer = WordNetLemmatizer()
 
-#For checking if the word has any non-English-alphabetical letters
-from unidecode import unidecode
+#Compiled version of the lexeme tests (see lexeme_filter.py for the rules)
+from lexeme_filter import unigram_tests
+#Parses all the year,match_count,volume_count entries of a row into typed arrays in one call
+from ngram_parser import records_from_entries
 
 import re
 #For the Google POS tagging mapping
 underscore = re.compile('_{1}')
 
-import string
-PUNCTUATION = set(char for char in string.punctuation).union({'“','”'})
-#ALPHABET = set(string.ascii_letters)
-
-DIGITS = set(string.digits)
-VOWELS = set("aeiouyAEIOUY")
-#Excluding '_' (underscore) from DASHES precludes the tagged 1grams "_NOUN", add it to also include the tagged 1grams
-DASHES = {'—','–','—','―','‒','-','_'}
-PUNCTUATION.difference_update(DASHES)
-STOPS = PUNCTUATION.union(DIGITS)
 #GOOGLE_TAGS = {'_NOUN','_VERB','_ADJ','_ADV','_PRON','_DET','_ADP','_NUM','_CONJ','_PRT'}
 
 #maps Google pos_tag to Wordnet pos_tag
@@ -48,41 +39,6 @@ def save_pickle(ngram_dict,directory,file_path):
     else:
         print('unigram dict empty',output)
         
-def csv2tuple(string):
-    year,match_count,volume_count = tuple(string.split(','))
-    return np.int8(year),np.int32(match_count),np.int16(volume_count)
-
-def unigram_tests(unigram):
-    #Exclude words with more than one underscore, can make this != to only include tagged words
-    if len(underscore.findall(unigram))!=1:
-        return False
-    
-    #Checks each character in the unigram against the characters in the STOP set. (character level filtering) - no punctuation or digits allowed
-    if set(unigram).intersection(STOPS):
-        return False
-    
-    #Excluded all of the form _PRON_ (or anything that starts or ends with an underscore)
-    if unigram[0] == '_' or unigram[-1] == '_':
-        return False
-    
-    #must have a vowel (presupposes that it must also have a letter of the alphabet inside)
-    if not set(unigram).intersection(VOWELS):
-        return False 
-    
-    #Words cannot start or end with dashes
-    if unigram[0] in DASHES or unigram[-1] in DASHES:
-        return False
-    
-    #must have 0 non-english letters
-    test = unidecode(unigram, errors='replace')
-    if test != unigram:
-        return False
-    
-    #Can implement more tests here if you need to do more filtering
-    
-    else:
-        return True
-
 def preprocess_ngrams(directory,file_path):
     
     ngram_dict = dict()
@@ -90,10 +46,9 @@ def preprocess_ngrams(directory,file_path):
     #This implementation uses {1gram:{year:match_count ...} ...}
     i=0
     for row in tqdm(open_gzip(directory,file_path)):
-        columns = row.split('\t')
         #unigram is the first entry, the rest of the entries are of the form year,match_count,volume_count\t n times, where n is variable each line
+        unigram, _, entries = row.partition('\t')
         
-        unigram = columns[0]
         #If it passes the word tests continue parsing and lemmatizing the unigram
         if unigram_tests(unigram):
             word_tag = underscore.split(unigram) # list of [word,tag]
@@ -109,14 +64,9 @@ def preprocess_ngrams(directory,file_path):
             #Adds the tag back onto the unigram
             unigram+='_'+word_tag[1]
             
-            #Parse the new entry and create a dictionary of records in form {year:match_count}
-            records = dict()
-            for entry in columns[1:]:
-                year,match_count,volume_count = csv2tuple(str(entry))
-                #This is the crucial filtering by volume count because only words in >1 volume are reasonably assumed to be used by >1 person
-                #Words only used by one person - which translates the computational parameter 1 volume - are not considered part of the lexicon
-                if volume_count>1:
-                    records[year] = match_count
+            #Parse all the entries of the row at once and create a dictionary of records in form {year:match_count}
+            #Only years with volume_count>1 are kept, because only words in >1 volume are reasonably assumed to be used by >1 person
+            records = records_from_entries(entries)
 
             #Modify the dictionary if new entry is already there, else just add it as a new unigram:records to the dict
             if unigram in ngram_dict.keys():
@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# # Synthetic Google Ngrams shards
+#
+# The real shards are many GB and cannot be checked in, so the benchmarks (see benchmark.py) run on shards generated here.
+# A corpus is fully determined by its parameters and seed: the same call writes the same `.gz` files (byte for byte, the gzip headers have no timestamp).
+#
+# The shards are in the 2020 export format (ngram TAB year,match_count,volume_count TAB ... NEWLINE) and look like the real ones:
+# - a Zipfian vocabulary: the ngram of rank r has a total match count proportional to 1/r^ZIPF_EXPONENT and is used in more years the more common it is
+# - lexemes are tagged with the Google POS tags (and some also come untagged, like in the export), with inflected forms of common English words
+#   so that the lemmatizer has work to do
+# - volume counts are at most the match counts, and the rarest ngrams are often in a single volume, so the volume filter drops some of their years
+# - a share of junk tokens (digits, punctuation, non-ASCII letters, no vowel, extra underscores, leading or trailing dashes) that `unigram_tests()` rejects
+# - 5-grams share their `w1 w2 _ w4 w5` contexts, so they form clusters with more than one bundle
+#
+# Usage:
+# `python synthetic_ngrams.py C:\path\to\synthetic\ -n 1 --shards 4 --rows 100000 --seed 0` writes 1-00000-of-00004.gz ... 1-00003-of-00004.gz
+
+import os
+import gzip
+import json
+import math
+import random
+from itertools import accumulate
+
+ZIPF_EXPONENT = 1.07
+FIRST_YEAR = 1700
+LAST_YEAR = 2019
+#Total match count of the most common ngram, summed over its years
+TOP_MATCH_COUNT = 10**9
+JUNK = 0.25
+METADATA_NAME = 'synthetic-ngrams.json'
+#Bump when the generator changes, so corpora written by an older version are not mistaken for the same data
+GENERATOR_VERSION = 1
+
+#Share of each POS tag among the tagged lexemes
+TAGS = {'NOUN':0.45, 'VERB':0.2, 'ADJ':0.15, 'ADV':0.06, 'PRON':0.03, 'DET':0.03, 'ADP':0.03, 'CONJ':0.02, 'PRT':0.02, 'NUM':0.01}
+#Common English words and some of their inflections, so lemmatization and the lemma cache behave as on real data
+ENGLISH = {'NOUN':['colour','colours','color','colors','time','times','man','men','child','children','house','houses','woman','women',
+                   'analysis','analyses','centre','center','programme','program','mouse','mice','day','days','city','cities'],
+           'VERB':['run','runs','running','ran','go','goes','went','gone','analyse','analyses','analysed','analyze','analyzed',
+                   'be','is','was','were','been','have','has','had','make','made','making','say','said','says'],
+           'ADJ':['good','better','best','big','bigger','biggest','grey','gray','happy','happier','new','newer','old','older'],
+           'ADV':['quickly','well','often','soon','sooner','rather','very'],
+           'PRON':['she','he','it','they','we','you','I'],
+           'DET':['the','a','an','this','these','that','those'],
+           'ADP':['of','in','on','at','upon','amongst','among'],
+           'CONJ':['and','or','but','nor'],
+           'PRT':['to','up','out','off'],
+           'NUM':['one','two','three','ten','hundred']}
+ONSETS = ['', 'b', 'c', 'd', 'f', 'g', 'h', 'j', 'k', 'l', 'm', 'n', 'p', 'r', 's', 't', 'v', 'w', 'z', 'br', 'ch', 'cl', 'dr', 'gr', 'pl', 'sh', 'st', 'th', 'tr']
+NUCLEI = ['a', 'e', 'i', 'o', 'u', 'y', 'ai', 'ea', 'ee', 'ou', 'oo']
+CODAS = ['', '', 'n', 'r', 's', 't', 'l', 'm', 'ng', 'ck', 'st']
+
+def _word(rng):
+    return ''.join(rng.choice(ONSETS)+rng.choice(NUCLEI)+rng.choice(CODAS) for _ in range(rng.choice((1, 1, 2, 2, 3))))
+
+def junk_token(rng):
+    #A token that unigram_tests() rejects, one kind of junk at a time
+    word, tag = _word(rng), rng.choice(list(TAGS))
+    kind = rng.randrange(8)
+    if kind == 0:
+        return word  #untagged
+    if kind == 1:
+        return str(rng.randrange(10**rng.randint(1,4)))+rng.choice(['', 'th', 's'])+'_'+rng.choice(['NUM', 'ADJ', 'NOUN'])
+    if kind == 2:
+        return rng.choice(['', word])+rng.choice(".,;:!?'\"()[]/&%“”")+rng.choice(['', word])+'_'+tag
+    if kind == 3:
+        return word[:1]+rng.choice('éüßçñøåäöæ')+word[1:]+'_'+tag
+    if kind == 4:
+        return rng.choice(['brr', 'hmm', 'shh', 'pst', 'tsk', 'nth'])+'_X'
+    if kind == 5:
+        return word+'_'+word+'_'+tag
+    if kind == 6:
+        return rng.choice(['-'+word, word+'-', '—'+word, word+'–'])+'_'+tag
+    return '_'+tag+rng.choice(['_', ''])
+
+def vocabulary(n_words, rng, junk=JUNK):
+    '''
+    n_words distinct tokens in order of decreasing frequency (their Zipf rank): tagged lexemes, some untagged copies and junk_token()s.
+    The English words come first since they are the most common.
+    '''
+    tokens, seen = [], set()
+    english = [(word, tag) for tag, words in ENGLISH.items() for word in words]
+    rng.shuffle(english)
+    tags, cum_weights = list(TAGS), list(accumulate(TAGS.values()))
+    while len(tokens) < n_words:
+        if rng.random() < junk:
+            token = junk_token(rng)
+        elif english and rng.random() < 0.5:
+            word, tag = english.pop()
+            token = word+'_'+tag
+        else:
+            word = _word(rng)
+            token = rng.choice([word, word, word.capitalize()])+'_'+rng.choices(tags, cum_weights=cum_weights)[0]
+        if token not in seen:
+            seen.add(token)
+            tokens.append(token)
+    return tokens
+
+def entries(rank, rng, first_year=FIRST_YEAR, last_year=LAST_YEAR, top_match_count=TOP_MATCH_COUNT):
+    #year,match_count,volume_count entries of the ngram of (1-based) Zipf rank, joined by tabs
+    weight = rank**-ZIPF_EXPONENT
+    span = last_year-first_year+1
+    n_years = max(1, min(span, round(span*weight**0.25)))
+    #A run of years with some gaps, most ngrams are still in use at the end
+    start = max(first_year, last_year-2*n_years+1-int(rng.expovariate(1/10)))
+    years = sorted(rng.sample(range(start, last_year+1), n_years))
+    mean = top_match_count*weight/n_years
+    fields = []
+    for year in years:
+        #Log-normal around the mean
+        match_count = max(1, int(mean*math.exp(rng.gauss(0, 1))))
+        volume_count = 1+int(rng.random()*match_count**0.8)
+        fields.append(str(year)+','+str(match_count)+','+str(volume_count))
+    return '\t'.join(fields)
+
+def unigram_rows(n_rows, rng, junk=JUNK):
+    #(rank, row) of n_rows 1-grams, every token once
+    tokens = vocabulary(n_rows, rng, junk)
+    for rank, token in enumerate(tokens, 1):
+        yield rank, token+'\t'+entries(rank, rng)
+
+def pentagram_rows(n_rows, rng, junk=JUNK, contexts=None):
+    '''
+    (rank, row) of n_rows distinct 5-grams. The w1 w2 _ w4 w5 contexts and the middle words are both drawn with Zipfian weights,
+    from contexts (default n_rows//8) contexts, so the common contexts come with many middle words.
+    '''
+    words = [token.partition('_')[0] if '_' in token[1:] and token[0] != '_' and rng.random() < 0.9 else token
+             for token in vocabulary(max(100, n_rows//4), rng, junk/4)]
+    cum_weights = list(accumulate(rank**-ZIPF_EXPONENT for rank in range(1, len(words)+1)))
+    n_contexts = contexts or max(1, n_rows//8)
+    contexts = [rng.choices(words, cum_weights=cum_weights, k=4) for _ in range(n_contexts)]
+    context_cum_weights = list(accumulate(rank**-ZIPF_EXPONENT for rank in range(1, n_contexts+1)))
+    seen = set()
+    while len(seen) < n_rows:
+        w1, w2, w4, w5 = rng.choices(contexts, cum_weights=context_cum_weights)[0]
+        pentagram = ' '.join((w1, w2, rng.choices(words, cum_weights=cum_weights)[0], w4, w5))
+        if pentagram in seen:
+            continue
+        seen.add(pentagram)
+        #5-grams are much rarer than 1-grams, their rank is scaled accordingly
+        yield len(seen), pentagram+'\t'+entries(len(seen)*100, rng, first_year=1800)
+
+def shard_name(n, shard, shards):
+    return str(n)+'-'+str(shard).zfill(5)+'-of-'+str(shards).zfill(5)+'.gz'
+
+def write_corpus(directory, n=1, shards=4, rows=100000, seed=0, junk=JUNK):
+    '''
+    Writes shards .gz files of n-grams (n is 1 or 5) with rows rows each into directory, the rows of the corpus are dealt to the shards at random.
+    The parameters are saved in synthetic-ngrams.json, returns them with the names and number of rows of the shards.
+    '''
+    rng = random.Random(seed)
+    generate = unigram_rows if n == 1 else pentagram_rows
+    os.makedirs(directory, exist_ok=True)
+    names = [shard_name(n, shard, shards) for shard in range(shards)]
+    files = [gzip.GzipFile(os.path.join(directory, name), 'wb', compresslevel=6, mtime=0) for name in names]
+    counts = [0]*shards
+    try:
+        for rank, row in generate(rows*shards, rng, junk):
+            shard = rng.randrange(shards)
+            files[shard].write((row+'\n').encode('utf8'))
+            counts[shard] += 1
+    finally:
+        for f_out in files:
+            f_out.close()
+    metadata = {'version':GENERATOR_VERSION, 'n':n, 'shards':shards, 'rows':rows, 'seed':seed, 'junk':junk,
+                'files':dict(zip(names, counts))}
+    with open(os.path.join(directory, METADATA_NAME), 'w') as f_out:
+        json.dump(metadata, f_out, indent=1)
+    print('SAVED: ', directory, sum(counts), 'rows in', shards, 'shards')
+    return metadata
+
+def read_metadata(directory):
+    #Parameters of the corpus written in directory, None if there is none
+    path = os.path.join(directory, METADATA_NAME)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as f:
+        return json.load(f)
+
+def ensure_corpus(directory, n=1, shards=4, rows=100000, seed=0, junk=JUNK):
+    #Writes the corpus unless directory already holds one generated with the same parameters
+    metadata = read_metadata(directory)
+    if (metadata is not None and all(os.path.exists(os.path.join(directory, name)) for name in metadata['files'])
+            and (metadata['version'], metadata['n'], metadata['shards'], metadata['rows'], metadata['seed'], metadata['junk'])
+            == (GENERATOR_VERSION, n, shards, rows, seed, junk)):
+        return metadata
+    return write_corpus(directory, n, shards, rows, seed, junk)
+
+if __name__ == '__main__':
+
+    import argparse
+    parser = argparse.ArgumentParser(description='Writes seeded synthetic Google Ngrams shards in the 2020 export format')
+
+    parser.add_argument('path', type=str, help="directory the shards are written to")
+    parser.add_argument('-n', type=int, choices=(1, 5), required=False, default=1, help="Write 1-grams or 5-grams. Default is 1")
+    parser.add_argument('--shards', type=int, required=False, default=4, help="Number of shards. Default is 4")
+    parser.add_argument('--rows', type=int, required=False, default=100000, help="Rows per shard. Default is 100000")
+    parser.add_argument('--seed', type=int, required=False, default=0, help="Random seed, the same seed writes the same shards. Default is 0")
+    parser.add_argument('--junk', type=float, required=False, default=JUNK, help="Share of the tokens that are not lexemes. Default is "+str(JUNK))
+
+    args = parser.parse_args()
+    write_corpus(args.path, args.n, args.shards, args.rows, args.seed, args.junk)
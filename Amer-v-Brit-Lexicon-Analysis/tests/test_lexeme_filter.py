@@ -0,0 +1,64 @@
+#Checks that the compiled lexeme filter gives the same result as the original unigram_tests (reference_unigram_tests)
+#Run with `python -m pytest tests` from Amer-v-Brit-Lexicon-Analysis
+
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+
+import pytest
+
+from lexeme_filter import (unigram_tests, reference_unigram_tests, rejection_rule, lexeme_rows, random_tokens, random_block,
+                           REJECTION_RULES)
+
+#One or more tokens for every rule, in both outcomes
+TOKENS = ['colour_NOUN', 'color_VERB', 'the_DET', 'she_PRON', 'co-op_NOUN', 'rhythm_NOUN', 'Y_X', 'a_',
+          '_NOUN', 'colour_', '_', '', 'colour', 'colour_NOUN_X', 'colour__NOUN',
+          'colour1_NOUN', 'colo.ur_NOUN', "don't_VERB", '“colour”_NOUN', 'c@lour_NOUN',
+          'brrr_NOUN', 'hmm_X', 'bcd_',
+          '-colour_NOUN', 'colour_NOUN-', '—colour_NOUN', 'co—op_NOUN', 'co-op_NOUN-',
+          'naïve_ADJ', 'día_NOUN', 'Über_ADJ', 'kožušček_NOUN', '漢字_NOUN', 'ЖΩ_NOUN',
+          'colour _NOUN', ' colour_NOUN', 'colour_NOUN ', 'co\tlour_NOUN', 'colour　_NOUN']
+
+@pytest.mark.parametrize('token', TOKENS)
+def test_unigram_tests_matches_reference(token):
+    assert unigram_tests(token) == reference_unigram_tests(token)
+
+@pytest.mark.parametrize('token', TOKENS)
+def test_rejection_rule_matches_reference(token):
+    rule = rejection_rule(token)
+    assert (rule is None) == reference_unigram_tests(token)
+    assert rule is None or rule in REJECTION_RULES
+
+def test_random_tokens_match_reference():
+    tokens = random_tokens(20000, seed=1)
+    expected = [reference_unigram_tests(token) for token in tokens]
+    assert 0 < sum(expected) < len(tokens)
+    assert [unigram_tests(token) for token in tokens] == expected
+    assert [rejection_rule(token) is None for token in tokens] == expected
+
+def decoded_rows(block):
+    #What lexeme_rows() replaces: every row decoded, stripped and split before its unigram is tested
+    return [line.decode('utf8').strip().partition('\t') for line in block.split(b'\n')]
+
+def test_lexeme_rows_match_decoded_rows():
+    block = random_block(20000, seed=2)
+    expected = [(unigram, entries) for unigram, _, entries in decoded_rows(block) if unigram_tests(unigram)]
+    assert len(expected) > 0
+    assert list(lexeme_rows(block)) == expected
+
+@pytest.mark.parametrize('token', TOKENS)
+def test_lexeme_rows_match_unigram_tests(token):
+    block = '\n'.join([token+'\t1850,3,2', ' '+token+'\t1850,3,2 ', token]).encode('utf8')
+    expected = [(unigram, entries) for unigram, _, entries in decoded_rows(block) if unigram_tests(unigram)]
+    assert list(lexeme_rows(block)) == expected
+
+def test_lexeme_rows_count_rejections_by_rule():
+    block = random_block(20000, seed=3)
+    expected = dict()
+    for unigram, _, entries in decoded_rows(block):
+        rule = rejection_rule(unigram)
+        if rule is not None:
+            expected[rule] = expected.get(rule, 0)+1
+    rejections = dict()
+    assert list(lexeme_rows(block, rejections)) == list(lexeme_rows(block))
+    assert rejections == expected
@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# # Shared vocabulary of lexemes
+#
+# Every stage keys its data by the tagged lexeme string (`colour_NOUN`) and holds its own copy of it:
+# the preprocessed dictionaries, the stores, the lexicons, the divergence sets, once per corpus.
+# A vocabulary gives every lexeme (lemma and POS tag) a stable integer ID shared by all the corpora. So far the stores can
+# save the ID of each ngram and divergence.py compares the corpora as arrays indexed by ID; the preprocessed dictionaries
+# and the lexicons are still keyed by the lexeme string.
+# Lookups are binary searches of the sorted blob, only the lexemes added since the vocabulary was saved are held in a dictionary.
+#
+# A vocabulary is a directory of numpy arrays:
+# - `vocab_blob.npy`, `vocab_offsets.npy`: every lexeme once, sorted by utf8 bytes and concatenated
+# - `ids.npy`: the ID of each sorted lexeme. IDs are given in the order lexemes are first added and never change,
+#   new lexemes get new IDs when the vocabulary is saved again
+# - `pos.npy`: the POS tag of each ID, as an index into the tags of `meta.json`
+# - `meta.json`: number of lexemes and the POS tags
+#
+# Usage:
+# `python vocabulary.py C:\path\to\vocabulary\ C:\path\to\amer_unigram_data\ C:\path\to\brit_unigram_data\`
+# adds the lexemes of every store and LEXICON file of the directories to the vocabulary
+
+import os
+import json
+import numpy as np
+
+VOCABULARY_FORMAT = 1
+
+def split_lexeme(lexeme):
+    #'colour_NOUN' -> ('colour', 'NOUN'), lexemes without a tag have an empty one
+    lemma, _, tag = lexeme.rpartition('_')
+    if not lemma:
+        return tag, ''
+    return lemma, tag
+
+class Vocabulary:
+    def __init__(self, path=None, mmap_mode='r'):
+        self.path = path
+        self.mmap_mode = mmap_mode
+        self._load()
+
+    def _load(self):
+        self.tags = []
+        self.vocab_blob = np.zeros(0, dtype=np.uint8)
+        self.vocab_offsets = np.zeros(1, dtype=np.int64)
+        self.sorted_ids = np.zeros(0, dtype=np.int64)
+        self.pos_codes = np.zeros(0, dtype=np.int16)
+        if self.path is not None and os.path.exists(os.path.join(self.path, 'meta.json')):
+            with open(os.path.join(self.path, 'meta.json'), 'r') as f:
+                meta = json.load(f)
+            if meta['format'] != VOCABULARY_FORMAT:
+                raise ValueError('Unsupported vocabulary format '+str(meta['format'])+' in '+self.path)
+            self.tags = meta['tags']
+            #Plain array views of the memory-mapped files, slicing a np.memmap is several times slower and every lookup slices the blob
+            load = lambda name: np.asarray(np.load(os.path.join(self.path, name+'.npy'), mmap_mode=self.mmap_mode))
+            self.vocab_blob = load('vocab_blob')
+            self.vocab_offsets = load('vocab_offsets')
+            self.sorted_ids = load('ids')
+            self.pos_codes = load('pos')
+        #Position of every saved ID in the sorted blob
+        self.positions = np.empty(len(self.sorted_ids), dtype=np.int64)
+        self.positions[self.sorted_ids] = np.arange(len(self.sorted_ids))
+        self.saved = len(self.sorted_ids)
+        #Lexemes added since the vocabulary was loaded, their IDs follow the saved ones
+        self.new_lexemes = []
+        self.new_pos = []
+        self.new_ids = dict()
+
+    def __len__(self):
+        return self.saved+len(self.new_lexemes)
+
+    def _word_bytes(self, i):
+        return self.vocab_blob[self.vocab_offsets[i]:self.vocab_offsets[i+1]].tobytes()
+
+    def lexeme(self, lexeme_id):
+        if lexeme_id >= self.saved:
+            return self.new_lexemes[lexeme_id-self.saved]
+        return self._word_bytes(self.positions[lexeme_id]).decode('utf8')
+
+    def lexemes(self, ids):
+        return [self.lexeme(lexeme_id) for lexeme_id in np.asarray(ids).tolist()]
+
+    def _search(self, key, lo=0):
+        #Position of the first saved lexeme >= key (utf8 bytes), from lo: galloping first, so bulk lookups in sorted order
+        #only read a few words each, then a binary search of the sorted blob
+        hi, step = lo, 1
+        while hi < self.saved and self._word_bytes(hi) < key:
+            lo = hi+1
+            hi += step
+            step *= 2
+        hi = min(hi, self.saved)
+        while lo < hi:
+            mid = (lo+hi)//2
+            if self._word_bytes(mid) < key:
+                lo = mid+1
+            else:
+                hi = mid
+        return lo
+
+    def id(self, lexeme):
+        #ID of one lexeme (binary search of the saved lexemes), -1 if it is not in the vocabulary
+        key = lexeme.encode('utf8')
+        position = self._search(key)
+        if position < self.saved and self._word_bytes(position) == key:
+            return int(self.sorted_ids[position])
+        return self.new_ids.get(lexeme, -1)
+
+    def __contains__(self, lexeme):
+        return self.id(lexeme) >= 0
+
+    def _saved_words(self):
+        #utf8 bytes of the saved lexemes, in sorted order
+        blob = self.vocab_blob.tobytes()
+        vocab_offsets = self.vocab_offsets.tolist()
+        return [blob[vocab_offsets[i]:vocab_offsets[i+1]] for i in range(self.saved)]
+
+    def _tag_code(self, tag):
+        if tag not in self.tags:
+            self.tags.append(tag)
+        return self.tags.index(tag)
+
+    def ids(self, lexemes, add=True):
+        #IDs of the lexemes as an int64 array, new lexemes are added to the vocabulary (or get -1 with add=False)
+        #The saved lexemes are searched in sorted order, each search starting where the previous one ended
+        keys = [lexeme.encode('utf8') for lexeme in lexemes]
+        ids = np.full(len(keys), -1, dtype=np.int64)
+        position = 0
+        for i in sorted(range(len(keys)), key=keys.__getitem__):
+            position = self._search(keys[i], position)
+            if position < self.saved and self._word_bytes(position) == keys[i]:
+                ids[i] = self.sorted_ids[position]
+        #Only the lexemes added since the vocabulary was saved are kept in a dictionary, new IDs are given in the order of lexemes
+        for i in np.flatnonzero(ids < 0).tolist():
+            lexeme = lexemes[i]
+            lexeme_id = self.new_ids.get(lexeme, -1)
+            if lexeme_id < 0 and add:
+                lexeme_id = len(self)
+                self.new_ids[lexeme] = lexeme_id
+                self.new_lexemes.append(lexeme)
+                self.new_pos.append(self._tag_code(split_lexeme(lexeme)[1]))
+            ids[i] = lexeme_id
+        return ids
+
+    def intern(self, lexeme):
+        return int(self.ids([lexeme])[0])
+
+    def pos(self, ids):
+        #POS tag codes of the IDs (indices into self.tags)
+        codes = np.concatenate([np.asarray(self.pos_codes), np.array(self.new_pos, dtype=np.int16)])
+        return codes[np.asarray(ids)]
+
+    def split(self, lexeme_id):
+        #(lemma, POS) of an ID
+        return split_lexeme(self.lexeme(lexeme_id))
+
+    def save(self, path=None):
+        #Writes the vocabulary with the lexemes added since it was loaded, the IDs of the saved ones do not change
+        path = path or self.path
+        if path is None:
+            raise ValueError('The vocabulary was opened without a path, pass the directory to save it to')
+        words = self._saved_words()+[lexeme.encode('utf8') for lexeme in self.new_lexemes]
+        ids = np.concatenate([np.asarray(self.sorted_ids), np.arange(self.saved, len(self), dtype=np.int64)])
+        order = sorted(range(len(words)), key=words.__getitem__)
+        vocab_offsets = np.zeros(len(words)+1, dtype=np.int64)
+        np.cumsum([len(words[i]) for i in order], out=vocab_offsets[1:])
+        pos_codes = np.concatenate([np.asarray(self.pos_codes), np.array(self.new_pos, dtype=np.int16)])
+        #Everything is copied above, the memory-mapped files can be closed before they are overwritten
+        self.vocab_blob = self.vocab_offsets = self.sorted_ids = self.pos_codes = None
+
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, 'vocab_blob.npy'), np.frombuffer(b''.join(words[i] for i in order), dtype=np.uint8))
+        np.save(os.path.join(path, 'vocab_offsets.npy'), vocab_offsets)
+        np.save(os.path.join(path, 'ids.npy'), ids[order])
+        np.save(os.path.join(path, 'pos.npy'), pos_codes)
+        #meta.json is written last, a vocabulary without it is incomplete
+        with open(os.path.join(path, 'meta.json'), 'w') as f_out:
+            json.dump({'format':VOCABULARY_FORMAT,
+                       'lexemes':len(words),
+                       'tags':self.tags}, f_out)
+        print('SAVED: ', path, len(words))
+        self.path = path
+        self._load()
+        return path
+
+def open_vocabulary(path, mmap_mode='r'):
+    #Opens the vocabulary saved in path, or an empty one that will be saved there
+    return Vocabulary(path, mmap_mode)
+
+def add_directory(vocabulary, directory):
+    #Adds the lexemes of every store and LEXICON file of a corpus directory, returns how many were new
+    from ngram_store import open_corpus
+    from lexicon_io import iter_lexicon
+    before = len(vocabulary)
+    for store in open_corpus(directory).values():
+        vocabulary.ids([store.word(i) for i in store.source_order().tolist()])
+    for file_name in sorted(os.listdir(directory)):
+        if file_name.startswith('LEXICON_') and file_name.endswith('.json'):
+            vocabulary.ids([lexeme for lexeme, record in iter_lexicon(directory, file_name)])
+    return len(vocabulary)-before
+
+if __name__ == '__main__':
+
+    import argparse
+    parser = argparse.ArgumentParser(description='Adds the lexemes of the stores and LEXICON files of corpus directories to a shared vocabulary')
+
+    parser.add_argument('vocabulary', type=str, help="directory of the vocabulary, created if it does not exist")
+    parser.add_argument('paths', type=str, nargs='+', help="absolute paths to the corpus directories")
+
+    args = parser.parse_args()
+    vocabulary = open_vocabulary(args.vocabulary)
+    for directory in args.paths:
+        if directory[-1] != '\\' and directory[-1] != '/':
+            directory += '/'
+        print('Added', add_directory(vocabulary, directory), 'lexemes from', directory)
+    vocabulary.save()
@@ -0,0 +1,390 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# # External-memory 5-gram clustering
+#
+# `preprocess_5grams()` in `5_gram_cluster_analysis_practice.ipynb` reads a whole shard with `readlines()` and grows one
+# `{cluster: {total_uses, bundles, words}}` dictionary, pruned with `clear_dict()` only at the end, so it cannot go past one shard.
+#
+# Here the clusters are built in two passes with a bounded amount of memory:
+# 1. map: the rows are streamed from the `.gz` file and the 5-grams that pass `pentagram_tests()` are aggregated into partial cluster records.
+#    Whenever the partial records hold `max_records` (cluster, word) pairs, they are spilled to disk, grouped by hash partition of the
+#    `w1 w2 _ w4 w5` cluster key, and the buffer starts again empty. All the spills of a shard go to one `.spill` file, one pickled chunk
+#    per partition and spill, and its `.spill-index.npy` (written last) holds the partition, offset and length of every chunk
+# 2. reduce: every partition holds all the partial records of its clusters, so each one is merged and filtered (`bundles >= 2`) on its own,
+#    reading only its chunks (seeking to their offsets), and only one partition is in memory at a time
+#
+# The kept clusters of all the partitions are then merged back in the order of the first row of each cluster and written as `_CLUSTERED.json`,
+# with the same records in the same order as the notebook's.
+# The one difference: when the same middle word comes back in another 5-gram of the cluster (e.g. `The` and `the` before lowercasing),
+# its usages are added up in `words` instead of being overwritten by the last one, so `words` always sums to `total_uses`.
+#
+# Usage:
+# `python cluster_5grams.py C:\path\to\5grams\` clusters every `.gz` shard of the directory into its own `_CLUSTERED.json`
+# `python cluster_5grams.py C:\path\to\5grams\ -p 256 -r 500000` uses more, smaller partitions and spills every 500,000 records
+#
+# A cluster can have 5-grams in many of the 19,423 shards, so the per-shard files undercount its bundles. With `--corpus`, the clusters are built over all the shards at once:
+# the map stage runs on every core, each shard spilling its partial records to its own `.spill` file and index under `cluster-spill/`
+# (two files per shard, whatever the number of partitions), then the partitions are reduced in parallel (partition by partition,
+# the chunks of the partition in every shard's spill in shard order) and the clusters of the whole corpus are saved in one `CORPUS_CLUSTERED.json`.
+# Mapped shards are recorded in `cluster-manifest.json` (see shard_manifest.py), so an interrupted run only maps the missing shards again.
+# `python cluster_5grams.py C:\path\to\5grams\ --corpus -j 32 -p 1024`
+#
+# Sizing `-p`: a reducer holds the merged records of one partition, which take several times (up to about 8x) the bytes of its spilled chunks,
+# and `-j` reducers run at once. After the map stage the spilled bytes of the largest partition are printed, so `-p` should be large enough
+# that `-j` x 8 x that fits in memory. Raising `-p` only adds chunks to the spill files, not files.
+
+import os
+import re
+import sys
+import gzip
+import json
+import heapq
+import pickle
+import shutil
+import string
+import zlib
+from functools import partial
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from tqdm import tqdm
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','Amer-v-Brit-Lexicon-Analysis'))
+#Sums the match counts of a row in one call
+from ngram_parser import parse_entries
+from shard_manifest import ShardManifest
+from parallel_preprocess import run_shards
+
+#Number of hash partitions of the cluster keys
+PARTITIONS = 64
+#(cluster, word) pairs held in memory before the partial records are spilled
+MAX_RECORDS = 1000000
+#Set the minimum number of bundles here
+MIN_BUNDLES = 2
+#Kept clusters per pickled chunk of a reduced partition
+CHUNK_SIZE = 10000
+
+#Bump when the spills change, the shards mapped by an older version are mapped again
+CLUSTER_VERSION = 2
+MANIFEST_NAME = 'cluster-manifest.json'
+#Subdirectory of the corpus directory with the spill file and index of every mapped shard
+SPILL_DIRECTORY = 'cluster-spill/'
+#Times the spilled bytes of a partition that its reducer holds in memory, roughly
+REDUCE_MEMORY_FACTOR = 8
+
+PUNCTUATION = set(char for char in string.punctuation).union({'“','”'})
+DIGITS = set(string.digits)
+VOWELS = set("aeiouyAEIOUY")
+#Excluding '_' (underscore) from DASHES precludes the tagged 1grams "_NOUN", add it to also include the tagged 1grams
+DASHES = {'—','–','—','―','‒','-'}
+PUNCTUATION.difference_update(DASHES)
+STOPS = PUNCTUATION.union(DIGITS)
+
+#The notebook's tests on one gram as a single regular expression: unidecode only leaves a gram unchanged when it is ASCII,
+#so a gram is made of ASCII characters which are not STOPS, has a vowel and does not start or end with a dash
+#('_' is one of the STOPS, which already rules out the _PRON_ grams)
+_CHARS = ''.join(chr(c) for c in range(128) if not chr(c).isspace() and chr(c) not in STOPS)
+_EDGE_CHARS = ''.join(char for char in _CHARS if char not in DASHES)
+_gram = re.compile('(?=.*[{vowels}])[{edge}](?:[{chars}]*[{edge}])?'.format(vowels=re.escape(''.join(sorted(VOWELS))),
+                                                                         edge=re.escape(_EDGE_CHARS),
+                                                                         chars=re.escape(_CHARS)), re.DOTALL)
+
+def pentagram_tests(pentagram_l):
+    #Same result as the notebook's pentagram_tests() on the lowered and split 5-gram
+    match = _gram.fullmatch
+    for gram in pentagram_l:
+        if match(gram) is None:
+            return False
+    return True
+
+def open_rows(directory, file_path):
+    #Streams the rows of a gzip file instead of reading them all with readlines()
+    with gzip.open(directory+file_path, 'r') as f_in:
+        for x in f_in:
+            yield x.decode('utf8').strip()
+
+def pentagram_cluster(row):
+    #(cluster, word, total_count) of a row whose 5-gram passes the tests, cluster being 'w1 w2 _ w4 w5', None for the other rows
+    pentagram, _, entries = row.partition('\t')
+    pentagram_l = pentagram.lower().split()
+    if len(pentagram_l) != 5 or not pentagram_tests(pentagram_l):
+        return None
+    total_count = int(parse_entries(entries)[1].sum())
+    return pentagram_l[0]+' '+pentagram_l[1]+' _ '+pentagram_l[3]+' '+pentagram_l[4], pentagram_l[2], total_count
+
+def partition_of(cluster, partitions=PARTITIONS):
+    #Stable across processes and runs, unlike hash()
+    return zlib.crc32(cluster.encode('utf8')) % partitions
+
+def index_path(spill_path):
+    #The index of a spill file, written once the shard is mapped
+    return spill_path+'-index.npy'
+
+def reduced_path(spill_directory, partition):
+    return os.path.join(spill_directory, 'part-%05d.reduced' % partition)
+
+class ClusterSpill:
+    '''
+    Partial cluster records of a stream of 5-grams, spilled to one file.
+    Each spill appends one pickled list of (cluster, first row, bundles, total_uses, {word: usage}) records per partition of the cluster keys,
+    and the index keeps (partition, offset, length) of every list, so the lists of a partition are in row order in the index.
+    '''
+    def __init__(self, spill_path, partitions=PARTITIONS, max_records=MAX_RECORDS):
+        self.spill_path = spill_path
+        self.partitions = partitions
+        self.max_records = max_records
+        #{cluster: [first row, bundles, total_uses, {word: usage}]}
+        self.clusters = dict()
+        self.records = 0
+        self.spills = 0
+        #(partition, offset, length) of every pickled list in the spill file
+        self.index = []
+        os.makedirs(os.path.dirname(spill_path) or '.', exist_ok=True)
+        for path in (spill_path, index_path(spill_path)):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def add(self, cluster, word, total_count, row):
+        record = self.clusters.get(cluster)
+        if record is None:
+            self.clusters[cluster] = [row, 1, total_count, {word:total_count}]
+            self.records += 1
+        else:
+            record[1] += 1
+            record[2] += total_count
+            words = record[3]
+            if word in words:
+                words[word] += total_count
+            else:
+                words[word] = total_count
+                self.records += 1
+        if self.records >= self.max_records:
+            self.spill()
+
+    def spill(self):
+        if not self.clusters:
+            return
+        parts = [[] for partition in range(self.partitions)]
+        for cluster, record in self.clusters.items():
+            parts[partition_of(cluster, self.partitions)].append((cluster,)+tuple(record))
+        with open(self.spill_path, 'ab') as f_out:
+            for partition, records in enumerate(parts):
+                if records:
+                    offset = f_out.tell()
+                    f_out.write(pickle.dumps(records, protocol=pickle.HIGHEST_PROTOCOL))
+                    self.index.append((partition, offset, f_out.tell()-offset))
+        self.clusters = dict()
+        self.records = 0
+        self.spills += 1
+
+    def close(self):
+        #Spills what is left and writes the index, returns its path
+        self.spill()
+        tmp_path = index_path(self.spill_path)+'.tmp'
+        with open(tmp_path, 'wb') as f_out:
+            np.save(f_out, np.array(self.index, dtype=np.int64).reshape(-1, 3))
+        os.replace(tmp_path, index_path(self.spill_path))
+        return index_path(self.spill_path)
+
+def map_shard(directory, file_path, spill_path, partitions=PARTITIONS, max_records=MAX_RECORDS):
+    '''
+    Streams one shard into partial cluster records spilled to spill_path (replaced if it exists) and its index.
+    Returns {'output', 'rows', 'ngrams', 'spills'}: the index of the spill, the rows read, the 5-grams kept and the number of spills.
+    '''
+    spill = ClusterSpill(spill_path, partitions, max_records)
+    rows = 0
+    ngrams = 0
+    for row in tqdm(open_rows(directory, file_path), unit='row', desc=file_path):
+        rows += 1
+        parsed = pentagram_cluster(row)
+        if parsed is not None:
+            #The index of the 5-gram orders the clusters like the notebook's dictionary
+            spill.add(*parsed, ngrams)
+            ngrams += 1
+    return {'output':spill.close(), 'rows':rows, 'ngrams':ngrams, 'spills':spill.spills}
+
+def partition_sources(spill_paths, partitions):
+    '''
+    Reads the index of every spill file (spill_paths in shard order) once and splits it by partition.
+    Returns the sources of every partition, a list of (shard, spill path, offsets, lengths) in shard order,
+    and the spilled bytes of every partition.
+    '''
+    sources = [[] for partition in range(partitions)]
+    spilled = np.zeros(partitions, dtype=np.int64)
+    for shard, spill_path in enumerate(spill_paths):
+        index = np.load(index_path(spill_path))
+        if not len(index):
+            continue
+        order = np.argsort(index[:,0], kind='stable')
+        index = index[order]
+        bounds = np.searchsorted(index[:,0], np.arange(partitions+1))
+        for partition in np.flatnonzero(np.diff(bounds)).tolist():
+            chunks = index[bounds[partition]:bounds[partition+1]]
+            sources[partition].append((shard, spill_path, chunks[:,1].tolist(), chunks[:,2].tolist()))
+        spilled += np.bincount(index[:,0], weights=index[:,2], minlength=partitions).astype(np.int64)
+    return sources, spilled
+
+def _load_sources(sources):
+    #(shard, list of records) of every chunk of a partition, in shard order then spill order
+    for shard, spill_path, offsets, lengths in sources:
+        with open(spill_path, 'rb') as f:
+            for offset, length in zip(offsets, lengths):
+                f.seek(offset)
+                yield shard, pickle.loads(f.read(length))
+
+def _load_chunks(path):
+    #Every pickled list of a reduced file, in the order they were written
+    if not os.path.exists(path):
+        return
+    with open(path, 'rb') as f:
+        while True:
+            try:
+                yield pickle.load(f)
+            except EOFError:
+                return
+
+def reduce_partition(sources, output_path, min_bundles=MIN_BUNDLES):
+    '''
+    Merges the partial records of one partition, sources being its chunks in the spill files (see partition_sources()), and keeps the clusters with at least
+    min_bundles bundles. They are written to output_path as pickled chunks of (first, cluster, record) sorted by first,
+    where first is (shard, row) of the first 5-gram of the cluster and record is {total_uses, bundles, words}.
+    Returns the number of kept clusters.
+    '''
+    clusters = dict()
+    for shard, records in _load_sources(sources):
+        for cluster, row, bundles, total_uses, words in records:
+            record = clusters.get(cluster)
+            if record is None:
+                clusters[cluster] = [(shard, row), bundles, total_uses, words]
+                continue
+            record[1] += bundles
+            record[2] += total_uses
+            merged = record[3]
+            for word, usage in words.items():
+                merged[word] = merged.get(word, 0)+usage
+
+    #Filter out the insignificant ones
+    kept = sorted((first, cluster, {'total_uses':total_uses, 'bundles':bundles, 'words':words})
+                  for cluster, (first, bundles, total_uses, words) in clusters.items() if bundles >= min_bundles)
+    clusters = None
+    with open(output_path, 'wb') as f_out:
+        for start in range(0, len(kept), CHUNK_SIZE):
+            pickle.dump(kept[start:start+CHUNK_SIZE], f_out, protocol=pickle.HIGHEST_PROTOCOL)
+    return len(kept)
+
+def _iter_reduced(path):
+    for chunk in _load_chunks(path):
+        yield from chunk
+
+def save_clusters(reduced_paths, directory, output):
+    '''
+    Merges the reduced partitions back in the order of the first row of each cluster and writes directory+output,
+    the same file json.dump would write for the notebook's dictionary. Returns the number of clusters saved.
+    '''
+    tmp_path = directory+output+'.part'
+    n_clusters = 0
+    with open(tmp_path, 'w') as f_out:
+        f_out.write('{')
+        for first, cluster, record in heapq.merge(*[_iter_reduced(path) for path in reduced_paths]):
+            if n_clusters:
+                f_out.write(', ')
+            f_out.write(json.dumps(cluster)+': '+json.dumps(record))
+            n_clusters += 1
+        f_out.write('}')
+    if n_clusters > 0:
+        os.replace(tmp_path, directory+output)
+        print('SAVED: ',output,n_clusters)
+    else:
+        os.remove(tmp_path)
+        print('unigram dict empty',output)
+    return n_clusters
+
+def cluster_shard(directory, file_path, partitions=PARTITIONS, max_records=MAX_RECORDS, min_bundles=MIN_BUNDLES, spill_directory=None):
+    #Same output as the notebook's preprocess_5grams(directory, file_path), in bounded memory
+    if spill_directory is None:
+        spill_directory = directory+file_path[:-3]+'-spill'
+    spill_path = os.path.join(spill_directory, file_path[:-3]+'.spill')
+    map_shard(directory, file_path, spill_path, partitions, max_records)
+    sources, spilled = partition_sources([spill_path], partitions)
+    reduced_paths = []
+    for partition in range(partitions):
+        reduced_paths.append(reduced_path(spill_directory, partition))
+        reduce_partition(sources[partition], reduced_paths[-1], min_bundles)
+    n_clusters = save_clusters(reduced_paths, directory, file_path[:-3]+'_CLUSTERED.json')
+    shutil.rmtree(spill_directory)
+    return n_clusters
+
+def corpus_spill_path(directory, file_path):
+    return directory+SPILL_DIRECTORY+file_path[:-3]+'.spill'
+
+def map_corpus_shard(directory, file_path, partitions=PARTITIONS, max_records=MAX_RECORDS):
+    #Map stage of one shard of the corpus, the index of its spill is recorded in the manifest relative to the corpus directory
+    result = map_shard(directory, file_path, corpus_spill_path(directory, file_path), partitions, max_records)
+    result['output'] = os.path.relpath(result['output'], directory).replace(os.sep, '/')
+    return result
+
+def cluster_corpus(directory, file_paths, output='CORPUS_CLUSTERED.json', partitions=PARTITIONS, max_records=MAX_RECORDS, min_bundles=MIN_BUNDLES,
+                   workers=None, max_in_memory=None, manifest=None, keep_spills=False):
+    '''
+    Clusters the 5-grams of all the shards in file_paths together and saves them as directory+output.
+    The shards are mapped on workers processes (skipping the ones the manifest records as done), then the partitions are reduced on workers processes.
+    The spills are removed at the end unless keep_spills, keeping them lets a later run only map the shards added since.
+    Returns the number of clusters saved, or None if some shards failed.
+    '''
+    workers = workers or os.cpu_count()
+    worker = partial(map_corpus_shard, partitions=partitions, max_records=max_records)
+    completed, failed = run_shards(directory, file_paths, worker=worker, workers=workers, max_in_memory=max_in_memory, manifest=manifest)
+    if failed:
+        return None
+
+    #A partition of the whole corpus is the same partition of every shard, merged in the order of the shards
+    sources, spilled = partition_sources([corpus_spill_path(directory, file_path) for file_path in sorted(file_paths)], partitions)
+    print('Spilled {:,.1f} MB, the largest partition has {:,.1f} MB (a reducer holds about {} times that, {} at once)'.format(
+        spilled.sum()/1024**2, spilled.max()/1024**2 if partitions else 0, REDUCE_MEMORY_FACTOR, workers))
+    reduced_paths = [reduced_path(directory+SPILL_DIRECTORY, partition) for partition in range(partitions)]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        kept = list(tqdm(executor.map(reduce_partition, sources, reduced_paths, repeat(min_bundles)), total=partitions, unit='partition'))
+    print('Reduced', partitions, 'partitions,', sum(kept), 'clusters kept')
+
+    n_clusters = save_clusters(reduced_paths, directory, output)
+    for path in reduced_paths:
+        os.remove(path)
+    if not keep_spills:
+        shutil.rmtree(directory+SPILL_DIRECTORY)
+    return n_clusters
+
+if __name__ == '__main__':
+
+    import argparse
+    parser = argparse.ArgumentParser(description='Clusters the 5-grams of every Google Ngrams shard in a directory with bounded memory')
+
+    parser.add_argument('path', type=str, help="absolute path to the directory with the raw 5-gram *.gz files")
+    parser.add_argument('-p', '--partitions', type=int, required=False, default=PARTITIONS, help="Number of hash partitions of the clusters. Default is "+str(PARTITIONS)+". Raise it if one partition does not fit in memory: a reducer takes about "+str(REDUCE_MEMORY_FACTOR)+" times the spilled bytes of its partition (printed after the map stage with --corpus), and -j of them run at once.")
+    parser.add_argument('-r', '--max-records', type=int, required=False, default=MAX_RECORDS, help="(cluster, word) records held in memory before spilling them to disk. Default is "+str(MAX_RECORDS))
+    parser.add_argument('--min-bundles', type=int, required=False, default=MIN_BUNDLES, help="Minimum number of bundles of a kept cluster. Default is "+str(MIN_BUNDLES))
+    parser.add_argument('--corpus', action='store_true', help="Cluster all the shards of the directory together instead of one file per shard")
+    parser.add_argument('-o', '--output', type=str, required=False, default='CORPUS_CLUSTERED', help="Name of the corpus JSON (without .json) with --corpus. Default is CORPUS_CLUSTERED")
+    parser.add_argument('-j', '--workers', type=int, required=False, default=os.cpu_count(), help="Number of worker processes with --corpus. Default is the number of cores.")
+    parser.add_argument('-m', '--max-in-memory', type=int, required=False, default=None, help="Maximum number of shards being mapped at once with --corpus. Default is the number of workers.")
+    parser.add_argument('--keep-spills', action='store_true', help="Keep the spills of the mapped shards after a --corpus run, so that the next run only maps new shards")
+    parser.add_argument('--force', action='store_true', help="Map again the shards the manifest records as done")
+
+    args = parser.parse_args()
+    directory = args.path
+    if directory[-1] != '\\' and directory[-1] != '/':
+        directory += '/'
+
+    files = sorted(file_path for file_path in os.listdir(directory) if file_path.endswith('.gz'))
+    if args.corpus:
+        #The spills of a shard are only reused with the same partitions
+        manifest = ShardManifest(directory, MANIFEST_NAME, {'version':CLUSTER_VERSION, 'partitions':args.partitions})
+        if args.force:
+            manifest.shards = dict()
+        n_clusters = cluster_corpus(directory, files, args.output+'.json', args.partitions, args.max_records, args.min_bundles,
+                                    args.workers, args.max_in_memory, manifest, args.keep_spills)
+        if n_clusters is None:
+            raise SystemExit(1)
+    else:
+        for file_path in files:
+            cluster_shard(directory, file_path, args.partitions, args.max_records, args.min_bundles)
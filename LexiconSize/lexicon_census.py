@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# # Lexeme census
+#
+# `Misc/total_counts-C/langsz.cpp` counts the words of each POS tag used in more than one volume in a single year, so it re-reads every database file
+# for every year of the census (220 passes over the corpus for 1800-2019).
+# Here every year is counted in the same pass: each shard is streamed once, in blocks, and every year,match_count,volume_count entry
+# that passes the volume filter (volume_count > 1) is added to a years x tags matrix, so the census of all years costs one read of the corpus.
+# - tags are the Google POS tags after the first underscore of the 1-gram, as in langsz.cpp (untagged 1-grams are not counted),
+#   with `_X` as the last column so that the totals can be taken with and without it
+# - `lexemes[year, tag]` is the number of distinct tagged 1-grams used that year (every 1-gram is in one row, with at most one entry per year)
+# - `match_counts[year, tag]` is the sum of their match counts
+# - with `--lexemes`, only the 1-grams that pass the word tests (`lexeme_filter.py`) are counted
+#
+# Every 1-gram is in exactly one shard, so the censuses of the shards are added up. The shards are counted in parallel and the result is
+# saved as arrays (`census.npz`), which `Census.load()` reads back. Years outside [first_year, last_year] are left out.
+#
+# Usage:
+# `python lexicon_census.py C:\path\to\raw_unigram_data\ -j 32` saves census.npz in the directory
+# `python lexicon_census.py C:\path\to\raw_unigram_data\ --year 1850 --year 1900` also prints the counts of 1850 and 1900 like langsz.cpp
+
+import os
+import re
+import sys
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from tqdm import tqdm
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','Amer-v-Brit-Lexicon-Analysis'))
+from lexeme_filter import lexeme_rows
+from ngram_parser import parse_entries_list
+from shard_pipeline import read_blocks
+
+#Same order as the counts of langsz.cpp, _X last
+TAGS = ('NOUN', 'VERB', 'ADJ', 'ADV', 'PRON', 'DET', 'ADP', 'NUM', 'CONJ', 'PRT', 'X')
+TAG_IDS = {tag:i for i, tag in enumerate(TAGS)}
+FIRST_YEAR = 1470
+LAST_YEAR = 2019
+MIN_VOLUMES = 2
+CENSUS_NAME = 'census.npz'
+
+#A row whose 1-gram is a word, one underscore and one of the TAGS: captures the tag and the entries
+TAGGED_ROW = re.compile('^[^_\t\n]*_('+'|'.join(TAGS)+')\t([^\n]*)', re.M)
+
+class Census:
+    def __init__(self, first_year=FIRST_YEAR, last_year=LAST_YEAR, lexemes=None, match_counts=None, tags=TAGS, min_volumes=MIN_VOLUMES):
+        self.years = np.arange(first_year, last_year+1)
+        self.tags = tuple(tags)
+        self.min_volumes = min_volumes
+        shape = (len(self.years), len(self.tags))
+        self.lexemes = np.zeros(shape, dtype=np.int64) if lexemes is None else np.asarray(lexemes, dtype=np.int64)
+        self.match_counts = np.zeros(shape, dtype=np.int64) if match_counts is None else np.asarray(match_counts, dtype=np.int64)
+
+    def add_entries(self, tag_ids, offsets, years, match_counts, volume_counts):
+        #Adds the entries of a block of rows, tag_ids[i] is the column of the row whose entries are years[offsets[i]:offsets[i+1]]
+        entry_tags = np.repeat(np.asarray(tag_ids, dtype=np.int64), np.diff(offsets))
+        first_year = self.years[0]
+        mask = (volume_counts >= self.min_volumes) & (years >= first_year) & (years <= self.years[-1])
+        cells = (years[mask].astype(np.int64)-first_year)*len(self.tags)+entry_tags[mask]
+        size = self.lexemes.size
+        self.lexemes += np.bincount(cells, minlength=size).reshape(self.lexemes.shape)
+        #The float sums of one block are exact (far below 2**53)
+        self.match_counts += np.rint(np.bincount(cells, weights=match_counts[mask], minlength=size)).astype(np.int64).reshape(self.lexemes.shape)
+        return self
+
+    def __add__(self, other):
+        if (self.years[0], self.years[-1], self.tags, self.min_volumes) != (other.years[0], other.years[-1], other.tags, other.min_volumes):
+            raise ValueError('Cannot add censuses of different years, tags or volume filters')
+        return Census(self.years[0], self.years[-1], self.lexemes+other.lexemes, self.match_counts+other.match_counts, self.tags, self.min_volumes)
+
+    def row(self, year):
+        return int(year)-int(self.years[0])
+
+    def column(self, tag):
+        return self.tags.index(tag)
+
+    def _without_x(self, counts, with_x):
+        return counts if with_x or 'X' not in self.tags else np.delete(counts, self.column('X'), axis=1)
+
+    def lexicon_size(self, with_x=False):
+        #Distinct tagged 1-grams of each year, over all the tags (with or without _X)
+        return self._without_x(self.lexemes, with_x).sum(axis=1)
+
+    def total_match_counts(self, with_x=False):
+        return self._without_x(self.match_counts, with_x).sum(axis=1)
+
+    def year(self, year):
+        #{tag:lexemes} of one year
+        return dict(zip(self.tags, self.lexemes[self.row(year)].tolist()))
+
+    def format_year(self, year):
+        #The report of langsz.cpp for one year
+        lines = ["There are {} _{}_'s in the year {}".format(count, tag, year) for tag, count in self.year(year).items() if tag != 'X']
+        lines.append('')
+        lines.append('There are {} words overall in the year {} with volume greater than or equal to {}'.format(self.lexicon_size()[self.row(year)], year, self.min_volumes))
+        lines.append('And there are {} words, when including the _X tag'.format(self.lexicon_size(with_x=True)[self.row(year)]))
+        return '\n'.join(lines)
+
+    def save(self, file_path, **info):
+        #info (e.g. the shards counted) is saved as extra arrays named info_<name>, so they cannot clash with the census arrays
+        np.savez(file_path, years=self.years, tags=np.array(self.tags), lexemes=self.lexemes, match_counts=self.match_counts, min_volumes=self.min_volumes,
+                 **{'info_'+name:np.asarray(value) for name, value in info.items()})
+        print('SAVED: ', file_path)
+        return file_path
+
+    @classmethod
+    def load(cls, file_path):
+        with np.load(file_path) as arrays:
+            years = arrays['years']
+            return cls(int(years[0]), int(years[-1]), arrays['lexemes'], arrays['match_counts'], arrays['tags'].tolist(), int(arrays['min_volumes']))
+
+def tagged_rows(block, lexemes=False):
+    #(tag column, entries) of the tagged rows of a block of raw bytes
+    if lexemes:
+        #Lexemes have exactly one underscore, so the tag is what follows it
+        rows = ((TAG_IDS.get(unigram.partition('_')[2]), entries) for unigram, entries in lexeme_rows(block))
+        return [(tag_id, entries) for tag_id, entries in rows if tag_id is not None]
+    return [(TAG_IDS[tag], entries) for tag, entries in TAGGED_ROW.findall(block.decode('utf8'))]
+
+def census_shard(directory, file_path, first_year=FIRST_YEAR, last_year=LAST_YEAR, lexemes=False, min_volumes=MIN_VOLUMES):
+    #Census of one shard, streamed in blocks
+    census = Census(first_year, last_year, min_volumes=min_volumes)
+    for block in read_blocks(directory, file_path):
+        rows = tagged_rows(block, lexemes)
+        if rows:
+            tag_ids, entries_list = zip(*rows)
+            census.add_entries(tag_ids, *parse_entries_list(entries_list))
+    return census
+
+def census_corpus(directory, file_paths, first_year=FIRST_YEAR, last_year=LAST_YEAR, lexemes=False, min_volumes=MIN_VOLUMES, workers=None):
+    #Census of all the shards in file_paths, counted on workers processes
+    census = Census(first_year, last_year, min_volumes=min_volumes)
+    worker = partial(census_shard, directory, first_year=first_year, last_year=last_year, lexemes=lexemes, min_volumes=min_volumes)
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        for shard_census in tqdm(executor.map(worker, file_paths), total=len(file_paths), unit='shard'):
+            census += shard_census
+    return census
+
+if __name__ == '__main__':
+
+    import argparse
+    parser = argparse.ArgumentParser(description='Counts the lexemes and match counts of every year and POS tag in one pass over the Google Ngrams 1-gram shards')
+
+    parser.add_argument('path', type=str, help="absolute path to the directory with the raw 1-gram *.gz files")
+    parser.add_argument('-j', '--workers', type=int, required=False, default=os.cpu_count(), help="Number of worker processes. Default is the number of cores.")
+    parser.add_argument('--first-year', type=int, required=False, default=FIRST_YEAR, help="First year of the census. Default is "+str(FIRST_YEAR))
+    parser.add_argument('--last-year', type=int, required=False, default=LAST_YEAR, help="Last year of the census. Default is "+str(LAST_YEAR))
+    parser.add_argument('--min-volumes', type=int, required=False, default=MIN_VOLUMES, help="Minimum volume count of a counted entry. Default is "+str(MIN_VOLUMES))
+    parser.add_argument('--lexemes', action='store_true', help="Only count the 1-grams that pass the word tests of the preprocessing")
+    parser.add_argument('-o', '--output', type=str, required=False, default=CENSUS_NAME, help="Name of the saved census. Default is "+CENSUS_NAME)
+    parser.add_argument('--year', type=int, action='append', default=[], help="Print the counts of this year like langsz.cpp, can be repeated")
+
+    args = parser.parse_args()
+    directory = args.path
+    if directory[-1] != '\\' and directory[-1] != '/':
+        directory += '/'
+
+    #Same selection as the preprocessing drivers
+    file_paths = sorted(file_path for file_path in os.listdir(os.path.abspath(directory)) if '.gz' in file_path and not '.json' in file_path)
+    census = census_corpus(directory, file_paths, args.first_year, args.last_year, args.lexemes, args.min_volumes, args.workers)
+    census.save(directory+args.output, shards=file_paths, lexemes_only=args.lexemes)
+    for year in args.year:
+        print(census.format_year(year))
+        print()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# # Lexicon size over time
+#
+# `Size of language over time.ipynb` gets the size of the lexicon of a window by calling `main(directory, t_start, t_end, t_step)`,
+# which reloads every `-COMPLETE.json` and checks `0 not in frequency_list` for every word, so a curve of sizes costs one pass over the corpus per window.
+# Only the size is needed for a curve, and a word is in the lexicon of a window exactly when it has no zero year in it:
+# - the corpus is read once (from the stores when they exist, like `create_lexicon.py`) into a words x years matrix of zero years per chunk of words
+# - the prefix sums of the zero years along each row give the number of zero years of any window with two lookups,
+#   so the sizes of all the windows of all the lengths are a few whole-array operations per chunk
+# - with smoothing (the `t_step` of `create_lexicon.py`), a smoothed year is zero when all the years of its centered smoothing window are zero,
+#   which is again a windowed sum of the zero years, so the sizes are the same as the lexicons `create_lexicon.main()` would create
+# - the windows of each word are kept as packed bits (one bit per window) only if the word is in at least one lexicon, and counted by POS tag at the end,
+#   so the size per tag comes with the total
+#
+# Usage:
+# `python lexicon_size.py C:\path\to\amer_unigram_data\ -w 10 25 50 --step 1` saves the sizes of every 10, 25 and 50 year window from 1800 to 2019
+# in LEXICON_SIZES_1800-2019_STEP1.json ({window length: {start_years, total, tags:{tag:sizes}}})
+
+import os
+import sys
+
+import numpy as np
+from tqdm import tqdm
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','Amer-v-Brit-Lexicon-Analysis'))
+#Reads the -COMPLETE.json files (or their stores) in chunks of words x years matrices
+from create_lexicon import shard_chunks, save_json, CHUNK_WORDS
+
+FIRST_YEAR = 1800
+LAST_YEAR = 2019
+
+def start_years(window_length, step=1, first_year=FIRST_YEAR, last_year=LAST_YEAR):
+    #First year of every window of window_length years that fits in first_year..last_year
+    return np.arange(first_year, last_year-window_length+2, step)
+
+def zero_windows(counts, t_step=1):
+    #Prefix sums along each row of the smoothed years that are zero (a smoothed year is zero when all the t_step years it averages are)
+    zero = counts == 0
+    if t_step > 1:
+        nonzero = np.zeros((counts.shape[0], counts.shape[1]+1), dtype=np.int32)
+        np.cumsum(~zero, axis=1, out=nonzero[:,1:])
+        zero = nonzero[:,t_step:] == nonzero[:,:-t_step]
+    prefix = np.zeros((zero.shape[0], zero.shape[1]+1), dtype=np.int32)
+    np.cumsum(zero, axis=1, out=prefix[:,1:])
+    return prefix
+
+def chunk_lexicons(counts, window_lengths, step=1, t_step=1, first_year=FIRST_YEAR):
+    #{window_length: words x start years boolean matrix}, True where the word of the row is in the lexicon of the window
+    prefix = zero_windows(counts, t_step)
+    last_year = first_year+counts.shape[1]-1
+    in_lexicon = dict()
+    for window_length in window_lengths:
+        n_starts = len(start_years(window_length, step, first_year, last_year))
+        #A window of window_length years has window_length-t_step+1 smoothed years, it is in the lexicon if none of them is zero
+        n_smoothed = window_length-t_step+1
+        in_lexicon[window_length] = prefix[:,n_smoothed:n_smoothed+step*n_starts:step] == prefix[:,:step*n_starts:step]
+    return in_lexicon
+
+def count_by_tag(tags, packed, n_starts):
+    #{tag: number of words in the lexicon of every window}, packed holds one row of packed bits per word, tags the tag of each word
+    tag_names, tag_ids = np.unique(tags, return_inverse=True)
+    order = np.argsort(tag_ids, kind='stable')
+    bounds = np.searchsorted(tag_ids[order], np.arange(len(tag_names)+1))
+    sizes = np.zeros((len(tag_names), n_starts), dtype=np.int64)
+    for tag_id in range(len(tag_names)):
+        rows = order[bounds[tag_id]:bounds[tag_id+1]]
+        for i in range(0, len(rows), CHUNK_WORDS):
+            sizes[tag_id] += np.unpackbits(packed[rows[i:i+CHUNK_WORDS]], axis=1, count=n_starts).sum(axis=0, dtype=np.int64)
+    return dict(zip(tag_names.tolist(), sizes))
+
+def lexicon_sizes(directory, window_lengths, step=1, t_step=1, first_year=FIRST_YEAR, last_year=LAST_YEAR):
+    '''
+    Size of the lexicon of every window of each length in window_lengths, the windows start every step years from first_year to the last one
+    that ends by last_year. t_step is the smoothing of create_lexicon.py (1 for none).
+    Every -COMPLETE.json of the directory is read once.
+    Returns {window_length: {'start_years':[...], 'total':[...], 'tags':{tag:[...]}}}.
+    '''
+    window_lengths = sorted(set(window_lengths))
+    for window_length in window_lengths:
+        if window_length < t_step or window_length > last_year-first_year+1:
+            raise ValueError('Windows of '+str(window_length)+' years do not fit in '+str(first_year)+'-'+str(last_year)+' with smoothing '+str(t_step))
+    #The same lemma can be in several shards, and like create_lexicon.py (which updates the lexicon with the sublexicon of every shard)
+    #it is in the lexicon of a window if it is in the sublexicon of any shard. So the windows of each word are kept as packed bits
+    #and OR-ed together by word at the end, only for the words that are in at least one lexicon
+    word_ids = dict()
+    parts = {window_length:[] for window_length in window_lengths}
+    for file_name in sorted(os.listdir(directory)):
+        if '-COMPLETE.json' in file_name:
+            for words, counts in tqdm(shard_chunks(directory, file_name, first_year, last_year), unit='chunk'):
+                in_lexicon = chunk_lexicons(counts, window_lengths, step, t_step, first_year)
+                rows = np.flatnonzero(np.any([windows.any(axis=1) for windows in in_lexicon.values()], axis=0))
+                ids = np.array([word_ids.setdefault(words[row], len(word_ids)) for row in rows.tolist()], dtype=np.int64)
+                for window_length, windows in in_lexicon.items():
+                    parts[window_length].append((ids, np.packbits(windows[rows], axis=1)))
+    tags = [word.rpartition('_')[2] for word in word_ids]
+
+    curves = dict()
+    for window_length in window_lengths:
+        starts = start_years(window_length, step, first_year, last_year)
+        ids = np.concatenate([ids for ids, packed in parts[window_length]]) if word_ids else np.zeros(0, dtype=np.int64)
+        packed = np.concatenate([packed for ids, packed in parts[window_length]]) if word_ids else np.zeros((0, 0), dtype=np.uint8)
+        #OR the rows of the same word together, the words come out in the order of their ids
+        order = np.argsort(ids, kind='stable')
+        firsts = np.flatnonzero(np.diff(ids[order], prepend=-1))
+        packed = np.bitwise_or.reduceat(packed[order], firsts, axis=0) if len(firsts) else packed
+        by_tag = {tag:sizes.tolist() for tag, sizes in count_by_tag(tags, packed, len(starts)).items()} if word_ids else dict()
+        total = np.sum(list(by_tag.values()), axis=0, dtype=np.int64) if by_tag else np.zeros(len(starts), dtype=np.int64)
+        curves[window_length] = {'start_years':starts.tolist(), 'total':total.tolist(), 'tags':by_tag}
+        del parts[window_length]
+    return curves
+
+if __name__ == '__main__':
+
+    import argparse
+    parser = argparse.ArgumentParser(description='Computes the size of the lexicon of every window of the given lengths in one pass over the -COMPLETE.json files')
+
+    parser.add_argument('path', type=str, help="absolute path to the directory with the -COMPLETE.json files")
+    parser.add_argument('-w', '--window-lengths', type=int, nargs='+', required=True, help="Lengths of the windows in years")
+    parser.add_argument('--step', type=int, required=False, default=1, help="Years between the starts of two windows. Default is 1")
+    parser.add_argument('-s', '--smoothing', type=int, required=False, default=1, help="Smoothing of the yearly counts, the t_step of create_lexicon.py. Default is 1 (none)")
+    parser.add_argument('-b', '--begin', type=int, required=False, default=FIRST_YEAR, help="First year of the windows. Default is "+str(FIRST_YEAR))
+    parser.add_argument('-e', '--end', type=int, required=False, default=LAST_YEAR, help="Last year of the windows. Default is "+str(LAST_YEAR))
+
+    args = parser.parse_args()
+    directory = args.path
+    if directory[-1] != '\\' and directory[-1] != '/':
+        directory += '/'
+
+    curves = lexicon_sizes(directory, args.window_lengths, args.step, args.smoothing, args.begin, args.end)
+    for window_length, curve in curves.items():
+        print('Windows of', window_length, 'years: size', min(curve['total']), 'to', max(curve['total']))
+    save_json(curves, directory, 'LEXICON_SIZES_'+str(args.begin)+'-'+str(args.end)+'_STEP'+str(args.smoothing))
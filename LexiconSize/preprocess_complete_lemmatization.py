@@ -128,36 +128,10 @@ def save_json(ngram_dict,directory,file_path):
 # In[ ]:
 
 
-def unigram_tests(unigram):
-    #Exclude words with more than one underscore, can make this != to only include tagged words
-    if len(underscore.findall(unigram))!=1:
-        return False
-    
-    #Checks each character in the unigram against the characters in the STOP set. (character level filtering) - no punctuation or digits allowed
-    if set(unigram).intersection(STOPS):
-        return False
-    
-    #Excluded all of the form _PRON_ (or anything that starts or ends with an underscore)
-    if unigram[0] == '_' or unigram[-1] == '_':
-        return False
-    
-    #must have a vowel (presupposes that it must also have a letter of the alphabet inside)
-    if not set(unigram).intersection(VOWELS):
-        return False 
-    
-    #Words cannot start or end with dashes
-    if unigram[0] in DASHES or unigram[-1] in DASHES:
-        return False
-    
-    #must have 0 non-english letters
-    test = unidecode(unigram, errors='replace')
-    if test != unigram:
-        return False
-    
-    #Can implement more tests here if you need to do more filtering
-    
-    else:
-        return True
+import sys
+#Compiled version of the lexeme tests, shared with the American vs British preprocessing (see lexeme_filter.py for the rules)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','Amer-v-Brit-Lexicon-Analysis'))
+from lexeme_filter import unigram_tests
 
 
 # In[ ]:
@@ -7,19 +7,30 @@
 # The purpose of this is to filter through the entire dataset without limiting years. It will create \*\-COMPLETE.json files. It can be used to find the size of the lexicon.
 
 import sys
-directory_absolute_path = sys.argv[1]
-
 import os
-import gzip
 import json
+import time
 #for progress bars
 from tqdm import tqdm
 
 from nltk import WordNetLemmatizer
 lemmatizer = WordNetLemmatizer()
 
-#For checking if the word has any non-English-alphabetical letters
-from unidecode import unidecode
+#Compiled version of the lexeme tests, shared with the American vs British preprocessing (see lexeme_filter.py for the rules)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','Amer-v-Brit-Lexicon-Analysis'))
+#Memoizes lemmatizer.lemmatize(word,pos), optionally persisted to disk with --lemma-cache
+from lemma_cache import LemmaCache, format_stats
+lemma_cache = LemmaCache(lemmatizer)
+#lexeme_rows() runs them on the raw bytes of the rows, so only the rows that pass are decoded
+from lexeme_filter import lexeme_rows
+#Parses the year,match_count,volume_count entries of all the lexemes of a block into typed arrays in one call
+from ngram_parser import records_from_entries_list
+#Records finished shards and checkpoints partial ones so an interrupted run can resume
+from shard_manifest import ShardManifest, ShardCheckpoint
+#Inflates the shards into line-aligned blocks of bytes
+from shard_pipeline import read_blocks, block_rows, merge_ngram_dicts, BLOCK_SIZE
+#Per-stage timers and rejection counters of each shard, saved next to its -COMPLETE.json
+from ingest_metrics import IngestMetrics, metrics_path, format_metrics
 
 import re
 #For the Google POS tagging mapping
@@ -48,70 +59,18 @@ underscore = re.compile('_{1}')
 # - _CONJ_	conjunction
 # - _PRT_	particle
 
-# Define sets which are going to be used in the unigram tests
-
-import string
-PUNCTUATION = set(char for char in string.punctuation).union({'“','”'})
-#ALPHABET = set(string.ascii_letters)
-
-DIGITS = set(string.digits)
-VOWELS = set("aeiouyAEIOUY")
-#Excluding '_' (underscore) from DASHES precludes the tagged 1grams "_NOUN", add it to also include the tagged 1grams
-DASHES = {'—','–','—','―','‒','-','_'}
-PUNCTUATION.difference_update(DASHES)
-STOPS = PUNCTUATION.union(DIGITS)
 #GOOGLE_TAGS = {'_NOUN','_VERB','_ADJ','_ADV','_PRON','_DET','_ADP','_NUM','_CONJ','_PRT'}
 
-def open_gzip(directory,file_path):
-    with gzip.open(directory+file_path,'r') as f_in:
-        rows = [x.decode('utf8').strip() for x in f_in.readlines()]
-    return rows
-
 def save_json(ngram_dict,directory,file_path):
     output = file_path[:-3]+'-COMPLETE.json'
     if len(ngram_dict)>0:
         with open(directory+output, 'w') as f_out:
             json.dump(ngram_dict, f_out)
         print('SAVED: ',output,len(ngram_dict))
+        return output
     else:
         print('unigram dict empty',output)
 
-def csv2tuple(string):
-    year,match_count,volume_count = tuple(string.split(','))
-    return int(year),int(match_count),int(volume_count)
-
-
-def unigram_tests(unigram):
-    #Exclude words with more than one underscore, can make this != to only include tagged words
-    if len(underscore.findall(unigram))!=1:
-        return False
-    
-    #Checks each character in the unigram against the characters in the STOP set. (character level filtering) - no punctuation or digits allowed
-    if set(unigram).intersection(STOPS):
-        return False
-    
-    #Excluded all of the form _PRON_ (or anything that starts or ends with an underscore)
-    if unigram[0] == '_' or unigram[-1] == '_':
-        return False
-    
-    #must have a vowel (presupposes that it must also have a letter of the alphabet inside)
-    if not set(unigram).intersection(VOWELS):
-        return False 
-    
-    #Words cannot start or end with dashes
-    if unigram[0] in DASHES or unigram[-1] in DASHES:
-        return False
-    
-    #must have 0 non-english letters
-    test = unidecode(unigram, errors='replace')
-    if test != unigram:
-        return False
-    
-    #Can implement more tests here if you need to do more filtering
-    
-    else:
-        return True
-
 #maps Google pos_tag to Wordnet pos_tag
 def POS_mapper(pos_tag):
     if pos_tag == 'NOUN':
@@ -125,61 +84,164 @@ def POS_mapper(pos_tag):
     else:
         return "n" #Default for wordnet lemmatizer
 
-def preprocess_ngrams(directory,file_path):
+#Bump when a change to the preprocessing changes its output, so the shards preprocessed before are not skipped by the manifest
+PREPROCESS_VERSION = 1
+MANIFEST_NAME = 'complete-manifest.json'
+MANIFEST_PARAMS = {'version':PREPROCESS_VERSION, 'output':'-COMPLETE.json'}
+RUN_METRICS_NAME = 'complete-metrics.json'
+
+def lemmatize_unigram(unigram):
+    pos = "n" #Default for wordnet lemmatizer
+    word_tag = underscore.split(unigram) # list of [word,tag]
+    
+    #maps Google tag to Wordnet tag
+    pos = POS_mapper(word_tag[1])
     
-    #rows = open_gzip(directory,file_path)
-    ngram_dict = dict()
+    #Removes the tag before processing unigram string
+    unigram = word_tag[0]
+    
+    #Lemmatize based on POS
+    unigram = lemma_cache.lemmatize(unigram.lower().strip(),pos)
+    
+    #Adds the tag back onto the unigram
+    return unigram+'_'+word_tag[1]
+
+def preprocess_block(block, ngram_dict, metrics):
+    #Filters, lemmatizes and parses a line-aligned block of raw bytes into ngram_dict, each stage is timed once per block (see ingest_metrics.py)
+    #unigram is the first entry, the rest of the entries are of the form year,match_count,volume_count\t n times, where n is variable each line
+    #Only the rows whose unigram passes the word tests come out of the block, to be parsed and lemmatized
+    metrics.lap('filter')
+    metrics.count('rows', block_rows(block))
+    lexemes = list(lexeme_rows(block, metrics.rejections))
+    metrics.count('lexemes', len(lexemes))
+
+    metrics.lap('lemmatize')
+    unigrams = [lemmatize_unigram(unigram) for unigram, entries in lexemes]
+
+    #Parse all the entries of each row at once and create a dictionary of records in form {year:match_count}
+    #Only years with volume_count>1 are kept, because only words in >1 volume are reasonably assumed to be used by >1 person
+    metrics.lap('parse')
+    all_records = records_from_entries_list([entries for unigram, entries in lexemes])
+    n_entries = sum(entries.count('\t')+1 for unigram, entries in lexemes if entries)
+    metrics.count('entries', n_entries)
+    metrics.count('entries_dropped', n_entries-sum(map(len, all_records)))
+
+    metrics.lap('merge')
+    for unigram, records in zip(unigrams, all_records):
+        #Modify the dictionary if new entry is already there, else just add it as a new unigram:records to the dict
+        if unigram in ngram_dict.keys():
+            #accessing the ngram dictionary and seeing if each year is present, if so add match count, else add a new record entry to the dictionary.
+            for yr, match_ct in records.items(): #each record should be of the form {year:match_count}
+                #If the year in the new record is in the dict for this 1gram, then find where it is.
+                if yr in ngram_dict[unigram].keys():
+                    ngram_dict[unigram][yr] += match_ct
+                else:
+                    #This just adds the record to the end, will need to sort later
+                    ngram_dict[unigram][yr] = match_ct
+        else:
+            ngram_dict[unigram] = records
+    return ngram_dict
+
+def preprocess_block_metrics(block):
+    #Pipeline stage run by the workers, the metrics of the block and what the worker's lemma cache learned from it (see LemmaCache.delta())
+    #are sent back with its partial dictionary
+    metrics = IngestMetrics()
+    ngram_dict = preprocess_block(block, dict(), metrics)
+    metrics.lap()
+    return ngram_dict, metrics.to_dict(), lemma_cache.delta()
+
+def preprocess_ngrams(directory,file_path,lemma_cache_path=None,workers=1):
+    #With lemma_cache_path (when the shards are preprocessed in parallel), the lemma cache is loaded from that file first and merged back into it at the end
+    #With workers>1 the shard is pipelined: it is inflated in blocks which are preprocessed by a pool of workers and merged in file order (see shard_pipeline.py)
+    
+    start = time.perf_counter()
+    if lemma_cache_path:
+        lemma_cache.load(lemma_cache_path)
+    lemma_cache.reset_stats()
+    #Each stage runs over a whole block at once, so it is timed once per block (see ingest_metrics.py)
+    metrics = IngestMetrics()
+    #Resumes from the checkpoint of an interrupted run of this shard, if there is one, and checkpoints the dictionary periodically
+    checkpoint = ShardCheckpoint(directory, file_path, MANIFEST_PARAMS)
 
     #This implementation uses {1gram:{year:match_count ...} ...}
-    i=0
-    for row in tqdm(open_gzip(directory,file_path)):
-        columns = row.split('\t')
-        #unigram is the first entry, the rest of the entries are of the form year,match_count,volume_count\t n times, where n is variable each line
-        
-        unigram = columns[0]
-        #If it passes the word tests continue parsing and lemmatizing the unigram
-        if unigram_tests(unigram):
-            pos = "n" #Default for wordnet lemmatizer
-            word_tag = underscore.split(unigram) # list of [word,tag]
-            
-            #maps Google tag to Wordnet tag
-            pos = POS_mapper(word_tag[1])
-            
-            #Removes the tag before processing unigram string
-            unigram = word_tag[0]
-            
-            #Lemmatize based on POS
-            unigram = lemmatizer.lemmatize(unigram.lower().strip(),pos)
-            
-            #Adds the tag back onto the unigram
-            unigram+='_'+word_tag[1]
-            
-            #Parse the new entry and create a dictionary of records in form {year:match_count}
-            records = dict()
-            for entry in columns[1:]:
-                year,match_count,volume_count = csv2tuple(str(entry))
-                #This is the crucial filtering by volume count because only words in >1 volume are reasonably assumed to be used by >1 person
-                #Words only used by one person - which translates the computational parameter 1 volume - are not considered part of the lexicon
-                if volume_count>1:
-                    records[year] = match_count
-
-            #Modify the dictionary if new entry is already there, else just add it as a new unigram:records to the dict
-            if unigram in ngram_dict.keys():
-                #accessing the ngram dictionary and seeing if each year is present, if so add match count, else add a new record entry to the dictionary.
-                for yr, match_ct in records.items(): #each record should be of the form {year:match_count}
-                    #If the year in the new record is in the dict for this 1gram, then find where it is.
-                    if yr in ngram_dict[unigram].keys():
-                        ngram_dict[unigram][yr] += match_ct
-                    else:
-                        #This just adds the record to the end, will need to sort later
-                        ngram_dict[unigram][yr] = match_ct
-            else:
-                ngram_dict[unigram] = records
+    if workers>1:
+        from shard_pipeline import run_pipeline
+        def merge_fn(ngram_dict, result):
+            #The timers of the workers add up to more than the wall time, the time they wait for the blocks to be inflated is not counted
+            #The lookups happen in the workers, their stats and new entries are merged into this process' lemma cache
+            partial_dict, block_metrics, cache_delta = result
+            metrics.merge(block_metrics)
+            lemma_cache.merge(cache_delta)
+            metrics.lap('merge')
+            merge_ngram_dicts(ngram_dict, partial_dict)
+            metrics.lap()
+        ngram_dict = run_pipeline(directory, file_path, preprocess_block_metrics, workers=workers, checkpoint=checkpoint, merge_fn=merge_fn)
+    else:
+        ngram_dict = checkpoint.resume('blocks of '+str(BLOCK_SIZE))
+        metrics.lap('decompress')
+        for block in tqdm(checkpoint.skip(read_blocks(directory,file_path)), desc=file_path, unit='block', initial=checkpoint.position):
+            preprocess_block(block, ngram_dict, metrics)
+            metrics.lap('checkpoint')
+            checkpoint.advance(ngram_dict, block_rows(block))
+            metrics.lap('decompress')
     #Save as JSON
-    save_json(ngram_dict,directory,file_path)
+    metrics.lap('save')
+    output = save_json(ngram_dict,directory,file_path)
+    checkpoint.remove()
+    if lemma_cache_path:
+        lemma_cache.save(lemma_cache_path)
+    metrics.save(metrics_path(directory, file_path, MANIFEST_PARAMS['output']), shard=file_path, output=output, ngrams=len(ngram_dict), wall_time=time.perf_counter()-start, lemma_cache=lemma_cache.stats())
+    print(format_metrics(metrics))
+    return {'output':output, 'rows':checkpoint.rows, 'ngrams':len(ngram_dict), 'metrics':metrics.to_dict(), 'lemma_cache':lemma_cache.stats()}
 
 #Run from command line
-files = os.listdir(os.path.abspath(directory_absolute_path))
-for file_path in files:
-    if '.gz' in file_path and not '.json' in file_path:
-        preprocess_ngrams(directory_absolute_path,file_path)
\ No newline at end of file
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Preprocesses every Google Ngrams shard in a directory into *-COMPLETE.json files')
+
+    parser.add_argument('path', type=str, help="absolute path to the directory with the raw *.gz files")
+    parser.add_argument('workers', type=int, nargs='?', default=1, help="Number of worker processes, each worker preprocesses and saves one shard at a time. Default is 1 (serial).")
+    parser.add_argument('--block-workers', type=int, required=False, default=1, help="Number of workers used to pipeline each shard (each of the workers above runs its own pool). Default is 1 (serial).")
+    parser.add_argument('--lemma-cache', type=str, required=False, default=None, help="File used to persist the lemmatization cache between runs and share it between workers")
+
+    args = parser.parse_args()
+    directory_absolute_path = args.path
+    if directory_absolute_path[-1] != '\\' and directory_absolute_path[-1] != '/':
+        directory_absolute_path += '/'
+    workers = args.workers
+    #Shards that are done (same input, same parameters, output still there) are skipped, delete the manifest to preprocess everything again
+    manifest = ShardManifest(directory_absolute_path, MANIFEST_NAME, MANIFEST_PARAMS)
+    run_start = time.perf_counter()
+
+    if workers>1:
+        #The parallel driver lives next to the American vs British preprocessing
+        from functools import partial
+        from parallel_preprocess import run_shards, list_shards
+        worker = partial(preprocess_ngrams, lemma_cache_path=args.lemma_cache, workers=args.block_workers)
+        completed, failed = run_shards(directory_absolute_path, list_shards(directory_absolute_path), worker=worker, workers=workers, manifest=manifest)
+    else:
+        if args.lemma_cache:
+            print('Loaded', lemma_cache.load(args.lemma_cache), 'cached lemmas')
+        completed, failed = dict(), dict()
+        files = os.listdir(os.path.abspath(directory_absolute_path))
+        for file_path in files:
+            if '.gz' in file_path and not '.json' in file_path:
+                if manifest.is_done(file_path):
+                    print('SKIPPED: ',file_path)
+                    continue
+                result = preprocess_ngrams(directory_absolute_path,file_path,workers=args.block_workers)
+                manifest.finish(file_path, result['output'], result['rows'], result['ngrams'])
+                completed[file_path] = result
+                if args.lemma_cache:
+                    lemma_cache.save(args.lemma_cache)
+
+    #Totals of the shards preprocessed by this run
+    run_metrics = IngestMetrics()
+    lemma_totals = {'hits':0, 'misses':0, 'evictions':0}
+    for result in completed.values():
+        run_metrics.merge(result['metrics'])
+        for stat in lemma_totals:
+            lemma_totals[stat] += result['lemma_cache'][stat]
+    run_metrics.save(os.path.join(directory_absolute_path, RUN_METRICS_NAME), shards=sorted(completed), failed=sorted(failed), wall_time=time.perf_counter()-run_start, lemma_cache=lemma_totals)
+    print(format_metrics(run_metrics))
+    print(format_stats(lemma_totals))
@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# # Zipf's law lexicon size estimator
+#
+# Estimates the size of the lexicon from the rank-frequency distribution of the words, following
+# [Estimating Lexicon Size Based upon Zipf’s Law](https://www.depts.ttu.edu/true/urc/2020/poster-files/poster_Kariampuzha.pdf):
+# - Zipf's law: the r-th most frequent word is used $f(r) = C / r^s$ times
+# - Zipf–Mandelbrot: $f(r) = C / (r+q)^s$, which flattens the head of the distribution
+# - the estimated size is the rank at which the fitted law falls to one use, $N = C^{1/s} - q$ (q = 0 for Zipf's law)
+#
+# The rank-frequency arrays of every year (or every window of `window` years) of every corpus are built from the preprocessed counts
+# (`-COMPLETE.json` files or their stores) in one pass over each corpus, with the counts of a lemma that is in several shards added up.
+# All of them are then fitted together: the log-log least squares fit of every (corpus, window) is a handful of weighted `np.bincount` sums
+# over one flat array of ranks and counts, and Zipf–Mandelbrot repeats it for every shift q of a grid and keeps the best q of each fit.
+# The estimates are reported beside the number of distinct words used in the window and the size of the lexicon `create_lexicon.py`
+# would create for it (the words used in every year of the window, see lexicon_size.py).
+#
+# Usage:
+# `python zipf_estimator.py -c AMER ../Ngrams/amer_unigram_data/ -c BRIT ../Ngrams/brit_unigram_data/ -o ZIPF` fits every year from 1800 to 2019
+# of both corpora and saves `ZIPF.csv` in the current directory (`-w 10` fits windows of 10 years instead)
+
+import os
+import csv
+import sys
+
+import numpy as np
+from tqdm import tqdm
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','Amer-v-Brit-Lexicon-Analysis'))
+#Reads the -COMPLETE.json files (or their stores) in chunks of words x years matrices
+from create_lexicon import shard_chunks
+from lexicon_size import lexicon_sizes, FIRST_YEAR, LAST_YEAR
+
+#Shifts q tried for the Zipf–Mandelbrot fits
+SHIFTS = (0, 0.5, 1, 2, 3, 5, 7.5, 10, 15, 20, 30, 50, 75, 100, 150, 200, 300)
+COLUMNS = ('corpus', 't_start', 't_end', 'tokens', 'types', 'lexicon_size',
+           'zipf_exponent', 'zipf_constant', 'zipf_r2', 'zipf_size',
+           'zm_exponent', 'zm_shift', 'zm_constant', 'zm_r2', 'zm_size')
+
+def window_counts(directory, window=1, first_year=FIRST_YEAR, last_year=LAST_YEAR):
+    '''
+    Match counts of every word in every window of window years from first_year (the last incomplete window is left out).
+    Returns (windows, counts), the words that are used in window windows[i] have counts[i] (an int64 array, not sorted).
+    '''
+    n_windows = (last_year-first_year+1)//window
+    word_ids = dict()
+    keys, values = [], []
+    for file_name in sorted(os.listdir(directory)):
+        if '-COMPLETE.json' in file_name:
+            for words, counts in tqdm(shard_chunks(directory, file_name, first_year, first_year+n_windows*window-1), unit='chunk'):
+                sums = counts.reshape(len(words), n_windows, window).sum(axis=2)
+                rows, windows = np.nonzero(sums)
+                ids = np.array([word_ids.setdefault(word, len(word_ids)) for word in words], dtype=np.int64)
+                keys.append(ids[rows]*n_windows+windows)
+                values.append(sums[rows, windows])
+    keys = np.concatenate(keys) if keys else np.zeros(0, dtype=np.int64)
+    values = np.concatenate(values) if values else np.zeros(0, dtype=np.int64)
+    #A lemma can be in several shards, its counts are added up
+    keys, inverse = np.unique(keys, return_inverse=True)
+    values = np.bincount(inverse, weights=values, minlength=len(keys)).round().astype(np.int64)
+    return keys % n_windows, values
+
+def rank_frequency(segments, counts):
+    #Sorts the counts of every segment in decreasing order, returns segments, ranks (from 1) and counts in that order
+    order = np.lexsort((-counts, segments))
+    segments, counts = segments[order], counts[order]
+    starts = np.flatnonzero(np.diff(segments, prepend=-1))
+    ranks = np.arange(1, len(segments)+1)-np.repeat(starts, np.diff(np.append(starts, len(segments))))
+    return segments, ranks, counts
+
+def _sums(segments, values, n_segments):
+    return np.bincount(segments, values, n_segments)
+
+def _least_squares(segments, x, y_sums, n_segments):
+    '''
+    Fits y = intercept + slope*x for every segment at once, y_sums are the (n, sum of y, sum of y*y, y) of every segment, which do not depend on x.
+    Returns intercepts, slopes and the residual sum of squares of every segment.
+    '''
+    n, sy, syy, y = y_sums
+    sx, sxx, sxy = _sums(segments, x, n_segments), _sums(segments, x*x, n_segments), _sums(segments, x*y, n_segments)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slopes = (n*sxy-sx*sy)/(n*sxx-sx*sx)
+        intercepts = (sy-slopes*sx)/n
+    residual = np.maximum(syy-2*intercepts*sy-2*slopes*sxy+n*intercepts**2+2*intercepts*slopes*sx+slopes**2*sxx, 0)
+    return intercepts, slopes, residual
+
+def _estimate(intercepts, slopes, shifts):
+    #Exponent s, constant C and the rank N = C^(1/s) - q at which the fitted law falls to one use
+    exponents = -slopes
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        sizes = np.where(exponents > 0, np.exp(intercepts/exponents)-shifts, np.nan)
+    return exponents, np.exp(intercepts), sizes
+
+def fit_zipf(segments, ranks, counts, n_segments, shifts=SHIFTS):
+    '''
+    Fits Zipf's law and Zipf–Mandelbrot to the rank-frequency arrays of all the segments at once.
+    Returns {'zipf_...': array, 'zm_...': array} with one value per segment (nan where a segment has fewer than 2 words).
+    '''
+    y = np.log(counts.astype(float))
+    n, sy = np.bincount(segments, minlength=n_segments).astype(float), _sums(segments, y, n_segments)
+    y_sums = (n, sy, _sums(segments, y*y, n_segments), y)
+    total = y_sums[2]-sy*sy/np.maximum(n, 1)
+    log_ranks = np.log(ranks.astype(float))
+
+    intercepts, slopes, residual = _least_squares(segments, log_ranks, y_sums, n_segments)
+    fits = dict(zip(('zipf_exponent', 'zipf_constant', 'zipf_size'), _estimate(intercepts, slopes, 0)))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        fits['zipf_r2'] = 1-residual/total
+
+    #Grid search of the shift, the best one of every segment is kept
+    best = None
+    for shift in shifts:
+        fit = _least_squares(segments, np.log(ranks+float(shift)) if shift else log_ranks, y_sums, n_segments)+(np.full(n_segments, float(shift)),)
+        if best is None:
+            best = fit
+        else:
+            better = fit[2] < best[2]
+            best = tuple(np.where(better, new, old) for new, old in zip(fit, best))
+    intercepts, slopes, residual, best_shifts = best
+    fits.update(zip(('zm_exponent', 'zm_constant', 'zm_size'), _estimate(intercepts, slopes, best_shifts)))
+    fits['zm_shift'] = best_shifts
+    with np.errstate(divide='ignore', invalid='ignore'):
+        fits['zm_r2'] = 1-residual/total
+    return fits
+
+def zipf_table(corpora, window=1, first_year=FIRST_YEAR, last_year=LAST_YEAR, shifts=SHIFTS):
+    '''
+    Fits every window of every corpus ({name: directory of the -COMPLETE.json files}) in one batch.
+    Returns the rows of the table, one per corpus and window.
+    '''
+    n_windows = (last_year-first_year+1)//window
+    segments, counts, lexicons = [], [], dict()
+    for i, (name, directory) in enumerate(corpora.items()):
+        print('Reading', name)
+        windows, corpus_counts = window_counts(directory, window, first_year, last_year)
+        segments.append(i*n_windows+windows)
+        counts.append(corpus_counts)
+        lexicons[name] = lexicon_sizes(directory, [window], window, 1, first_year, first_year+n_windows*window-1)[window]['total']
+    segments, ranks, counts = rank_frequency(np.concatenate(segments), np.concatenate(counts))
+    n_segments = len(corpora)*n_windows
+    fits = fit_zipf(segments, ranks, counts, n_segments, shifts)
+    tokens = np.bincount(segments, weights=counts, minlength=n_segments)
+    types = np.bincount(segments, minlength=n_segments)
+
+    rows = []
+    for i, name in enumerate(corpora):
+        for j in range(n_windows):
+            segment = i*n_windows+j
+            row = {'corpus':name, 't_start':first_year+j*window, 't_end':first_year+(j+1)*window-1,
+                   'tokens':int(tokens[segment]), 'types':int(types[segment]), 'lexicon_size':lexicons[name][j]}
+            row.update({column:float(values[segment]) for column, values in fits.items()})
+            rows.append(row)
+    return rows
+
+def save_table(rows, file_path):
+    with open(file_path, 'w', newline='') as f_out:
+        writer = csv.DictWriter(f_out, fieldnames=COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
+    print('SAVED: ', file_path, len(rows))
+
+if __name__ == '__main__':
+
+    import argparse
+    parser = argparse.ArgumentParser(description="Estimates the size of the lexicon of every year (or window) of one or more corpora from Zipf's law")
+
+    parser.add_argument('-c', '--corpus', nargs=2, action='append', required=True, metavar=('NAME', 'DIRECTORY'), help="Name and directory of the -COMPLETE.json files of a corpus, can be repeated")
+    parser.add_argument('-w', '--window', type=int, required=False, default=1, help="Years per fitted window. Default is 1 (every year)")
+    parser.add_argument('-b', '--begin', type=int, required=False, default=FIRST_YEAR, help="First year. Default is "+str(FIRST_YEAR))
+    parser.add_argument('-e', '--end', type=int, required=False, default=LAST_YEAR, help="Last year. Default is "+str(LAST_YEAR))
+    parser.add_argument('--shifts', type=float, nargs='+', required=False, default=SHIFTS, help="Shifts q tried for the Zipf–Mandelbrot fits. Default is "+' '.join(str(shift) for shift in SHIFTS))
+    parser.add_argument('-o', '--output', type=str, required=False, default='ZIPF', help="Name of the saved table (without .csv). Default is ZIPF")
+
+    args = parser.parse_args()
+    corpora = dict()
+    for name, directory in args.corpus:
+        if directory[-1] != '\\' and directory[-1] != '/':
+            directory += '/'
+        corpora[name] = directory
+    save_table(zipf_table(corpora, args.window, args.begin, args.end, args.shifts), args.output+'.csv')